@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the analyze_code_changes diff backends.
+
+Generates synthetic "generated/vendored"-style files (many repeated lines such as blank lines,
+closing braces and boilerplate returns) at several sizes, applies ~1% scattered edits plus one
+larger rewritten region, and times each backend on HEAD-vs-staged line lists.
+
+Usage:
+    python benchmarks/bench_diff.py                      # 1k / 10k / 100k lines, all backends
+    python benchmarks/bench_diff.py --sizes 1000 20000   # custom sizes
+    python benchmarks/bench_diff.py --difflib-timeout 30 # skip difflib above the first size exceeding 30 s
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from green_code_analyzer.diff_utils import compute_diff_opcodes
+
+REPEATED_LINES = ["", "    }", "}", "    return None", "        pass", "    # ---", "        i += 1"]
+
+
+def generate_lines(line_count, rng):
+    """Synthetic source: roughly half the lines are repeated boilerplate, the rest unique statements."""
+    lines = []
+    for index in range(line_count):
+        if rng.random() < 0.5:
+            lines.append(rng.choice(REPEATED_LINES))
+        else:
+            lines.append(f"    value_{index} = compute({index}, {rng.randint(0, 999)})")
+    return lines
+
+
+def mutate_lines(lines, rng, edit_ratio=0.01):
+    """Scattered single-line edits/inserts/deletes plus one rewritten 2% region."""
+    mutated = list(lines)
+    for _ in range(max(1, int(len(lines) * edit_ratio))):
+        position = rng.randrange(len(mutated))
+        choice = rng.random()
+        if choice < 0.4:
+            mutated[position] = mutated[position] + "  # edited"
+        elif choice < 0.7:
+            mutated.insert(position, f"    inserted_{position} = True")
+        else:
+            del mutated[position]
+    start = rng.randrange(len(mutated))
+    for offset in range(start, min(len(mutated), start + max(1, len(mutated) // 50))):
+        mutated[offset] = f"    rewritten_{offset}()" if offset % 3 else "}"
+    return mutated
+
+
+def time_backend(backend, original, staged):
+    started = time.perf_counter()
+    opcodes, used = compute_diff_opcodes(original, staged, backend)
+    elapsed = time.perf_counter() - started
+    changed = sum(1 for op in opcodes if op[0] != 'equal')
+    return elapsed, changed, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark diff backends used by analyze_code_changes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Line counts to test.")
+    parser.add_argument("--backends", nargs="+", default=["difflib", "patience"], help="Backends to compare.")
+    parser.add_argument("--difflib-timeout", type=float, default=120.0,
+                        help="Stop running difflib on larger sizes once one run exceeds this many seconds.")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    skip_difflib = False
+    print(f"{'lines':>8} | {'backend':<9} | {'seconds':>9} | {'blocks':>6}")
+    print("-" * 42)
+    for size in args.sizes:
+        original = generate_lines(size, rng)
+        staged = mutate_lines(original, rng)
+        for backend in args.backends:
+            if backend == "difflib" and skip_difflib:
+                print(f"{size:>8} | {backend:<9} | {'skipped':>9} | {'-':>6}")
+                continue
+            elapsed, changed, used = time_backend(backend, original, staged)
+            print(f"{size:>8} | {used:<9} | {elapsed:>9.3f} | {changed:>6}")
+            if backend == "difflib" and elapsed > args.difflib_timeout:
+                skip_difflib = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end hook latency benchmark against the offline mock LLM server.
+
+Every run builds a throwaway Git repository of a given shape (file count, file size, language
+mix, edit shape), commits the HEAD version, stages an edited version and then either
+  - calls analyze_files_for_sustainability for the staged files in-process, exactly as
+    'main.py --staged' does (default), recording wall time per stage and subprocess counts, or
+  - runs the real .husky/pre-commit script (--hook), recording end-to-end wall time including
+    interpreter start-up.
+Stage times are the summed time of the outermost call into each stage's functions (LLM requests
+of one file may overlap, so 'llm' can exceed the wall time). Each scenario is run --repeat times
+and reported as p50/p95. Results are written as JSON; --compare flags scenarios whose p50 wall
+time regressed by more than --threshold against an earlier result file (exit code 1).
+
+Usage:
+    python benchmarks/bench_hook.py --quick                              # small scenarios only
+    python benchmarks/bench_hook.py --repeat 5 --output hook_latency.json
+    python benchmarks/bench_hook.py --compare hook_latency.json           # fail on regressions
+    python benchmarks/bench_hook.py --hook --scenarios many-small-files
+"""
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_llm_server
+
+# name -> (file count, lines per file, languages cycled over the files, edit shape)
+SCENARIOS = {
+    'one-small-file':        (1, 50, ('python',), 'hunks'),
+    'many-small-files':      (100, 50, ('python', 'javascript', 'c'), 'hunks'),
+    'large-file-hunks':      (1, 20000, ('python',), 'hunks'),
+    'large-file-rewrite':    (1, 20000, ('python',), 'rewrite'),
+    'mixed-medium-rewrite':  (12, 800, ('python', 'javascript', 'c'), 'rewrite'),
+}
+QUICK_SCENARIOS = ('one-small-file', 'many-small-files', 'mixed-medium-rewrite')
+EXTENSIONS = {'python': '.py', 'javascript': '.js', 'c': '.c'}
+HUNK_EVERY = 40 # 'hunks' edits one line in this many
+REWRITE_RATIO = 0.3 # 'rewrite' replaces this fraction of the file in one region
+
+# Stage -> main.py functions whose (outermost) calls are timed
+STAGE_FUNCTIONS = {
+    'git': ('get_staged_file_paths', 'get_staged_file_content', 'get_head_file_content', 'analyze_code_changes'),
+    'metrics': ('precompute_batch_metrics', 'get_metrics_for_content'),
+    'llm': ('request_llm_completion',),
+    'syntax_check': ('check_python_syntax',),
+}
+
+
+def source_unit(language, index, variant=0):
+    """One small function (7 lines) in `language`; variant changes its body like an edit would."""
+    factor = 2 + variant
+    if language == 'python':
+        return [f"def compute_{index}(values):", "    result = []", "    for i in range(len(values)):",
+                f"        result.append(values[i] * {factor})", "    return result", "", ""]
+    if language == 'javascript':
+        return [f"function compute{index}(values) {{", "  const result = [];",
+                "  for (let i = 0; i < values.length; i++) {", f"    result.push(values[i] * {factor});",
+                "  }", "  return result;", "}"]
+    return [f"int compute_{index}(const int *values, int count, int *out) {{", "  int i;",
+            "  for (i = 0; i < count; i++) {", f"    out[i] = values[i] * {factor};", "  }", "  return count;", "}"]
+
+
+def generate_source(language, line_count, variant_for=lambda index: 0):
+    lines = []
+    index = 0
+    while len(lines) < line_count:
+        lines.extend(source_unit(language, index, variant_for(index)))
+        index += 1
+    return '\n'.join(lines) + '\n'
+
+
+def staged_source(language, line_count, edit_shape, rng):
+    """The edited (staged) version: scattered one-line hunks, or one rewritten region."""
+    unit_count = -(-line_count // 7)
+    if edit_shape == 'hunks':
+        edited = {index for index in range(unit_count) if rng.random() < 7 / HUNK_EVERY}
+        return generate_source(language, line_count, lambda index: 1 if index in edited else 0)
+    start = rng.randrange(max(1, int(unit_count * (1 - REWRITE_RATIO))))
+    end = start + max(1, int(unit_count * REWRITE_RATIO))
+    return generate_source(language, line_count, lambda index: 1 if start <= index < end else 0)
+
+
+def git(repo, *args):
+    subprocess.run(["git", *args], cwd=repo, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def build_repo(scenario, rng):
+    """Temporary repository with the scenario's files committed and their edited versions staged."""
+    file_count, line_count, languages, edit_shape = SCENARIOS[scenario]
+    repo = tempfile.mkdtemp(prefix=f"bench_hook_{scenario}_")
+    git(repo, "init", "-q")
+    git(repo, "config", "user.email", "bench@example.com")
+    git(repo, "config", "user.name", "bench")
+    paths = []
+    for index in range(file_count):
+        language = languages[index % len(languages)]
+        path = os.path.join("src", f"module_{index}{EXTENSIONS[language]}")
+        os.makedirs(os.path.join(repo, "src"), exist_ok=True)
+        with open(os.path.join(repo, path), 'w', encoding='utf-8') as source_file:
+            source_file.write(generate_source(language, line_count))
+        paths.append((path, language))
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "HEAD")
+    for path, language in paths:
+        with open(os.path.join(repo, path), 'w', encoding='utf-8') as source_file:
+            source_file.write(staged_source(language, line_count, edit_shape, rng))
+    git(repo, "add", "-A")
+    with open(os.path.join(repo, "api_key.txt"), 'w', encoding='utf-8') as key_file:
+        key_file.write("mock-key\n")
+    return repo
+
+
+class StageRecorder:
+    """Times the outermost call per thread into each stage's functions, and counts subprocesses."""
+
+    def __init__(self, main_module):
+        self.main = main_module
+        self.stage_seconds = {}
+        self.subprocesses = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._originals = []
+
+    def _wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+                if depth == 0:
+                    with self._lock:
+                        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + time.perf_counter() - started
+        return timed
+
+    def __enter__(self):
+        for stage, names in STAGE_FUNCTIONS.items():
+            for name in names:
+                original = getattr(self.main, name)
+                self._originals.append((self.main, name, original))
+                setattr(self.main, name, self._wrap(stage, original))
+        recorder = self
+        original_popen = subprocess.Popen
+
+        class CountingPopen(original_popen):
+            def __init__(self, args, *popen_args, **popen_kwargs):
+                command = args if isinstance(args, str) else args[0]
+                name = os.path.basename(str(command).split()[0])
+                if name == 'git' and not isinstance(args, str) and len(args) > 1:
+                    name = f"git {args[1]}"
+                with recorder._lock:
+                    recorder.subprocesses[name] = recorder.subprocesses.get(name, 0) + 1
+                super().__init__(args, *popen_args, **popen_kwargs)
+
+        self._originals.append((subprocess, 'Popen', original_popen))
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, name, original in reversed(self._originals):
+            setattr(module, name, original)
+        return False
+
+
+def reset_main_state(main_module):
+    """Forget the per-repository caches main.py keeps in module globals (they point into .git/)."""
+    main_module.close_git_snapshot()
+    main_module._LLM_CACHE = None
+    main_module._METRICS_CACHE = None
+    main_module._LATENCY_CACHE = None
+    main_module._LATENCY_TRACKERS.clear()
+    main_module._BATCH_METRICS.clear()
+    main_module.get_tracer().drain()
+
+
+def run_in_process(main_module, repo, options):
+    """One 'main.py --staged' run inside `repo`; returns (wall seconds, stage seconds, subprocesses, success)."""
+    previous_cwd = os.getcwd()
+    os.chdir(repo)
+    try:
+        reset_main_state(main_module)
+        log = io.StringIO()
+        with StageRecorder(main_module) as recorder, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            started = time.perf_counter()
+            staged_paths = main_module.get_staged_file_paths() or []
+            results = main_module.analyze_files_for_sustainability(
+                staged_paths, api_key_file=os.path.join(repo, "api_key.txt"), **options)
+            wall = time.perf_counter() - started
+        return wall, recorder.stage_seconds, recorder.subprocesses, bool(results) and all(results.values())
+    finally:
+        os.chdir(previous_cwd)
+
+
+def run_hook(repo, env, full_file):
+    """Runs a copy of .husky/pre-commit in `repo`, pointed at this checkout's main.py; returns (wall seconds, success)."""
+    with open(os.path.join(ROOT, ".husky", "pre-commit"), 'r', encoding='utf-8') as hook_file:
+        script = hook_file.read().replace('MAIN_SCRIPT="main.py"', f'MAIN_SCRIPT="{os.path.join(ROOT, "main.py")}"')
+    hook = os.path.join(tempfile.mkdtemp(prefix="bench_hook_script_"), "pre-commit")
+    with open(hook, 'w', encoding='utf-8') as hook_file:
+        hook_file.write(script)
+    hook_env = dict(env, ff="1" if full_file else "0")
+    started = time.perf_counter()
+    completed = subprocess.run(["sh", hook], cwd=repo, env=hook_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - started
+    shutil.rmtree(os.path.dirname(hook), ignore_errors=True)
+    return wall, completed.returncode == 0
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return round(ordered[int(rank) - 1], 4)
+
+
+def summarize(samples):
+    return {'p50': percentile(samples, 50), 'p95': percentile(samples, 95)}
+
+
+def compare_results(results, baseline_path, threshold):
+    """Prints p50 wall-time ratios against a previous result file; returns the regressed scenario names."""
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    regressed = []
+    print(f"\nComparison with {baseline_path} (regression threshold {threshold:.0%}):")
+    for scenario, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(scenario)
+        if not old or old.get('mode') != result['mode'] or not old['wall']['p50']:
+            print(f"  {scenario:<22} no comparable baseline")
+            continue
+        ratio = result['wall']['p50'] / old['wall']['p50']
+        flag = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"  {scenario:<22} p50 {old['wall']['p50']:.3f}s -> {result['wall']['p50']:.3f}s ({ratio:.2f}x) {flag}")
+        if ratio > 1 + threshold:
+            regressed.append(scenario)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hook latency across synthetic repositories, against the mock LLM server.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), help="Scenarios to run (default: all).")
+    parser.add_argument("--quick", action="store_true", help=f"Only {', '.join(QUICK_SCENARIOS)}.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario (fresh repository each time).")
+    parser.add_argument("--hook", action="store_true", help="Run the real .husky/pre-commit script instead of the in-process pipeline.")
+    parser.add_argument("--full-file", action="store_true", help="Full-file mode instead of --changes-only.")
+    parser.add_argument("--latency", default="fixed:0.05", help="Mock LLM latency spec (see mock_llm_server.py).")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of mock LLM requests answered with 429.")
+    parser.add_argument("--output", default="bench_hook_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Earlier --output file to check for regressions.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p50 wall-time increase for --compare.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--keep-repos", action="store_true", help="Do not delete the generated repositories.")
+    args = parser.parse_args()
+
+    mock_args = mock_llm_server.build_parser().parse_args(
+        ["--port", "0", "--latency", args.latency, "--rate-limit-rate", str(args.rate_limit_rate),
+         "--retry-after", "0.1", "--seed", str(args.seed)])
+    server = mock_llm_server.create_server(mock_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/openai/v1"
+    os.environ["GROQ_BASE_URL"] = base_url # Read by main.py at import time and by hook subprocesses
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    main_module = None
+    if not args.hook:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main as main_module
+    options = {'changes_only': not args.full_file, 'full_file_mode': args.full_file,
+               'use_llm_cache': False, 'measure_emissions': False}
+
+    scenarios = args.scenarios or (QUICK_SCENARIOS if args.quick else tuple(SCENARIOS))
+    rng = random.Random(args.seed)
+    results = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'mode': 'hook' if args.hook else 'in-process', 'full_file': args.full_file, 'repeat': args.repeat,
+                 'mock_latency': args.latency, 'mock_rate_limit_rate': args.rate_limit_rate},
+        'scenarios': {},
+    }
+    print(f"{'scenario':<22} | {'wall p50':>9} | {'wall p95':>9} | {'git':>7} | {'metrics':>7} | {'llm':>7} | {'subproc':>7} | ok")
+    print("-" * 90)
+    for scenario in scenarios:
+        walls, stages, subprocess_totals, subprocess_commands, failures = [], {}, [], {}, 0
+        for _ in range(args.repeat):
+            repo = build_repo(scenario, rng)
+            try:
+                if args.hook:
+                    wall, success = run_hook(repo, env, args.full_file)
+                else:
+                    wall, stage_seconds, subprocesses, success = run_in_process(main_module, repo, options)
+                    for stage in STAGE_FUNCTIONS:
+                        stages.setdefault(stage, []).append(stage_seconds.get(stage, 0.0))
+                    subprocess_totals.append(sum(subprocesses.values()))
+                    for command, count in subprocesses.items():
+                        subprocess_commands.setdefault(command, []).append(count)
+                walls.append(wall)
+                failures += not success
+            finally:
+                if not args.keep_repos:
+                    shutil.rmtree(repo, ignore_errors=True)
+        file_count, line_count, languages, edit_shape = SCENARIOS[scenario]
+        result = {'mode': results['meta']['mode'], 'files': file_count, 'lines_per_file': line_count,
+                  'languages': list(languages), 'edit_shape': edit_shape, 'runs': len(walls), 'failures': failures,
+                  'wall': summarize(walls)}
+        if not args.hook:
+            result['stages'] = {stage: summarize(samples) for stage, samples in stages.items()}
+            result['subprocesses'] = summarize(subprocess_totals)
+            result['subprocesses_by_command'] = {command: summarize(counts) for command, counts in sorted(subprocess_commands.items())}
+        results['scenarios'][scenario] = result
+        stage_p50 = {stage: (result.get('stages', {}).get(stage) or {}).get('p50') for stage in ('git', 'metrics', 'llm')}
+        print(f"{scenario:<22} | {result['wall']['p50']:>8.3f}s | {result['wall']['p95']:>8.3f}s | "
+              + " | ".join(f"{value:>6.3f}s" if value is not None else f"{'-':>7}" for value in stage_p50.values())
+              + f" | {(result.get('subprocesses') or {}).get('p50') or '-':>7} | {len(walls) - failures}/{len(walls)}")
+
+    results['mock_server'] = server.state.snapshot()
+    server.shutdown()
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        if compare_results(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Token counts for the change context of full-file prompts: the whole ORIGINAL (HEAD) file, as
+sent before, vs the compact unified diff from build_change_context.
+
+Each given file plays the HEAD version; the staged version gets a commit-sized set of scattered
+edits (changed, inserted and deleted lines plus one rewritten function-sized region). Tokens are
+estimated with the same chars/token heuristic used for chunk packing. The MODIFIED file is sent
+in both cases, so the "prompt" columns include it.
+
+Usage:
+    python benchmarks/bench_prompt_context.py                        # repo sources at 1% edits
+    python benchmarks/bench_prompt_context.py main.py --edit-ratio 0.05
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from green_code_analyzer.chunk_utils import estimate_tokens
+from green_code_analyzer.diff_utils import build_change_context
+
+DEFAULT_FILES = ['main.py', 'stream.py', 'hh2.js'] + sorted(
+    os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, 'green_code_analyzer', '*.py')))
+CONTEXT_LINES = 2 # Matches LLM_CONTEXT_DIFF_LINES in main.py
+
+
+def mutate_source(lines, rng, edit_ratio):
+    """Scattered single-line edits/inserts/deletes plus one rewritten ~10-line region."""
+    mutated = list(lines)
+    for _ in range(max(1, int(len(lines) * edit_ratio))):
+        position = rng.randrange(len(mutated))
+        choice = rng.random()
+        if choice < 0.5:
+            mutated[position] = mutated[position] + "  # edited"
+        elif choice < 0.8:
+            indent = mutated[position][:len(mutated[position]) - len(mutated[position].lstrip())]
+            mutated.insert(position, f"{indent}inserted_{position} = True")
+        else:
+            del mutated[position]
+    start = rng.randrange(len(mutated))
+    for offset in range(start, min(len(mutated), start + 10)):
+        mutated[offset] = f"    rewritten_{offset}()"
+    return mutated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full-ORIGINAL vs diff change context token counts.")
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES, help="Files to use as HEAD versions.")
+    parser.add_argument("--edit-ratio", type=float, default=0.01, help="Fraction of lines edited in the staged copy.")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'file':<36} | {'lines':>6} | {'ORIGINAL':>8} | {'diff':>6} | {'prompt before':>13} | {'prompt after':>12} | {'saved':>6}")
+    print("-" * 104)
+    total_before = total_after = 0
+    for file_path in args.files:
+        with open(os.path.join(ROOT, file_path) if not os.path.isabs(file_path) else file_path,
+                  encoding='utf-8', errors='ignore') as source_file:
+            original = source_file.read()
+        original_lines = original.splitlines()
+        if not original_lines:
+            continue
+        staged = '\n'.join(mutate_source(original_lines, rng, args.edit_ratio)) + '\n'
+        context = build_change_context(original, staged, context_lines=CONTEXT_LINES)
+        staged_tokens = estimate_tokens(staged)
+        original_tokens = estimate_tokens(original)
+        context_tokens = estimate_tokens(context)
+        before = original_tokens + staged_tokens
+        # main.py falls back to the ORIGINAL when the diff would not be shorter
+        after = min(context_tokens, original_tokens) + staged_tokens
+        total_before += before
+        total_after += after
+        print(f"{file_path[-36:]:<36} | {len(original_lines):>6} | {original_tokens:>8} | {context_tokens:>6} | "
+              f"{before:>13} | {after:>12} | {1 - after / before:>6.1%}")
+    if total_before:
+        print("-" * 104)
+        print(f"{'total':<36} | {'':>6} | {'':>8} | {'':>6} | {total_before:>13} | {total_after:>12} | "
+              f"{1 - total_after / total_before:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
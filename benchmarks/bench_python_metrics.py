@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark + parity check for the built-in Python metrics engine.
+
+For every given Python file it times compute_python_metrics against the external-tool path
+(lizard / cloc / radon subprocesses through get_static_metrics) and, when the lizard and radon
+libraries are importable, compares the native numbers with theirs:
+
+  - cyclomatic_complexity_max/avg and function_loc_max vs lizard
+  - loc_logical_radon vs radon.raw.analyze
+
+Usage:
+    python benchmarks/bench_python_metrics.py main.py samp.py
+    python benchmarks/bench_python_metrics.py --no-tools $(python -c "import sysconfig,glob;print(' '.join(glob.glob(sysconfig.get_paths()['stdlib'] + '/*.py')))")
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from green_code_analyzer.py_metrics import compute_python_metrics
+
+try:
+    import lizard
+except ImportError:
+    lizard = None
+try:
+    import radon.raw
+except ImportError:
+    radon = None
+
+
+def reference_metrics(file_path, source):
+    """Metrics as lizard/radon compute them (library calls, no subprocess)."""
+    reference = {}
+    if lizard is not None:
+        functions = lizard.analyze_file.analyze_source_code(file_path, source).function_list
+        if functions:
+            complexities = [function.cyclomatic_complexity for function in functions]
+            reference['cyclomatic_complexity_max'] = max(complexities)
+            reference['cyclomatic_complexity_avg'] = round(sum(complexities) / len(complexities), 2)
+            reference['function_loc_max'] = max(function.nloc for function in functions)
+    if radon is not None:
+        try:
+            reference['loc_logical_radon'] = radon.raw.analyze(source).lloc
+        except SyntaxError:
+            pass
+    return reference
+
+
+def time_tools(file_path):
+    """Wall time of the subprocess-based path used before the native engine."""
+    import main as analyzer # Imported lazily: pulls in requests and the rest of the hook
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyzer.get_static_metrics(file_path, 'python')
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and cross-check the built-in Python metrics engine.")
+    parser.add_argument("files", nargs="+", help="Python files to analyze.")
+    parser.add_argument("--no-tools", action="store_true", help="Skip timing the lizard/cloc/radon subprocess path.")
+    args = parser.parse_args()
+
+    mismatches, compared = 0, 0
+    print(f"{'file':<40} {'lines':>6} {'native ms':>10} {'tools ms':>10}  parity")
+    for file_path in args.files:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                source = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        started = time.perf_counter()
+        metrics = compute_python_metrics(source)
+        native_ms = (time.perf_counter() - started) * 1000
+        if metrics is None:
+            print(f"{os.path.basename(file_path):<40} {'-':>6} {'unparsable':>10}")
+            continue
+        tools_ms = '-' if args.no_tools else f"{time_tools(file_path) * 1000:.1f}"
+        reference = reference_metrics(file_path, source)
+        diffs = {key: (value, metrics.get(key)) for key, value in reference.items() if metrics.get(key) != value}
+        compared += 1
+        mismatches += bool(diffs)
+        parity = "ok" if not diffs else "; ".join(f"{k}: ref={v[0]} native={v[1]}" for k, v in diffs.items())
+        print(f"{os.path.basename(file_path):<40} {metrics['loc_total_cloc']:>6} {native_ms:>10.1f} {tools_ms:>10}  {parity}")
+    print(f"\n{compared - mismatches}/{compared} file(s) match the lizard/radon reference numbers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time budget check for hook start-up (every commit pays it before any analysis starts).
+
+Runs 'main.py <file> --skip-llm --full-file-mode --quiet' under 'python -X importtime' on a small
+generated Python file and fails (exit code 1) if
+  - the imports added by main.py (everything the bare interpreter does not import already) take
+    longer than --budget-ms (median of --repeat runs), or
+  - a heavy module that only some code paths need is imported: requests (LLM calls only) or
+    codecarbon/pandas (--measure-emissions only).
+
+Usage:
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --budget-ms 40 --repeat 9 --top 15
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(ROOT, "main.py")
+DEFAULT_BUDGET_MS = 60.0
+# Top-level packages that must stay off the --skip-llm start-up path
+FORBIDDEN_MODULES = ('requests', 'urllib3', 'codecarbon', 'pandas')
+SAMPLE_CODE = '''def collect(values):
+    result = []
+    for i in range(len(values)):
+        result.append(values[i] * 2)
+    return result
+
+
+if __name__ == "__main__":
+    print(collect(list(range(10))))
+'''
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)\s*$')
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from '-X importtime' output (depth 0 = top level)."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def run_importtime(args, cwd):
+    process = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, capture_output=True,
+                             text=True, encoding='utf-8', errors='replace')
+    return process.returncode, parse_importtime(process.stderr), process.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Maximum median import time added by main.py, in milliseconds.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs to take the median over.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="green_code_importtime_") as work_dir:
+        sample_path = os.path.join(work_dir, "sample.py")
+        with open(sample_path, 'w', encoding='utf-8') as sample_file:
+            sample_file.write(SAMPLE_CODE)
+        _, baseline_entries, _ = run_importtime(["-c", "pass"], work_dir)
+        baseline_modules = {module for module, _, _, _ in baseline_entries}
+
+        totals_ms, last_entries = [], []
+        for _ in range(max(1, args.repeat)):
+            returncode, entries, stdout = run_importtime(
+                [MAIN_SCRIPT, sample_path, "--skip-llm", "--full-file-mode", "--quiet"], work_dir)
+            if returncode != 0:
+                print(f"main.py exited with code {returncode}:\n{stdout}")
+                sys.exit(1)
+            added = [entry for entry in entries if entry[3] == 0 and entry[0] not in baseline_modules]
+            totals_ms.append(sum(cumulative_us for _, _, cumulative_us, _ in added) / 1000)
+            last_entries = entries
+
+    median_ms = statistics.median(totals_ms)
+    print(f"Import time added by main.py: median {median_ms:.1f} ms over {len(totals_ms)} run(s) "
+          f"(min {min(totals_ms):.1f} ms, max {max(totals_ms):.1f} ms), budget {args.budget_ms:.1f} ms")
+    top_level = sorted((entry for entry in last_entries if entry[3] == 0 and entry[0] not in baseline_modules),
+                       key=lambda entry: -entry[2])
+    for module, _, cumulative_us, _ in top_level[:args.top]:
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {module}")
+
+    imported = {module.split('.')[0] for module, _, _, _ in last_entries}
+    forbidden = sorted(imported.intersection(FORBIDDEN_MODULES))
+    failed = False
+    if forbidden:
+        print(f"FAIL: heavy module(s) imported on the --skip-llm path: {', '.join(forbidden)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import time {median_ms:.1f} ms exceeds the {args.budget_ms:.1f} ms budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip check for prompt compaction (comment_compaction.py) and chunking (chunk_utils.py) on
+real Python sources.
+
+For every built-in regression case and every given file that parses, checks that
+  - the compacted code (comments/docstrings as placeholders) still parses,
+  - restoring the placeholders gives back exactly the original text, and
+  - the chunks from split_into_chunks (one per top-level piece, and at --chunk-tokens) each pass
+    chunk_syntax_ok and join back into the original text.
+Exits with code 1 on any failure. The regression cases cover characters that str.splitlines()
+treats as line breaks but Python's tokenizer does not (form feed, \\u2028, \\x85, \\x1c-\\x1e).
+
+Usage:
+    python benchmarks/check_source_roundtrip.py
+    python benchmarks/check_source_roundtrip.py $(python -c "import sysconfig,glob;print(' '.join(glob.glob(sysconfig.get_paths()['stdlib'] + '/email/*.py')))")
+"""
+import argparse
+import ast
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from green_code_analyzer.comment_compaction import compact_python_source, restore_python_source, PlaceholderMismatch
+from green_code_analyzer.chunk_utils import split_into_chunks, chunk_syntax_ok, split_source_lines
+
+DEFAULT_CHUNK_TOKENS = 1500 # LLM_CHUNK_MAX_TOKENS in main.py
+
+REGRESSION_CASES = {
+    'form feed': 'import os  # first\n\x0c\ndef f():\n    """doc"""\n    return os.sep  # sep\n',
+    'line separator in a string': 'x = "a\u2028b"  # note\ndef f():\n    """doc"""\n    return 1  # one\n',
+    'separators in comments': '# a\x85b\x1cc\ndef g():\n    # d\x1de\x1ef\n    """doc"""\n    return 2\n',
+    'CR and CRLF line breaks': 'x = 1  # cr\ry = 2  # crlf\r\ndef h():\r\n    """doc"""\r\n    return x\r\n',
+}
+
+
+def compaction_problem(source):
+    """Why compaction of `source` does not round-trip, or None if it does."""
+    placeholders = {}
+    compacted = compact_python_source(source, placeholders)
+    try:
+        ast.parse(compacted)
+    except (SyntaxError, ValueError) as e:
+        return f"compacted code does not parse ({e.__class__.__name__}: {e})"
+    try:
+        restored = restore_python_source(compacted, placeholders)
+    except PlaceholderMismatch as e:
+        return f"restore failed ({e})"
+    if restored != source:
+        return f"restored text differs ({len(source)} -> {len(restored)} chars)"
+    return None
+
+
+def chunking_problem(source, max_tokens):
+    """Why chunking `source` at max_tokens loses text or yields an unparseable chunk, or None."""
+    chunks = split_into_chunks(source, 'python', max_tokens)
+    if chunks is None:
+        return "split_into_chunks could not chunk parseable code"
+    lines = split_source_lines(source, keepends=True)
+    chunk_texts = [''.join(lines[start:end]) for start, end in chunks]
+    if ''.join(chunk_texts) != source:
+        return "chunks do not join back into the original text"
+    bad_chunks = [i + 1 for i, text in enumerate(chunk_texts) if text.strip() and not chunk_syntax_ok(text, 'python')]
+    if bad_chunks:
+        return f"{len(bad_chunks)}/{len(chunks)} chunk(s) fail chunk_syntax_ok (chunk {', '.join(map(str, bad_chunks[:5]))})"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Python files to check in addition to the regression cases.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help="Chunk budget (estimated tokens) to check besides one chunk per top-level piece.")
+    args = parser.parse_args()
+
+    sources = dict(REGRESSION_CASES)
+    for file_path in args.files:
+        try:
+            with open(file_path, 'r', encoding='utf-8', newline='') as source_file:
+                source = source_file.read()
+            ast.parse(source)
+        except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+            continue # Only code the hook would compact
+        sources[file_path] = source
+
+    failures = 0
+    for name, source in sources.items():
+        problems = [('compaction', compaction_problem(source))]
+        if source.strip(): # Empty files (e.g. bare __init__.py) have nothing to chunk
+            problems += [(f"chunking at {max_tokens} token(s)", chunking_problem(source, max_tokens))
+                         for max_tokens in (1, args.chunk_tokens)]
+        for check, problem in problems:
+            if problem:
+                failures += 1
+                print(f"FAIL: {name}: {check}: {problem}")
+    print(f"Checked {len(sources)} source(s) ({len(REGRESSION_CASES)} regression case(s)), {failures} failure(s)")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Offline stand-in for Groq's OpenAI-compatible chat completions API, for deterministic pipeline
+benchmarks and load tests (hook throughput, retries, rate limiting, concurrency, streaming).
+
+Serves POST /openai/v1/chat/completions (and /v1/chat/completions), plain or streamed
+("stream": true, server-sent events), plus GET /stats with request counters as JSON.
+  - latency:   time to first token drawn from --latency (fixed:S, uniform:LO:HI, exp:MEAN or
+               lognormal:MEDIAN:SIGMA), occasional --stall-rate stalls of --stall-seconds, and
+               --tokens-per-second pacing of the reply (words count as tokens)
+  - failures:  --error-rate injects 500s, --rate-limit-rate injects 429s with 'retry-after', and
+               --rpm enforces a requests-per-minute quota with Groq's 'x-ratelimit-*' headers
+  - replies:   --response echo returns the code the prompt asked to optimize (last fenced block,
+               the code after the prompt's instructions, or every <<<SEGMENT n>>> of a packed
+               request), passed through --transform; diff requests get an empty diff (no change).
+               --response canned returns the contents of --canned-file.
+Draws use one seeded RNG (--seed), so a run with the same request order is reproducible.
+
+Point the tools at it with the GROQ_BASE_URL environment variable:
+    python benchmarks/mock_llm_server.py --port 8765 --latency lognormal:0.8:0.5 --rate-limit-rate 0.05 &
+    GROQ_BASE_URL=http://127.0.0.1:8765/openai/v1 python main.py --staged --changes-only --no-llm-cache
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION_PATHS = ('/openai/v1/chat/completions', '/v1/chat/completions')
+TRANSFORMS = ('identity', 'fence', 'preamble', 'prose', 'truncate')
+_SEGMENT = re.compile(r'<<<SEGMENT (\d+)>>>\n(.*?)\n?<<<END SEGMENT \1>>>', re.DOTALL)
+_FENCED_BLOCK = re.compile(r'```[\w+-]*\n(.*?)\n?```', re.DOTALL)
+_TOKEN = re.compile(r'\s*\S+|\s+')
+# Last line of main.py's full-file instructions; the code follows it when it is sent unfenced
+_INSTRUCTIONS_END = 'The primary focus remains sustainability optimization.'
+
+
+def parse_latency(spec):
+    """Returns a callable(rng) -> seconds for a --latency spec."""
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(':') if value]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'exp' and len(values) == 1 and values[0] > 0:
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    if kind == 'lognormal' and len(values) == 2 and values[0] > 0:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unsupported latency spec {spec!r} (use fixed:S, uniform:LO:HI, exp:MEAN or lognormal:MEDIAN:SIGMA)")
+
+
+def transform_code(code, transform):
+    """Applies an --transform to echoed code (the non-identity ones exercise the pipeline's cleanup and fallbacks)."""
+    if transform == 'fence':
+        return f"```python\n{code}\n```"
+    if transform == 'preamble':
+        return f"Here's the optimized code:\n\n{code}"
+    if transform == 'prose':
+        return f"I optimized the loops and removed redundant work in the code below.\n\n{code}"
+    if transform == 'truncate':
+        lines = code.splitlines()
+        return '\n'.join(lines[:max(1, len(lines) // 2)])
+    return code
+
+
+def echo_reply(user_prompt, transform):
+    """The code a pipeline prompt asks to optimize, transformed, in the reply format the prompt expects."""
+    if 'Return ONLY a unified diff' in user_prompt:
+        return ''
+    segments = _SEGMENT.findall(user_prompt)
+    if segments:
+        return '\n\n'.join(f"<<<SEGMENT {segment_id}>>>\n{transform_code(code, transform)}\n<<<END SEGMENT {segment_id}>>>"
+                           for segment_id, code in segments)
+    fenced = _FENCED_BLOCK.findall(user_prompt)
+    if fenced:
+        code = fenced[-1]
+    elif _INSTRUCTIONS_END in user_prompt:
+        code = user_prompt.rsplit(_INSTRUCTIONS_END, 1)[1].split('\n', 1)[-1].strip('\n')
+    else:
+        code = user_prompt
+    return transform_code(code, transform)
+
+
+class MockState:
+    """Settings, RNG and counters shared by all handler threads."""
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.rng = random.Random(args.seed)
+        self.canned = None
+        if args.response == 'canned':
+            with open(args.canned_file, 'r', encoding='utf-8') as canned_file:
+                self.canned = canned_file.read()
+        self.lock = threading.Lock()
+        self.window = [] # Request times within the last minute, for --rpm
+        self.counters = {'requests': 0, 'streamed': 0, 'completed': 0, 'errors_500': 0,
+                         'rate_limited_429': 0, 'stalls': 0, 'disconnects': 0}
+        self.latencies = []
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def draw(self):
+        """(outcome, first-token delay) for one request; outcome is 'ok', 'error', 'rate_limit' or 'quota'."""
+        with self.lock:
+            now = time.monotonic()
+            self.window = [stamp for stamp in self.window if now - stamp < 60]
+            if self.args.rpm and len(self.window) >= self.args.rpm:
+                return 'quota', 60 - (now - self.window[0])
+            self.window.append(now)
+            roll = self.rng.random()
+            if roll < self.args.error_rate:
+                return 'error', 0.0
+            if roll < self.args.error_rate + self.args.rate_limit_rate:
+                return 'rate_limit', 0.0
+            delay = max(0.0, self.latency(self.rng))
+            if self.args.stall_rate and self.rng.random() < self.args.stall_rate:
+                self.counters['stalls'] += 1
+                delay += self.args.stall_seconds
+            return 'ok', delay
+
+    def snapshot(self):
+        with self.lock:
+            ordered = sorted(self.latencies)
+            stats = dict(self.counters, remaining_quota=(self.args.rpm - len(self.window)) if self.args.rpm else None)
+        if ordered:
+            stats['latency_p50'] = ordered[len(ordered) // 2]
+            stats['latency_p90'] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+            stats['latency_max'] = ordered[-1]
+        return stats
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real API (exercises the client's connection pool)
+    server_version = 'MockLLM/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.state.args.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.server.state.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.split('?')[0].rstrip('/') not in COMPLETION_PATHS:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+        try:
+            request = json.loads(body or b'{}')
+            messages = request['messages']
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': {'message': 'Body must be JSON with a messages list'}})
+            return
+        state.count('requests')
+        started = time.monotonic()
+
+        outcome, delay = state.draw()
+        if outcome == 'error':
+            state.count('errors_500')
+            self._send_json(500, {'error': {'message': 'Injected server error', 'type': 'internal_server_error'}})
+            return
+        if outcome in ('rate_limit', 'quota'):
+            state.count('rate_limited_429')
+            wait = state.args.retry_after if outcome == 'rate_limit' else delay
+            headers = {'retry-after': f'{wait:.2f}'} if outcome == 'rate_limit' else {
+                'x-ratelimit-limit-requests': str(state.args.rpm), 'x-ratelimit-remaining-requests': '0',
+                'x-ratelimit-reset-requests': f'{wait:.2f}s'}
+            self._send_json(429, {'error': {'message': 'Rate limit reached (injected)', 'type': 'rate_limit_exceeded'}}, headers)
+            return
+
+        user_prompt = next((message.get('content', '') for message in reversed(messages) if message.get('role') == 'user'), '')
+        reply = state.canned if state.canned is not None else echo_reply(user_prompt, state.args.transform)
+        tokens = _TOKEN.findall(reply)
+        token_delay = 1.0 / state.args.tokens_per_second if state.args.tokens_per_second else 0.0
+        model = request.get('model', 'mock')
+        time.sleep(delay)
+        try:
+            if request.get('stream'):
+                state.count('streamed')
+                self._stream_reply(model, tokens, token_delay)
+            else:
+                time.sleep(token_delay * len(tokens))
+                self._send_json(200, {
+                    'id': f'chatcmpl-{uuid.uuid4().hex[:12]}', 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': len(_TOKEN.findall(user_prompt)), 'completion_tokens': len(tokens),
+                              'total_tokens': len(_TOKEN.findall(user_prompt)) + len(tokens)},
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            state.count('disconnects') # Client stopped reading (e.g. an aborted stream)
+            self.close_connection = True
+            return
+        state.count('completed')
+        with state.lock:
+            state.latencies.append(time.monotonic() - started)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _stream_reply(self, model, tokens, token_delay):
+        """Sends the reply as chat.completion.chunk server-sent events over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+        for token in tokens:
+            event = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                     'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            self._write_chunk(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+            if token_delay:
+                time.sleep(token_delay)
+        final = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self._write_chunk(f'data: {json.dumps(final)}\n\ndata: [DONE]\n\n'.encode('utf-8'))
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible chat completions server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0.2", help="Time to first token: fixed:S, uniform:LO:HI, exp:MEAN or lognormal:MEDIAN:SIGMA.")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Reply pacing (0 = send at once).")
+    parser.add_argument("--stall-rate", type=float, default=0, help="Fraction of requests delayed by an extra --stall-seconds.")
+    parser.add_argument("--stall-seconds", type=float, default=60)
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Fraction of requests answered with HTTP 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="'retry-after' seconds sent with injected 429s.")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests-per-minute quota with x-ratelimit headers (0 = none).")
+    parser.add_argument("--response", choices=("echo", "canned"), default="echo")
+    parser.add_argument("--transform", choices=TRANSFORMS, default="identity", help="What echo does to the code it returns.")
+    parser.add_argument("--canned-file", help="Reply text for --response canned.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    return parser
+
+
+def create_server(args):
+    """ThreadingHTTPServer for parsed options (port 0 picks a free port); call serve_forever() to run it."""
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(args)
+    return server
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.response == 'canned' and not args.canned_file:
+        parser.error("--response canned requires --canned-file")
+    try:
+        server = create_server(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    state = server.state
+    print(f"Mock LLM server on http://{args.host}:{server.server_port}/openai/v1 "
+          f"(set GROQ_BASE_URL to this URL); stats at /stats", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(state.snapshot(), indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Small content-addressed on-disk cache used by the hook (stored under .git/ by default).
+
+Each entry is one JSON file named after the SHA-256 of its key, sharded by the first two hex
+characters. Reads refresh the file's mtime, so eviction by oldest mtime is an LRU policy.
+Writes are atomic (temp file + os.replace), which keeps concurrent hook runs safe.
+With ttl_seconds set, entries also record their creation time and expire after the TTL.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+
+def make_cache_key(*parts):
+    """Stable SHA-256 hex key for any sequence of strings/bytes."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8', errors='surrogateescape')
+        digest.update(len(part).to_bytes(8, 'big')) # Length prefix keeps ('ab','c') != ('a','bc')
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def get_git_cache_dir(name, cwd=None):
+    """Returns <git common dir>/green_code_cache/<name>, or None when not inside a Git repository."""
+    try:
+        git_dir = subprocess.check_output(
+            ["git", "rev-parse", "--git-common-dir"], cwd=cwd, stderr=subprocess.DEVNULL
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return os.path.join(os.path.abspath(os.path.join(cwd or '.', git_dir)), "green_code_cache", name)
+
+
+class DiskCache:
+    """JSON value cache with size-bounded LRU eviction, optional TTL and hit/miss counters."""
+
+    COUNTERS = ('hits', 'misses', 'writes', 'evictions', 'expirations')
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._total_bytes = None # Computed lazily on first write
+        self._lock = threading.Lock() # Counters and size bookkeeping are shared by concurrent requests
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + ".json")
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss/corrupt entry."""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            if self.ttl_seconds is not None:
+                # TTL entries are {"created": <epoch seconds>, "value": <cached value>}
+                if time.time() - value["created"] > self.ttl_seconds:
+                    self._remove_expired(path)
+                    return None
+                value = value["value"]
+        except (OSError, ValueError, TypeError, KeyError):
+            self._count('misses')
+            return None
+        try:
+            os.utime(path, None) # Mark as recently used for LRU eviction
+        except OSError:
+            pass
+        self._count('hits')
+        return value
+
+    def contains(self, key):
+        """True if an entry exists for key (does not count as a hit or refresh its LRU position)."""
+        return os.path.exists(self._entry_path(key))
+
+    def put(self, key, value):
+        """Stores value (must be JSON serializable). Failures are non-fatal and return False."""
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.ttl_seconds is not None:
+                value = {"created": time.time(), "value": value}
+            data = json.dumps(value).encode('utf-8')
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError):
+            return False
+        with self._lock:
+            self.writes += 1
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total_bytes()
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return True
+
+    def _remove_expired(self, path):
+        self._count('misses')
+        self._count('expirations')
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _iter_entries(self):
+        try:
+            shards = os.listdir(self.directory)
+        except OSError:
+            return
+        for shard in shards:
+            shard_dir = os.path.join(self.directory, shard)
+            try:
+                names = os.listdir(shard_dir)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _scan_total_bytes(self):
+        return sum(size for _, size, _ in self._iter_entries())
+
+    def _evict(self):
+        """Removes least recently used entries until the cache is back under ~90% of max_bytes (caller holds _lock)."""
+        entries = sorted(self._iter_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def drain(self):
+        """Returns and resets the counters, e.g. for a worker process to hand them to the parent."""
+        with self._lock:
+            counts = {counter: getattr(self, counter) for counter in self.COUNTERS}
+            for counter in self.COUNTERS:
+                setattr(self, counter, 0)
+        return counts
+
+    def add(self, counts):
+        """Adds counters returned by drain() (in another process) to these totals."""
+        with self._lock:
+            for counter in self.COUNTERS:
+                setattr(self, counter, getattr(self, counter) + counts.get(counter, 0))
+
+    def stats_line(self):
+        """One-line hit/miss summary for the run report."""
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        line = (f"{self.hits} hit(s), {self.misses} miss(es) ({hit_rate:.0f}% hit rate), "
+                f"{self.writes} write(s), {self.evictions} eviction(s)")
+        if self.ttl_seconds is not None:
+            line += f", {self.expirations} expired"
+        return line
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Structure-aware chunking for files too large to send to the LLM in one request.
+
+A file is cut only at top-level boundaries, so every chunk is a self-contained piece of code
+that the model can rewrite (and we can syntax-check) on its own:
+  - Python:          top-level statements from 'ast' (a function/class with its decorators)
+  - C-like languages: lines where the brace depth returns to zero (strings and comments skipped)
+Comment, decorator and annotation lines directly above a boundary move with the code below them.
+Consecutive pieces are then packed greedily into chunks of at most max_tokens (estimated), and
+a piece larger than the budget becomes a chunk of its own.
+
+The same statement ranges widen --changes-only blocks to whole Python statements
+(python_statement_units / expand_to_statement_units), so a block never starts mid-function or
+mid-expression.
+"""
+import ast
+import re
+
+CHARS_PER_TOKEN = 4 # Rough estimate for code with llama-family tokenizers
+BRACE_LANGUAGE_KEYS = ('javascript', 'java', 'c', 'cpp', 'csharp', 'go', 'php', 'swift', 'rust', 'kotlin', 'scala')
+CHUNKABLE_LANGUAGE_KEYS = ('python',) + BRACE_LANGUAGE_KEYS
+
+_LEADING_LINE_PREFIXES = {
+    'python': ('#', '@'),
+    'brace': ('//', '/*', '*', '@', '#['), # Comments, Java/Kotlin annotations, Rust attributes
+}
+_OPENERS = {'{': '}', '(': ')', '[': ']'}
+_CLOSERS = {'}', ')', ']'}
+# Rust uses ' for lifetimes ('a), so only double quotes delimit literals there
+_QUOTE_CHARS = {'rust': ('"',), 'go': ('"', "'", '`'), 'javascript': ('"', "'", '`')}
+_DEFAULT_QUOTE_CHARS = ('"', "'")
+_SOURCE_LINE = re.compile(r'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+\Z')
+
+
+def split_source_lines(source, keepends=False):
+    """
+    Lines of `source` as Python's tokenizer and ast number them: split only at \\r\\n, \\r and \\n.
+    (str.splitlines also breaks at form feeds, \\x1c-\\x1e, \\x85 and \\u2028, which shifts every
+    line after one.) keepends keeps the line breaks, like str.splitlines(keepends=True).
+    """
+    lines = _SOURCE_LINE.findall(source)
+    return lines if keepends else [line.rstrip('\r\n') for line in lines]
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used for packing chunks (no tokenizer dependency)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _python_boundaries(source):
+    """0-based line indices where top-level Python statements (with their decorators) start."""
+    tree = ast.parse(source)
+    boundaries = []
+    for node in tree.body:
+        boundaries.append(_statement_start(node) - 1)
+    return boundaries
+
+
+def _statement_start(node):
+    """1-based first line of a statement, including its decorators."""
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+
+
+def python_statement_units(source):
+    """
+    [(start, end, child_spans)] for every statement in `source`: 0-based half-open line range and
+    the ranges of its nested statement lists (bodies, else/finally branches, except/case bodies).
+    Line numbers index split_source_lines(source), not str.splitlines().
+    Raises SyntaxError/ValueError if the source does not parse.
+    """
+    units = []
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.stmt):
+            continue
+        statement_lists = [getattr(node, field, None) for field in ('body', 'orelse', 'finalbody')]
+        statement_lists += [handler.body for handler in getattr(node, 'handlers', [])]
+        statement_lists += [case.body for case in getattr(node, 'cases', [])]
+        child_spans = [(_statement_start(body[0]) - 1, body[-1].end_lineno)
+                       for body in statement_lists if isinstance(body, list) and body]
+        units.append((_statement_start(node) - 1, node.end_lineno, child_spans))
+    return units
+
+
+def expand_to_statement_units(units, start, end):
+    """
+    Widens the 0-based half-open line range [start, end) until it only cuts through statements
+    whose nested statement lists fully contain it, i.e. it consists of complete statements.
+    A statement whose header, decorators or (for simple statements) any part is touched is
+    included whole. Empty ranges (pure deletions) are returned unchanged.
+    """
+    if start >= end:
+        return start, end
+    changed = True
+    while changed:
+        changed = False
+        for unit_start, unit_end, child_spans in units:
+            if unit_end <= start or unit_start >= end or (start <= unit_start and unit_end <= end):
+                continue # Disjoint from, or already inside, the range
+            if any(span_start <= start and end <= span_end for span_start, span_end in child_spans):
+                continue # The range lies within one of this statement's bodies
+            start, end = min(start, unit_start), max(end, unit_end)
+            changed = True
+    return start, end
+
+
+def _scan_delimiters(source, language_key):
+    """
+    Yields (line_index, depth_after_line, balanced_so_far, is_code) for each line of C-like source,
+    ignoring delimiters inside string/char literals and // or /* */ comments. balanced_so_far turns
+    False for good once a closer does not match its opener; is_code is False for blank and
+    comment-only lines. Literals are assumed not to span lines.
+    """
+    quote_chars = _QUOTE_CHARS.get(language_key, _DEFAULT_QUOTE_CHARS)
+    stack = []
+    balanced = True
+    in_block_comment = False
+    for line_index, line in enumerate(split_source_lines(source)):
+        quote = None
+        is_code = False
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if not (in_block_comment or quote or char.isspace() or line.startswith(('//', '/*'), i)):
+                is_code = True
+            if in_block_comment:
+                if line.startswith('*/', i):
+                    in_block_comment = False
+                    i += 1
+            elif quote:
+                if char == '\\':
+                    i += 1 # Skip the escaped character
+                elif char == quote:
+                    quote = None
+            elif line.startswith('//', i):
+                break
+            elif line.startswith('/*', i):
+                in_block_comment = True
+                i += 1
+            elif char in quote_chars:
+                quote = char
+            elif char in _OPENERS:
+                stack.append(_OPENERS[char])
+            elif char in _CLOSERS:
+                if not stack or stack.pop() != char:
+                    balanced = False
+            i += 1
+        yield line_index, len(stack), balanced, is_code
+
+
+def _brace_boundaries(source, language_key):
+    """0-based line indices after a line of code that leaves the brace depth at zero."""
+    boundaries = [0]
+    for line_index, depth, _, is_code in _scan_delimiters(source, language_key):
+        if depth == 0 and is_code:
+            boundaries.append(line_index + 1)
+    return boundaries
+
+
+def _attach_leading_lines(lines, boundaries, prefixes):
+    """
+    Moves each boundary up over the comment/decorator lines directly above it, and past any blank
+    lines, which stay with the piece above.
+    """
+    adjusted = []
+    previous = 0
+    for boundary in sorted(set(boundaries)):
+        start = boundary
+        while start - 1 > previous:
+            above = lines[start - 1].strip()
+            if above and not above.startswith(prefixes):
+                break
+            start -= 1
+        while start < len(lines) and not lines[start].strip():
+            start += 1
+        adjusted.append(start)
+        previous = start
+    return adjusted
+
+
+def split_into_chunks(source, language_key, max_tokens):
+    """
+    Returns [(start_line, end_line)] 0-based half-open line ranges covering the whole of `source`,
+    each at most max_tokens (estimated) unless a single top-level piece is larger.
+    Returns None if the language is not chunkable or the source cannot be parsed.
+    Line numbers index split_source_lines(source), the way ast counts them.
+    """
+    lines = split_source_lines(source, keepends=True)
+    if not lines:
+        return None
+    if language_key == 'python':
+        try:
+            boundaries = _python_boundaries(source)
+        except (SyntaxError, ValueError):
+            return None
+        prefixes = _LEADING_LINE_PREFIXES['python']
+    elif language_key in BRACE_LANGUAGE_KEYS:
+        boundaries = _brace_boundaries(source, language_key)
+        prefixes = _LEADING_LINE_PREFIXES['brace']
+    else:
+        return None
+
+    starts = [start for start in _attach_leading_lines(lines, boundaries, prefixes) if 0 < start < len(lines)]
+    piece_starts = [0] + sorted(set(starts))
+    pieces = list(zip(piece_starts, piece_starts[1:] + [len(lines)]))
+
+    chunks = []
+    chunk_start, chunk_tokens = 0, 0
+    for start, end in pieces:
+        piece_tokens = estimate_tokens(''.join(lines[start:end]))
+        if chunk_tokens and chunk_tokens + piece_tokens > max_tokens:
+            chunks.append((chunk_start, start))
+            chunk_start, chunk_tokens = start, 0
+        chunk_tokens += piece_tokens
+    chunks.append((chunk_start, len(lines)))
+    return chunks
+
+
+def chunk_syntax_ok(code, language_key):
+    """
+    Standalone syntax check for one chunk: ast.parse for Python, balanced (), [] and {} for
+    C-like languages. Other languages are not checked.
+    """
+    if language_key == 'python':
+        try:
+            ast.parse(code)
+        except (SyntaxError, ValueError):
+            return False
+        return True
+    if language_key in BRACE_LANGUAGE_KEYS:
+        depth, balanced = 0, True
+        for _, depth, balanced, _ in _scan_delimiters(code, language_key):
+            pass
+        return balanced and depth == 0
+    return True
+
+
+def restore_chunk_padding(original_chunk, optimized_chunk):
+    """
+    Re-applies the leading/trailing whitespace of original_chunk to a stripped optimized_chunk,
+    so stitched chunks keep the file's blank lines between top-level definitions.
+    """
+    core = original_chunk.strip()
+    if not core:
+        return original_chunk
+    leading = original_chunk[:original_chunk.index(core[0])]
+    trailing = original_chunk[len(original_chunk.rstrip()):]
+    # Leading indentation of the first line belongs to the code, not to the padding
+    leading = leading[:leading.rfind('\n') + 1] if '\n' in leading else ''
+    return leading + optimized_chunk.lstrip('\n').rstrip() + trailing
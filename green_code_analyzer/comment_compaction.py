@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Prompt compaction for Python: comments and docstrings are swapped for short placeholders before
+code is sent to the LLM and put back into its reply afterwards, so we stop paying input and
+output tokens for text the model is told to leave untouched anyway.
+
+  - every COMMENT token becomes '#@GC<n>'
+  - every bare string statement (docstrings, and string literals used as block comments)
+    becomes '"@GC<n>"', which is still a valid statement in the same place
+Placeholders are numbered through one shared dict, so several compacted pieces of code (e.g. the
+staged file and the HEAD version shown for context) can be restored with the same mapping.
+A reply that drops one of the placeholders sent with it, or still contains an issued placeholder
+after restoration (mangled marker), raises PlaceholderMismatch, a ValueError, so callers treat it
+like an unparseable reply and revert instead of losing comments. '@GC' text that was never issued
+as a placeholder (e.g. in a file that already contained it) is left alone.
+"""
+import re
+import tokenize
+
+from green_code_analyzer.chunk_utils import split_source_lines
+
+PLACEHOLDER_PREFIX = '@GC'
+PLACEHOLDER_PROMPT_NOTE = (
+    "Comments and docstrings have been replaced by placeholders such as #@GC3 and \"@GC4\". "
+    "Keep every placeholder exactly as written, next to the code it belongs to; they are restored afterwards.")
+
+_COMMENT_PLACEHOLDER = re.compile(r'#[ \t]*@GC(\d+)\b')
+_STRING_PLACEHOLDER = re.compile(r'[rRuU]?("""|\'\'\'|"|\')@GC(\d+)\1')
+_ANY_PLACEHOLDER = re.compile(r'@GC\d+')
+_STATEMENT_START_TOKENS = (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT)
+
+
+class PlaceholderMismatch(ValueError):
+    """Raised when placeholders in an LLM reply cannot be matched back to the original text."""
+
+
+def _line_offsets(lines):
+    """Absolute offset of the start of every (1-based) line, for mapping token positions."""
+    offsets = [0, 0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def compact_python_source(source, placeholders, issued=None):
+    """
+    Returns `source` with comments and bare string statements replaced by placeholders, adding
+    {id: original text} entries to `placeholders` (and the new IDs to the `issued` set, if given).
+    Code that cannot be tokenized, or that already contains placeholder-like text, is returned unchanged.
+    """
+    if PLACEHOLDER_PREFIX in source:
+        return source
+    lines = split_source_lines(source, keepends=True) # The tokenizer's lines, so positions map back exactly
+    try:
+        tokens = list(tokenize.generate_tokens(iter(lines).__next__))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return source
+
+    offsets = _line_offsets(lines)
+    replacements = [] # (token, '#' for a comment or '"' for a string statement)
+    significant = [token for token in tokens if token.type not in (tokenize.NL, tokenize.COMMENT)]
+    for token in tokens:
+        if token.type == tokenize.COMMENT:
+            replacements.append((token, '#'))
+    for index, token in enumerate(significant):
+        if token.type != tokenize.STRING:
+            continue
+        previous_type = significant[index - 1].type if index else tokenize.NEWLINE
+        next_type = significant[index + 1].type if index + 1 < len(significant) else tokenize.NEWLINE
+        # A string that is a whole statement on its own: docstring or string "comment"
+        if previous_type in _STATEMENT_START_TOKENS and next_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            replacements.append((token, '"'))
+    if not replacements:
+        return source
+
+    replacements.sort(key=lambda item: item[0].start)
+    pieces = []
+    cursor = 0
+    for token, kind in replacements:
+        start = offsets[token.start[0]] + token.start[1]
+        end = offsets[token.end[0]] + token.end[1]
+        placeholder_id = len(placeholders) + 1
+        placeholders[placeholder_id] = token.string
+        if issued is not None:
+            issued.add(placeholder_id)
+        pieces.append(source[cursor:start])
+        pieces.append(f'#{PLACEHOLDER_PREFIX}{placeholder_id}' if kind == '#'
+                      else f'"{PLACEHOLDER_PREFIX}{placeholder_id}"')
+        cursor = end
+    pieces.append(source[cursor:])
+    return ''.join(pieces)
+
+
+def restore_python_source(code, placeholders, expected_ids=None):
+    """
+    Puts the original comments and docstrings back into `code` (an LLM reply to compacted code).
+    expected_ids are the placeholders that were sent in this piece of code (default: all of
+    `placeholders`); other issued IDs (e.g. from the ORIGINAL context) are restored if present.
+    Raises PlaceholderMismatch if an expected placeholder is missing from the reply or an issued
+    one is left over after restoration. Without placeholders the code is returned unchanged.
+    """
+    if not placeholders:
+        return code
+    expected_ids = set(placeholders) if expected_ids is None else set(expected_ids)
+    found_ids = set()
+
+    def restore(match, group):
+        placeholder_id = int(match.group(group))
+        if placeholder_id not in placeholders:
+            return match.group(0) # Never issued: ordinary text of the reply
+        found_ids.add(placeholder_id)
+        return placeholders[placeholder_id]
+
+    restored = _STRING_PLACEHOLDER.sub(lambda match: restore(match, 2), code)
+    restored = _COMMENT_PLACEHOLDER.sub(lambda match: restore(match, 1), restored)
+    leftover = sorted({marker for marker in _ANY_PLACEHOLDER.findall(restored)
+                       if int(marker[len(PLACEHOLDER_PREFIX):]) in placeholders})
+    if leftover:
+        raise PlaceholderMismatch(f"{len(leftover)} placeholder(s) could not be restored "
+                                  f"({', '.join(leftover[:5])})")
+    missing = sorted(expected_ids - found_ids)
+    if missing:
+        raise PlaceholderMismatch(f"{len(missing)} placeholder(s) missing from the reply "
+                                  f"({', '.join(f'{PLACEHOLDER_PREFIX}{i}' for i in missing[:5])})")
+    return restored
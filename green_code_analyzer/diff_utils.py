@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable line-diff backends for analyze_code_changes.
+
+Every backend returns SequenceMatcher-style opcodes: (tag, i1, i2, j1, j2) tuples with
+tag in 'equal' / 'replace' / 'delete' / 'insert', so callers can build change_blocks
+exactly as they did from difflib.
+
+Backends:
+  - 'difflib':  difflib.SequenceMatcher(autojunk=False). Original behaviour, quadratic worst case.
+  - 'patience': unique-line anchoring (patience diff) with a bounded Myers O(ND) pass for the
+                gaps between anchors. Near-linear on real files, never quadratic.
+  - 'git':      reuse the hunks git already computed ('git diff --cached -U0'). Only valid for
+                HEAD vs index; verified against the content and replaced by 'patience' on mismatch.
+  - 'auto':     'difflib' for small inputs (keeps the exact block shapes we always produced),
+                'patience' above AUTO_DIFFLIB_MAX_LINES.
+
+format_unified_diff / build_change_context turn any backend's opcodes into compact unified-diff
+hunks, used as prompt context in place of the whole HEAD version of a file.
+"""
+import bisect
+import difflib
+import re
+import subprocess
+
+DIFF_BACKENDS = ('auto', 'difflib', 'patience', 'git')
+AUTO_DIFFLIB_MAX_LINES = 2000 # Combined line count up to which 'auto' keeps using difflib
+MYERS_WORK_BUDGET = 4000000   # Caps the O(ND) search on regions without unique anchor lines
+
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _opcodes_from_matching_pairs(pairs, len_a, len_b):
+    """Turns sorted (i, j) matched line pairs into SequenceMatcher-style opcodes."""
+    opcodes = []
+    i = j = 0
+    run_start = None
+    # Sentinel pair closes the last run and emits the trailing change, if any
+    for ai, bj in list(pairs) + [(len_a, len_b)]:
+        if run_start is not None and ai == i and bj == j and ai < len_a and bj < len_b:
+            i, j = ai + 1, bj + 1 # Extends the current 'equal' run
+            continue
+        if run_start is not None:
+            opcodes.append(('equal', run_start[0], i, run_start[1], j))
+            run_start = None
+        if i < ai and j < bj:
+            opcodes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(('insert', i, ai, j, bj))
+        if ai < len_a and bj < len_b:
+            run_start = (ai, bj)
+            i, j = ai + 1, bj + 1
+    return opcodes
+
+
+def _myers_pairs(a, b, alo, ahi, blo, bhi):
+    """
+    Myers' greedy O(ND) diff on a[alo:ahi] vs b[blo:bhi].
+    Returns matched (i, j) pairs, or None when the edit distance exceeds the work budget.
+    """
+    n, m = ahi - alo, bhi - blo
+    max_cost = min(n + m, max(256, MYERS_WORK_BUDGET // max(1, n + m)))
+    v = {1: 0}
+    trace = []
+    for d in range(max_cost + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, alo, blo)
+    return None
+
+
+def _myers_backtrack(trace, x, y, alo, blo):
+    pairs = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v.get(k - 1, -1) < v.get(k + 1, -1)):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    return pairs
+
+
+def _unique_anchor_pairs(a, b, alo, ahi, blo, bhi):
+    """Lines occurring exactly once on each side, reduced to their longest increasing subsequence."""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        counts[a[i]] = [1, i, None, 0] if entry is None else [entry[0] + 1, i, None, 0]
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[2] = j
+            entry[3] += 1
+    candidates = sorted((entry[1], entry[2]) for entry in counts.values() if entry[0] == 1 and entry[3] == 1)
+    if not candidates:
+        return []
+
+    # Patience sorting: longest increasing run of b-indices over candidates ordered by a-index
+    tails, tail_indices, predecessors = [], [], []
+    for index, (_, bj) in enumerate(candidates):
+        position = bisect.bisect_left(tails, bj)
+        if position == len(tails):
+            tails.append(bj)
+            tail_indices.append(index)
+        else:
+            tails[position] = bj
+            tail_indices[position] = index
+        predecessors.append(tail_indices[position - 1] if position else -1)
+    anchors = []
+    index = tail_indices[-1]
+    while index != -1:
+        anchors.append(candidates[index])
+        index = predecessors[index]
+    anchors.reverse()
+    return anchors
+
+
+def _patience_pairs(a, b):
+    """Matched (i, j) pairs for the whole sequences using patience anchoring + bounded Myers."""
+    pairs = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        # Common prefix / suffix never need anchoring
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            pairs.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            pairs.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchor_pairs(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            region_pairs = _myers_pairs(a, b, alo, ahi, blo, bhi)
+            if region_pairs:
+                pairs.extend(region_pairs)
+            # None/empty: region is reported as a single replace block
+            continue
+
+        previous_i, previous_j = alo, blo
+        for ai, bj in anchors:
+            pairs.append((ai, bj))
+            regions.append((previous_i, ai, previous_j, bj))
+            previous_i, previous_j = ai + 1, bj + 1
+        regions.append((previous_i, ahi, previous_j, bhi))
+    pairs.sort()
+    return pairs
+
+
+def _git_hunk_opcodes(file_path, original_lines, staged_lines):
+    """
+    Builds opcodes from 'git diff --cached -U0' hunks (HEAD vs index).
+    Returns None if git is unavailable or its hunks don't line up with the given content.
+    """
+    try:
+        output = subprocess.check_output(
+            ["git", "diff", "--cached", "-U0", "--no-color", "--no-ext-diff", "--no-renames", "--", file_path],
+            stderr=subprocess.DEVNULL
+        ).decode('utf-8', errors='replace')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    len_a, len_b = len(original_lines), len(staged_lines)
+    opcodes = []
+    i = j = 0
+    for line in output.splitlines():
+        match = _HUNK_HEADER.match(line)
+        if not match:
+            continue
+        old_start, old_count = int(match.group(1)), int(match.group(2) or 1)
+        new_start, new_count = int(match.group(3)), int(match.group(4) or 1)
+        # A zero count means the hunk sits *after* the given line number
+        i1 = old_start if old_count == 0 else old_start - 1
+        j1 = new_start if new_count == 0 else new_start - 1
+        i2, j2 = i1 + old_count, j1 + new_count
+        if i1 < i or j1 < j or i2 > len_a or j2 > len_b or i1 - i != j1 - j:
+            return None
+        if i < i1:
+            opcodes.append(('equal', i, i1, j, j1))
+        tag = 'replace' if old_count and new_count else 'delete' if old_count else 'insert'
+        opcodes.append((tag, i1, i2, j1, j2))
+        i, j = i2, j2
+    if len_a - i != len_b - j:
+        return None
+    if i < len_a:
+        opcodes.append(('equal', i, len_a, j, len_b))
+
+    # git splits lines differently from str.splitlines() in corner cases; only trust verified hunks
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal' and original_lines[i1:i2] != staged_lines[j1:j2]:
+            return None
+    return opcodes
+
+
+def compute_diff_opcodes(original_lines, staged_lines, backend='auto', file_path=None):
+    """
+    Returns (opcodes, backend_used) for two lists of lines using the requested backend.
+    The 'git' backend needs file_path and falls back to 'patience' if its hunks can't be used.
+    """
+    if backend not in DIFF_BACKENDS:
+        raise ValueError(f"Unknown diff backend '{backend}'. Choose from: {', '.join(DIFF_BACKENDS)}")
+
+    if backend == 'auto':
+        small = len(original_lines) + len(staged_lines) <= AUTO_DIFFLIB_MAX_LINES
+        backend = 'difflib' if small else 'patience'
+
+    if backend == 'git':
+        opcodes = _git_hunk_opcodes(file_path, original_lines, staged_lines) if file_path else None
+        if opcodes is not None:
+            return opcodes, 'git'
+        backend = 'patience'
+
+    if backend == 'difflib':
+        matcher = difflib.SequenceMatcher(None, original_lines, staged_lines, autojunk=False)
+        return matcher.get_opcodes(), 'difflib'
+
+    pairs = _patience_pairs(original_lines, staged_lines)
+    return _opcodes_from_matching_pairs(pairs, len(original_lines), len(staged_lines)), 'patience'
+
+
+def group_opcodes(opcodes, context_lines=3):
+    """
+    Groups opcodes into hunks with up to context_lines of surrounding 'equal' lines, like
+    difflib.SequenceMatcher.get_grouped_opcodes but for opcodes from any backend.
+    """
+    codes = list(opcodes)
+    if not codes:
+        return []
+    # Trim the leading/trailing 'equal' runs down to the context size
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context_lines), i2, max(j1, j2 - context_lines), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context_lines), j1, min(j2, j1 + context_lines)
+
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # An 'equal' run longer than two contexts ends one hunk and starts the next
+        if tag == 'equal' and i2 - i1 > 2 * context_lines:
+            group.append((tag, i1, min(i2, i1 + context_lines), j1, min(j2, j1 + context_lines)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context_lines), max(j1, j2 - context_lines)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+    return [group for group in groups if any(tag != 'equal' for tag, *_ in group)]
+
+
+def _hunk_range(start, end):
+    """'start,count' as used in unified diff hunk headers (1-based; empty ranges name the line before)."""
+    length = end - start
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start + 1 if length else start},{length}"
+
+
+def format_unified_diff(original_lines, staged_lines, opcodes, context_lines=3):
+    """Unified-diff hunks (no file headers) for the given opcodes, one string with '\n' line ends."""
+    output = []
+    for group in group_opcodes(opcodes, context_lines):
+        first, last = group[0], group[-1]
+        output.append(f"@@ -{_hunk_range(first[1], last[2])} +{_hunk_range(first[3], last[4])} @@")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                output.extend(' ' + line for line in original_lines[i1:i2])
+                continue
+            output.extend('-' + line for line in original_lines[i1:i2])
+            output.extend('+' + line for line in staged_lines[j1:j2])
+    return '\n'.join(output)
+
+
+def build_change_context(original_text, staged_text, backend='auto', file_path=None, context_lines=2):
+    """
+    Compact description of what changed between the HEAD and staged text: unified-diff hunks with
+    a little context. Returns '' when nothing changed.
+    """
+    original_lines = original_text.splitlines()
+    staged_lines = staged_text.splitlines()
+    opcodes, _ = compute_diff_opcodes(original_lines, staged_lines, backend, file_path)
+    return format_unified_diff(original_lines, staged_lines, opcodes, context_lines)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Leveled, buffered event log for the analysis pipeline, with an optional JSON-lines sink.
+
+Console lines go to sys.stdout (looked up on every write, so contextlib.redirect_stdout still
+captures a worker's output) when they are at or above the configured level:
+  quiet   -> RESULT and up: one result line per file, warnings, errors and the run totals
+  normal  -> INFO and up: step banners, model choices, score summaries
+  verbose -> DEBUG and up: every git, diff, tool, metrics and LLM detail
+Lines are not flushed one by one: the hook's output is block-buffered and flush() runs at file
+boundaries and before worker processes start. On an interactive terminal INFO and higher lines
+are flushed right away so progress stays visible.
+
+The JSON-lines sink (configure(json_path=...)) receives every message, whatever the console
+level, plus one 'span' record per finished tracing span (stage, name, duration, outcome and the
+span's args, see tracing.py). Records carry ts, event, file and stage (messages also their
+level), so CI tools can consume results without scraping the console. Worker processes collect
+their records in memory and hand them to the parent (drain_records/add_records), which writes
+them in input order.
+"""
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from green_code_analyzer.tracing import get_tracer
+
+DEBUG = 10
+INFO = 20
+RESULT = 25
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', RESULT: 'result', WARNING: 'warning', ERROR: 'error'}
+VERBOSITY_LEVELS = {'quiet': RESULT, 'normal': INFO, 'verbose': DEBUG}
+
+
+def level_for_text(text, default=DEBUG):
+    """Level implied by a pre-formatted log line's ERROR/WARNING tag (default without one)."""
+    if 'ERROR' in text:
+        return ERROR
+    if 'WARNING' in text:
+        return WARNING
+    return default
+
+
+class EventLogger:
+    """Leveled console output plus an optional JSON-lines record sink. Thread-safe."""
+
+    def __init__(self):
+        self.level = INFO
+        self.file = None # Path of the file being analyzed, added to every record
+        self._sink = None
+        self._records = None # Worker processes collect records here instead of writing them
+        self._flush_level = None
+        self._lock = threading.Lock()
+
+    def configure(self, level=None, json_path=None, collect=False):
+        """
+        Sets the console level and (re)opens the sink: json_path appends records to that file,
+        collect keeps them in memory for drain_records. Raises OSError if json_path can't be opened.
+        """
+        if level is not None:
+            self.level = level
+        self.close()
+        if json_path:
+            self._sink = open(json_path, 'a', encoding='utf-8')
+        elif collect:
+            self._records = []
+        if self.records_enabled:
+            get_tracer().add_listener(self._on_span)
+        else:
+            get_tracer().remove_listener(self._on_span)
+        try:
+            self._flush_level = INFO if sys.stdout.isatty() else None
+        except (AttributeError, ValueError):
+            self._flush_level = None
+
+    def configure_worker(self, level, collect):
+        """
+        Process pool initializer hook: forgets the sink file inherited from the parent (without
+        flushing or closing it, the parent owns it) and collects records for the parent instead.
+        """
+        self._sink = None
+        self.configure(level=level, collect=collect)
+
+    @property
+    def records_enabled(self):
+        return self._sink is not None or self._records is not None
+
+    def worker_settings(self):
+        """Arguments for configure_worker in a worker process."""
+        return {'level': self.level, 'collect': self.records_enabled}
+
+    def log(self, level, message, **fields):
+        if level >= self.level:
+            stream = sys.stdout
+            stream.write(f"{message}\n")
+            if self._flush_level is not None and level >= self._flush_level:
+                stream.flush()
+        if self.records_enabled:
+            self.record('message', level=LEVEL_NAMES.get(level, str(level)), message=message.strip(), **fields)
+
+    def record(self, event, **fields):
+        """Writes one structured record to the sink (no-op without one)."""
+        if not self.records_enabled:
+            return
+        entry = {'ts': round(time.time(), 6), 'event': event, 'file': self.file,
+                 'stage': get_tracer().current_stage()}
+        entry.update(fields)
+        with self._lock:
+            if self._records is not None:
+                self._records.append(entry)
+            elif self._sink is not None:
+                self._sink.write(json.dumps(entry, default=str) + "\n")
+
+    def _on_span(self, event):
+        args = dict(event['args'])
+        outcome = args.pop('outcome', None) or ('error' if 'error' in args else 'ok')
+        self.record('span', name=event['name'], duration=round(event['dur'] / 1e6, 6),
+                    outcome=outcome, file=args.pop('file', self.file), stage=event['cat'], args=args)
+
+    def drain_records(self):
+        """Returns and forgets the records collected in this (worker) process."""
+        with self._lock:
+            records = self._records or []
+            if self._records is not None:
+                self._records = []
+        return records
+
+    def add_records(self, records):
+        """Writes records collected by a worker process to this process's sink."""
+        with self._lock:
+            if self._sink is not None:
+                for entry in records:
+                    self._sink.write(json.dumps(entry, default=str) + "\n")
+            elif self._records is not None:
+                self._records.extend(records)
+
+    @contextmanager
+    def file_context(self, file_path):
+        """Tags every record logged inside the block with file_path."""
+        previous, self.file = self.file, file_path
+        try:
+            yield
+        finally:
+            self.file = previous
+
+    def flush(self):
+        try:
+            sys.stdout.flush()
+        except (AttributeError, ValueError):
+            pass
+        with self._lock:
+            if self._sink is not None:
+                self._sink.flush()
+
+    def close(self):
+        """Flushes and closes the sink; console logging keeps working."""
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+            self._sink = None
+            self._records = None
+
+
+_EVENT_LOG = EventLogger()
+
+
+def get_event_log():
+    """The process-wide EventLogger."""
+    return _EVENT_LOG
+
+
+def log_debug(message, **fields):
+    _EVENT_LOG.log(DEBUG, message, **fields)
+
+
+def log_info(message, **fields):
+    _EVENT_LOG.log(INFO, message, **fields)
+
+
+def log_result(message, **fields):
+    _EVENT_LOG.log(RESULT, message, **fields)
+
+
+def log_warning(message, **fields):
+    _EVENT_LOG.log(WARNING, message, **fields)
+
+
+def log_error(message, **fields):
+    _EVENT_LOG.log(ERROR, message, **fields)
+
+
+def log_captured(message):
+    """Logs a line captured through a log= callback at the level its ERROR/WARNING tag implies."""
+    _EVENT_LOG.log(level_for_text(message), message)
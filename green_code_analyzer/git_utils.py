@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Process-frugal Git access for the sustainability hook.
+
+Instead of spawning 4-5 'git' processes per analyzed file, GitRepoSnapshot takes one
+'git ls-files -s' and one 'git diff-index --cached' snapshot of the repository and
+answers tracked/staged/exists-in-HEAD questions from memory. Blob contents are read
+through a single long-lived 'git cat-file --batch' process (GitObjectReader).
+"""
+import os
+import subprocess
+import threading
+
+
+class GitError(Exception):
+    """Raised when a git command needed by the backend cannot be run."""
+
+
+def _run_git(args, cwd=None):
+    """Runs a git command and returns raw stdout bytes. Raises GitError on failure."""
+    try:
+        return subprocess.check_output(["git"] + list(args), cwd=cwd, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        raise GitError("'git' command not found")
+    except subprocess.CalledProcessError as e:
+        raise GitError(f"'git {' '.join(args)}' failed (Exit Code {e.returncode})")
+
+
+def decode_blob(data):
+    """Decodes blob bytes like 'git show' with universal_newlines=True did (UTF-8, \\n newlines)."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class GitObjectReader:
+    """
+    Wraps one long-lived 'git cat-file --batch' process.
+    Any number of objects (blob SHAs or '<rev>:<path>' names) can be read over the same pipe.
+    """
+
+    def __init__(self, repo_dir=None):
+        self.repo_dir = repo_dir
+        self._process = None
+        self._lock = threading.Lock()
+        self.objects_read = 0
+
+    def _ensure_process(self):
+        if self._process is None or self._process.poll() is not None:
+            try:
+                self._process = subprocess.Popen(
+                    ["git", "cat-file", "--batch"],
+                    cwd=self.repo_dir,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                raise GitError("'git' command not found")
+        return self._process
+
+    def _read_response(self, process):
+        """Reads one '<sha> <type> <size>\\n<content>\\n' response. Returns bytes or None if missing."""
+        header = process.stdout.readline()
+        if not header:
+            raise GitError("'git cat-file --batch' exited unexpectedly")
+        parts = header.rstrip(b'\n').split(b' ')
+        # '<name> missing' / '<name> ambiguous' responses carry no content
+        if len(parts) != 3 or parts[-1] in (b'missing', b'ambiguous'):
+            return None
+        size = int(parts[2])
+        data = process.stdout.read(size)
+        process.stdout.read(1) # Trailing newline after the content
+        self.objects_read += 1
+        return data
+
+    def read(self, object_name):
+        """Returns the raw bytes of a single object, or None if it does not exist."""
+        return self.read_many([object_name])[0]
+
+    def read_many(self, object_names):
+        """
+        Returns raw bytes (or None) for every object name, in order, over one pipe.
+        Requests are written from a helper thread so large responses cannot deadlock the pipe.
+        """
+        object_names = list(object_names)
+        if not object_names:
+            return []
+        with self._lock:
+            process = self._ensure_process()
+            request = b''.join(name.encode('utf-8', errors='surrogateescape') + b'\n' for name in object_names)
+
+            def _write_requests():
+                try:
+                    process.stdin.write(request)
+                    process.stdin.flush()
+                except (BrokenPipeError, OSError):
+                    pass # Reader side reports the failure
+
+            writer = threading.Thread(target=_write_requests, daemon=True)
+            writer.start()
+            try:
+                return [self._read_response(process) for _ in object_names]
+            finally:
+                writer.join()
+
+    def close(self):
+        """Terminates the cat-file process (idempotent)."""
+        with self._lock:
+            if self._process is not None:
+                try:
+                    self._process.stdin.close()
+                    self._process.wait(timeout=5)
+                except Exception:
+                    self._process.kill()
+                self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class GitRepoSnapshot:
+    """
+    Snapshot of the index and its differences to HEAD, taken with two git commands.
+
+    - index_blobs: repo-relative path -> blob SHA in the index ('git ls-files -s -z')
+    - head_blobs:  repo-relative path -> blob SHA in HEAD, for every indexed path that exists in HEAD
+    - staged_paths: paths whose index blob differs from HEAD ('git diff-index --cached HEAD')
+    """
+
+    def __init__(self, repo_dir=None):
+        top_level = _run_git(["rev-parse", "--show-toplevel"], cwd=repo_dir).decode('utf-8').strip()
+        self.top_level = os.path.realpath(top_level)
+        self.index_blobs = {}
+        self.head_blobs = {}
+        self.staged_paths = set()
+        self.has_head = True
+        self.reader = GitObjectReader(self.top_level)
+        self._prefetched_blobs = {} # blob SHA -> bytes, filled by prefetch() and kept until close()
+        self._load_index()
+        self._load_head_diff()
+
+    def _load_index(self):
+        output = _run_git(["ls-files", "-s", "-z", "--full-name"], cwd=self.top_level)
+        for entry in output.split(b'\0'):
+            if not entry:
+                continue
+            # '<mode> <sha> <stage>\t<path>'
+            meta, _, raw_path = entry.partition(b'\t')
+            mode, sha, stage = meta.split(b' ')
+            if stage != b'0':
+                continue # Unmerged entries are not analyzable content
+            path = raw_path.decode('utf-8', errors='surrogateescape')
+            self.index_blobs[path] = sha.decode('ascii')
+
+    def _load_head_diff(self):
+        try:
+            output = _run_git(["diff-index", "--cached", "-z", "--no-renames", "HEAD"], cwd=self.top_level)
+        except GitError:
+            # No HEAD yet (initial commit): nothing exists in HEAD, everything indexed is staged
+            self.has_head = False
+            self.staged_paths = set(self.index_blobs)
+            return
+
+        # Unchanged tracked files have the same blob in HEAD and the index
+        self.head_blobs = dict(self.index_blobs)
+        fields = output.split(b'\0')
+        for meta, raw_path in zip(fields[0::2], fields[1::2]):
+            if not meta:
+                continue
+            # ':<old mode> <new mode> <old sha> <new sha> <status>'
+            _, _, old_sha, _, status = meta.lstrip(b':').split(b' ')
+            path = raw_path.decode('utf-8', errors='surrogateescape')
+            self.staged_paths.add(path)
+            if status == b'A':
+                self.head_blobs.pop(path, None)
+            else:
+                self.head_blobs[path] = old_sha.decode('ascii')
+
+    def repo_path(self, file_path):
+        """Converts a filesystem path into the repo-relative, '/'-separated form git uses."""
+        absolute = os.path.realpath(os.path.abspath(file_path))
+        return os.path.relpath(absolute, self.top_level).replace(os.sep, '/')
+
+    def get_file_info(self, file_path):
+        """Same shape as get_git_file_info: is_tracked / is_staged / exists_in_head."""
+        path = self.repo_path(file_path)
+        is_tracked = path in self.index_blobs
+        return {
+            "is_tracked": is_tracked,
+            "is_staged": is_tracked and path in self.staged_paths,
+            "exists_in_head": is_tracked and path in self.head_blobs,
+        }
+
+    def _read_blob(self, sha):
+        data = self._prefetched_blobs.get(sha)
+        return data if data is not None else self.reader.read(sha)
+
+    def get_staged_bytes(self, file_path):
+        """Raw index blob for the path, or None if the path is not in the index."""
+        sha = self.index_blobs.get(self.repo_path(file_path))
+        return self._read_blob(sha) if sha else None
+
+    def get_head_bytes(self, file_path):
+        """Raw HEAD blob for the path, or None if the path does not exist in HEAD."""
+        sha = self.head_blobs.get(self.repo_path(file_path))
+        return self._read_blob(sha) if sha else None
+
+    def prefetch(self, file_paths):
+        """Reads the staged and HEAD blobs of many files in one round trip over the cat-file pipe."""
+        wanted = []
+        for file_path in file_paths:
+            path = self.repo_path(file_path)
+            for blobs in (self.index_blobs, self.head_blobs):
+                sha = blobs.get(path)
+                if sha and sha not in self._prefetched_blobs and sha not in wanted:
+                    wanted.append(sha)
+        for sha, data in zip(wanted, self.reader.read_many(wanted)):
+            if data is not None:
+                self._prefetched_blobs[sha] = data
+        return len(wanted)
+
+    def close(self):
+        self._prefetched_blobs.clear()
+        self.reader.close()
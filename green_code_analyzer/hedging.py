@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Hedged LLM requests: when the primary backend has not answered within its usual (p90) latency,
+the same request is sent to a secondary model or OpenAI-compatible endpoint, and the first
+response that passes validation wins. The other request is told to stop through a CancelEvent:
+streamed requests register a callback that closes their response, so even a stalled stream is cut
+off at once. Both requests run on daemon threads, so a loser that can't stop never delays the
+end of the run; its result is dropped.
+
+LatencyTracker keeps recent primary latencies (optionally persisted, so one-shot hook runs learn
+from earlier ones) and HedgeStats counts hedges and wins so the extra cost stays visible.
+"""
+import queue
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """Rolling window of request latencies (seconds) with percentile lookup."""
+
+    def __init__(self, max_samples=200, samples=()):
+        self._samples = deque((float(sample) for sample in samples), maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(float(seconds))
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def percentile(self, percent, min_samples=1):
+        """Nearest-rank percentile of the window, or None with fewer than min_samples samples."""
+        ordered = sorted(self.samples())
+        if not ordered or len(ordered) < min_samples:
+            return None
+        rank = max(1, -(-len(ordered) * percent // 100)) # ceil(n * p / 100)
+        return ordered[int(rank) - 1]
+
+
+class HedgeStats:
+    """Counts hedged requests and which backend answered first, for the run report."""
+
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+        self.both_failed = 0
+        self._lock = threading.Lock()
+
+    COUNTERS = ('requests', 'hedged', 'primary_wins', 'secondary_wins', 'both_failed')
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def drain(self):
+        """Returns and resets the counters, e.g. for a worker process to hand them to the parent."""
+        with self._lock:
+            counts = {counter: getattr(self, counter) for counter in self.COUNTERS}
+            for counter in self.COUNTERS:
+                setattr(self, counter, 0)
+        return counts
+
+    def add(self, counts):
+        """Adds counters returned by drain() (in another process) to these totals."""
+        with self._lock:
+            for counter in self.COUNTERS:
+                setattr(self, counter, getattr(self, counter) + counts.get(counter, 0))
+
+    def stats_line(self):
+        """One-line hedge rate / win ratio summary."""
+        if not self.requests:
+            return "no hedgeable requests"
+        line = f"{self.hedged}/{self.requests} request(s) hedged ({self.hedged / self.requests:.0%})"
+        if self.hedged:
+            line += (f", hedge won {self.secondary_wins}, primary won {self.primary_wins}"
+                     f" ({self.secondary_wins / self.hedged:.0%} hedge win ratio)")
+            if self.both_failed:
+                line += f", {self.both_failed} with no valid response"
+        return line
+
+
+class CancelEvent(threading.Event):
+    """threading.Event that also runs callbacks registered with on_set (e.g. closing a stream) when set."""
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+
+    def on_set(self, callback):
+        """Runs callback() when the event is set, or right away if it already is."""
+        with self._callback_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self._callback_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass # Cancelling is best effort; the request is abandoned either way
+
+
+def run_hedged(primary, secondary, hedge_delay, accept=None, stats=None):
+    """
+    Calls primary(cancelled) and, if it has not finished after hedge_delay seconds, also
+    secondary(cancelled); both get their own CancelEvent that is set once the other wins.
+    A hedged result only wins if accept(result) is true (no accept: any result); a failed or
+    rejected response waits for the other one. Returns (result, winner) with winner 'primary' or
+    'secondary'. If neither produces an accepted response, the primary's outcome is returned or
+    its exception re-raised.
+    Without hedging (primary answered in time) the primary's outcome is returned as is.
+    """
+    stats = stats or HedgeStats()
+    stats.count('requests')
+    cancel_events = {'primary': CancelEvent(), 'secondary': CancelEvent()}
+    finished = queue.Queue() # (name, result, exception) of every request that returned
+
+    def start(name, request):
+        def run():
+            try:
+                finished.put((name, request(cancel_events[name]), None))
+            except BaseException as e:
+                finished.put((name, None, e))
+        # Daemon threads: an abandoned request must not keep the process alive at exit
+        threading.Thread(target=run, name=f"hedged-{name}", daemon=True).start()
+
+    start('primary', primary)
+    try:
+        _, result, error = finished.get(timeout=hedge_delay)
+    except queue.Empty:
+        pass
+    else:
+        if error is not None:
+            raise error
+        return result, 'primary'
+
+    stats.count('hedged')
+    start('secondary', secondary)
+    outcomes = {} # name -> (result, exception) of a finished, rejected or failed request
+    while len(outcomes) < 2:
+        name, result, error = finished.get()
+        outcomes[name] = (result, error)
+        if error is None and (accept is None or accept(result)):
+            for other, event in cancel_events.items():
+                if other != name:
+                    event.set()
+            stats.count(f'{name}_wins')
+            return result, name
+    stats.count('both_failed')
+    result, error = outcomes['primary']
+    if error is not None:
+        raise error
+    return result, 'primary'
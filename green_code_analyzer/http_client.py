@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP client for the Groq (OpenAI-compatible) chat completion endpoint.
+
+All entry points (main.py, stream.py, test_streamlit.py) send their requests through one
+process-wide LLMHttpClient, which provides:
+  - a pooled requests.Session, so every request after the first reuses a keep-alive TLS connection
+  - retries with exponential backoff and full jitter on 429 / 5xx responses and connection errors
+  - respect for 'retry-after' and Groq's 'x-ratelimit-*' headers (waits until the advertised reset
+    instead of guessing, and holds back new requests once the remaining quota reaches zero)
+  - an optional per-run request budget, so a runaway batch cannot burn through the daily quota
+It also reads streamed (server-sent events) chat completions, so callers can show tokens as they
+arrive and stop reading a response that is already unusable.
+
+requests (with urllib3, certifi and charset_normalizer) takes longer to import than the rest of
+the hook together, so it is only imported once a client is created: runs that never reach the
+LLM (--skip-llm, perfect scores, cache hits) don't load it at all.
+"""
+import functools
+import json
+import random
+import re
+import threading
+import time
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0  # Seconds; attempt n waits up to base * 2**n (full jitter)
+DEFAULT_BACKOFF_MAX = 30.0  # Upper bound for one computed backoff delay
+DEFAULT_MAX_RETRY_WAIT = 60.0 # Give up instead of sleeping longer than this for one retry
+
+# Groq reports resets as Go-style durations, e.g. "2m59.56s", "7.66s" or "120ms"
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+
+@functools.lru_cache(maxsize=None)
+def _request_budget_exceeded_class():
+    import requests
+
+    class RequestBudgetExceeded(requests.exceptions.RequestException):
+        """Raised instead of sending a request once the per-run request budget is used up."""
+
+    RequestBudgetExceeded.__module__ = __name__
+    RequestBudgetExceeded.__qualname__ = 'RequestBudgetExceeded' # Picklable through __getattr__ below
+    return RequestBudgetExceeded
+
+
+def __getattr__(name):
+    # RequestBudgetExceeded subclasses requests' RequestException, so it is created on first use
+    if name == 'RequestBudgetExceeded':
+        return _request_budget_exceeded_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LLMStreamAborted(ValueError):
+    """Raised by a stream callback to stop reading a completion that is clearly going to be rejected."""
+
+
+def parse_duration_seconds(value):
+    """Seconds for a 'retry-after' / 'x-ratelimit-reset-*' header value, or None if unparseable."""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value)) # Plain seconds
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts and ''.join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    import email.utils # Rarely needed, and it pulls in socket/datetime/calendar
+    try:
+        # HTTP-date form of retry-after
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def rate_limit_wait_seconds(headers):
+    """
+    How long the server asked us to wait, from 'retry-after' or, failing that, the reset time of
+    whichever 'x-ratelimit-*' quota (requests or tokens) is exhausted. None if nothing is advertised.
+    """
+    retry_after = parse_duration_seconds(headers.get('retry-after'))
+    if retry_after is not None:
+        return retry_after
+    waits = []
+    for quota in ('requests', 'tokens'):
+        remaining = headers.get(f'x-ratelimit-remaining-{quota}')
+        reset = parse_duration_seconds(headers.get(f'x-ratelimit-reset-{quota}'))
+        if reset is not None and remaining is not None and remaining.strip() in ('0', '0.0'):
+            waits.append(reset)
+    return max(waits) if waits else None
+
+
+class LLMHttpClient:
+    """Pooled, rate-limit aware POST client. Thread-safe; counters feed the run summary."""
+
+    COUNTERS = ('requests_sent', 'retries', 'rate_limit_waits', 'budget_rejections')
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_max=DEFAULT_BACKOFF_MAX, max_retry_wait=DEFAULT_MAX_RETRY_WAIT,
+                 request_budget=None, pool_maxsize=32, log=print):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_wait = max_retry_wait
+        self.request_budget = request_budget # None = unlimited; counts every attempt, retries included
+        self.log = log
+        import requests
+        self.session = requests.Session()
+        # Enough pooled keep-alive connections for every concurrent block request
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.requests_sent = 0
+        self.retries = 0
+        self.rate_limit_waits = 0
+        self.budget_rejections = 0
+        self._not_before = 0.0 # Monotonic time before which no new request is sent (exhausted quota)
+        self._lock = threading.Lock()
+
+    def _reserve_request(self):
+        """Counts one attempt against the budget, or raises RequestBudgetExceeded."""
+        with self._lock:
+            if self.request_budget is not None and self.requests_sent >= self.request_budget:
+                self.budget_rejections += 1
+                raise _request_budget_exceeded_class()(
+                    f"LLM request budget of {self.request_budget} request(s) for this run is used up")
+            self.requests_sent += 1
+            return max(0.0, self._not_before - time.monotonic())
+
+    def _hold_back(self, seconds):
+        """Delays every new request until the advertised quota reset."""
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        """
+        POSTs with retries and returns the final requests.Response (which may still be a 4xx/5xx
+        once retries are exhausted, so callers keep their own status handling).
+        Raises RequestBudgetExceeded, or the last requests exception if every attempt failed to connect.
+        """
+        import requests
+        attempt = 0
+        while True:
+            wait = self._reserve_request()
+            if wait > 0:
+                with self._lock:
+                    self.rate_limit_waits += 1
+                self.log(f"    Waiting {wait:.1f}s for the LLM API rate limit to reset...")
+                time.sleep(wait)
+            try:
+                response = self.session.post(url, headers=headers, json=json, timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                # Read timeouts are not caught here: the caller's timeout is already its latency budget
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                self.log(f"    Connection error ({e.__class__.__name__}), retrying in {delay:.1f}s "
+                         f"(attempt {attempt + 2}/{self.max_retries + 1})...")
+            else:
+                server_wait = rate_limit_wait_seconds(response.headers)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    if server_wait is not None:
+                        self._hold_back(server_wait) # Quota just ran out: pace the next request
+                    return response
+                if attempt >= self.max_retries:
+                    return response
+                delay = server_wait if server_wait is not None else self._backoff_delay(attempt)
+                if delay > self.max_retry_wait:
+                    self.log(f"    Server asked to wait {delay:.0f}s (HTTP {response.status_code}), "
+                             f"more than the {self.max_retry_wait:.0f}s retry limit. Giving up.")
+                    return response
+                self.log(f"    HTTP {response.status_code} from LLM API, retrying in {delay:.1f}s "
+                         f"(attempt {attempt + 2}/{self.max_retries + 1})...")
+                response.close()
+                if response.status_code == 429:
+                    # Every thread (this one included) waits for the same reset before its next request
+                    self._hold_back(delay)
+                    delay = 0
+            with self._lock:
+                self.retries += 1
+            if delay:
+                time.sleep(delay)
+            attempt += 1
+
+    def drain(self):
+        """Returns and resets the counters, e.g. for a worker process to hand them to the parent."""
+        with self._lock:
+            counts = {counter: getattr(self, counter) for counter in self.COUNTERS}
+            for counter in self.COUNTERS:
+                setattr(self, counter, 0)
+        return counts
+
+    def add(self, counts):
+        """Adds counters returned by drain() (in another process) to these totals."""
+        with self._lock:
+            for counter in self.COUNTERS:
+                setattr(self, counter, getattr(self, counter) + counts.get(counter, 0))
+
+    def stats_line(self):
+        """One-line request/retry summary for the run report."""
+        line = (f"{self.requests_sent} request(s), {self.retries} retried, "
+                f"{self.rate_limit_waits} rate-limit wait(s)")
+        if self.request_budget is not None:
+            line += f", budget {self.requests_sent}/{self.request_budget}"
+            if self.budget_rejections:
+                line += f" ({self.budget_rejections} request(s) refused)"
+        return line
+
+    def close(self):
+        self.session.close()
+
+
+def abort_response(response):
+    """
+    Closes a streamed response from another thread. The socket is shut down first: closing alone
+    does not wake a reader blocked waiting for the next chunk of a stalled stream.
+    """
+    import socket
+    connection = getattr(getattr(response, 'raw', None), '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass # Already closed
+    response.close()
+
+
+def read_chat_completion_stream(response, on_delta=None, max_latency=None, started=None):
+    """
+    Accumulates the content deltas of a streamed chat completion (request sent with "stream": true)
+    and returns the full text. on_delta(delta, text_so_far) runs after every delta and may raise
+    (e.g. LLMStreamAborted) to stop early. Raises requests.exceptions.Timeout once more than
+    max_latency seconds have passed since `started` (time.monotonic(), default: now), and ValueError
+    on a malformed event. The response is closed in every case, releasing its pooled connection.
+    """
+    import requests
+    deadline = None
+    if max_latency is not None:
+        deadline = (time.monotonic() if started is None else started) + max_latency
+    text = ''
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if deadline is not None and time.monotonic() > deadline:
+                raise requests.exceptions.Timeout(
+                    f"LLM stream exceeded its {max_latency:.0f}s latency budget "
+                    f"({len(text)} chars received)")
+            if not line or not line.startswith('data:'):
+                continue # Keep-alive blank lines, SSE comments and other fields
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            try:
+                event = json.loads(data)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Malformed LLM stream event: {e}") from e
+            if event.get('error'):
+                raise ValueError(f"LLM stream reported an error: {event['error']}")
+            choices = event.get('choices') or []
+            delta = (choices[0].get('delta') or {}).get('content') if choices else None
+            if not delta:
+                continue
+            text += delta
+            if on_delta is not None:
+                on_delta(delta, text)
+    finally:
+        response.close()
+    return text
+
+
+# --- Process-wide client shared by every entry point ---
+_CLIENT = None
+_CLIENT_SETTINGS = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def configure_http_client(**settings):
+    """Sets LLMHttpClient keyword arguments (e.g. request_budget) and drops any existing client."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT_SETTINGS.clear()
+        _CLIENT_SETTINGS.update(settings)
+        _CLIENT = None
+
+
+def get_http_client(create=True):
+    """Returns the process-wide LLMHttpClient, creating it on first use (create=False: None until then)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None and create:
+            _CLIENT = LLMHttpClient(**_CLIENT_SETTINGS)
+        return _CLIENT
+
+
+def reset_http_client():
+    """Forgets the current client (e.g. in a forked worker that must not share its connections)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = None
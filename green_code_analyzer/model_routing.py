@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Model routing: picks the Groq model for each LLM request from the size of the code, the
+sustainability scores of the file and its language, instead of one hardcoded model.
+
+A routing table is a dict (JSON-serializable, so it can be loaded with --llm-routing FILE):
+  - 'default_model':      used when no rule matches
+  - 'long_context_model': used when the estimated prompt + completion would overflow the chosen
+                          model's context window (see 'context_tokens')
+  - 'context_tokens':     {model: context window in tokens}, merged over MODEL_CONTEXT_TOKENS
+  - 'rules':              checked in order, the first match wins. Every condition a rule leaves
+                          out matches; a rule with score conditions never matches without scores.
+      max_code_tokens / min_code_tokens  estimated tokens of the code being optimized
+      min_score / max_score              total file score (0-100, calculate_total_score)
+      low_metric_scores                  {metric: score}; matches if ANY listed metric scored at or below
+      languages                          list of scoring keys ('python', 'javascript', ...)
+"""
+import json
+
+MODEL_CONTEXT_TOKENS = {
+    'llama3-8b-8192': 8192,
+    'llama3-70b-8192': 8192,
+    'mixtral-8x7b-32768': 32768,
+}
+
+DEFAULT_ROUTING = {
+    'default_model': 'llama3-8b-8192',
+    'long_context_model': 'mixtral-8x7b-32768',
+    'rules': [
+        # Small edits and code that already scores well: the fastest model is good enough
+        {'name': 'small code', 'max_code_tokens': 200, 'model': 'llama3-8b-8192'},
+        {'name': 'high score', 'min_score': 85, 'model': 'llama3-8b-8192'},
+        # Complex, poorly scoring code is where a larger model pays off
+        {'name': 'complex low-scoring code', 'max_score': 70,
+         'low_metric_scores': {'cyclomatic_complexity_max': 40, 'cyclomatic_complexity_avg': 40, 'function_loc_max': 40},
+         'model': 'llama3-70b-8192'},
+        {'name': 'low score', 'max_score': 50, 'model': 'llama3-70b-8192'},
+    ],
+}
+
+
+def load_routing_config(path):
+    """Reads a routing table from a JSON file; raises ValueError if it has no default model."""
+    with open(path, 'r', encoding='utf-8') as config_file:
+        routing = json.load(config_file)
+    if not isinstance(routing, dict) or not routing.get('default_model'):
+        raise ValueError(f"Routing config '{path}' must be a JSON object with a 'default_model'")
+    return routing
+
+
+def _rule_matches(rule, code_tokens, score, individual_scores, language_key):
+    if 'languages' in rule and language_key not in rule['languages']:
+        return False
+    if 'max_code_tokens' in rule and code_tokens > rule['max_code_tokens']:
+        return False
+    if 'min_code_tokens' in rule and code_tokens < rule['min_code_tokens']:
+        return False
+    if ('min_score' in rule or 'max_score' in rule or 'low_metric_scores' in rule) and score is None:
+        return False
+    if 'min_score' in rule and score < rule['min_score']:
+        return False
+    if 'max_score' in rule and score > rule['max_score']:
+        return False
+    if 'low_metric_scores' in rule:
+        scores = individual_scores or {}
+        if not any(metric in scores and scores[metric]['score'] <= threshold
+                   for metric, threshold in rule['low_metric_scores'].items()):
+            return False
+    return True
+
+
+def route_llm_model(prompt_tokens, code_tokens, max_tokens, score=None, individual_scores=None,
+                    language_key=None, routing=None):
+    """
+    Returns (model, reason) for one request. prompt_tokens is the estimated size of the whole
+    prompt (system + user), code_tokens that of the code inside it, max_tokens the completion budget.
+    """
+    routing = routing or DEFAULT_ROUTING
+    model, reason = routing['default_model'], 'default'
+    for rule in routing.get('rules', []):
+        if _rule_matches(rule, code_tokens, score, individual_scores, language_key):
+            model, reason = rule['model'], rule.get('name', 'rule')
+            break
+
+    context_tokens = dict(MODEL_CONTEXT_TOKENS, **routing.get('context_tokens', {}))
+    needed = prompt_tokens + max_tokens
+    long_context_model = routing.get('long_context_model')
+    if (model in context_tokens and needed > context_tokens[model] and long_context_model
+            and long_context_model != model):
+        reason = f"~{needed} tokens exceed {model}'s {context_tokens[model]}-token context"
+        model = long_context_model
+    return model, reason
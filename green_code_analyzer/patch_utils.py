@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Tolerant unified-diff applier for LLM-generated patches (--llm-output diff).
+
+Models get the mechanics of unified diffs wrong in predictable ways, so hunks are located by
+their content rather than trusted line numbers:
+  - '@@' headers may carry wrong numbers or none at all; the numbers only pick between equally
+    good matches (nearest wins)
+  - context/removed lines are matched exactly first, then ignoring trailing whitespace, then
+    ignoring all leading/trailing whitespace; the file's own text is kept for context lines
+  - up to MAX_FUZZ leading/trailing context lines that match nowhere are dropped (like patch's
+    fuzz factor), and context lines that lost their leading space are accepted
+  - markdown fences, 'diff'/'index'/'---'/'+++' file headers and '\\ No newline' markers are ignored
+Hunks may come in any order but must not overlap. Anything that cannot be placed raises
+PatchApplyError, so the caller can fall back to the original content.
+"""
+import bisect
+import re
+from collections import namedtuple
+
+MAX_FUZZ = 2 # Context lines that may be dropped from each end of a hunk before giving up
+
+_HUNK_HEADER = re.compile(r'^@@\s*-(\d+)(?:,\d+)?\s+\+\d+(?:,\d+)?\s*@@')
+_BARE_HUNK_HEADER = re.compile(r'^@@')
+_GIT_HEADER = re.compile(r'^(?:diff --git |index [0-9a-f]+\.\.[0-9a-f]+)')
+
+# old_start: 1-based line number from the '@@' header (None if missing); lines: [(op, text)] with op in ' -+'
+Hunk = namedtuple('Hunk', ['old_start', 'lines'])
+
+# Line normalizations tried in order when locating a hunk
+_NORMALIZERS = (lambda line: line, str.rstrip, str.strip)
+
+
+class PatchApplyError(ValueError):
+    """Raised when a hunk cannot be located in (or conflicts with) the content being patched."""
+
+
+def _is_file_header(lines, index):
+    """True for 'diff --git' / 'index' lines and '---' + '+++' pairs (not a removed '-- ...' line)."""
+    line = lines[index]
+    if line.startswith('--- '):
+        return index + 1 < len(lines) and lines[index + 1].startswith('+++ ')
+    if line.startswith('+++ '):
+        return index > 0 and lines[index - 1].startswith('--- ')
+    return bool(_GIT_HEADER.match(line))
+
+
+def parse_unified_diff(patch_text):
+    """Parses (possibly sloppy) unified diff text into Hunks. Hunks without any change are dropped."""
+    hunks = []
+    current = None
+    lines = patch_text.splitlines()
+    for index, line in enumerate(lines):
+        if line.startswith('```') or line.startswith('\\'):
+            continue # Markdown fence or '\ No newline at end of file'
+        header = _HUNK_HEADER.match(line)
+        if header or _BARE_HUNK_HEADER.match(line):
+            current = Hunk(int(header.group(1)) if header else None, [])
+            hunks.append(current)
+            continue
+        if _is_file_header(lines, index):
+            current = None # A new file header ends the current hunk
+            continue
+        if current is None:
+            continue # Prose or headers before the first hunk
+        if line[:1] in ('-', '+', ' '):
+            current.lines.append((line[0], line[1:]))
+        else:
+            current.lines.append((' ', line)) # Blank context line, or context that lost its leading space
+    return [hunk for hunk in hunks if any(op != ' ' for op, _ in hunk.lines)]
+
+
+def _find_block(file_lines, normalized_cache, block, expected, level):
+    """Start index of `block` in file_lines under normalization `level`, nearest to `expected`, or None."""
+    normalize = _NORMALIZERS[level]
+    if level not in normalized_cache:
+        normalized = [normalize(line) for line in file_lines]
+        positions = {}
+        for position, line in enumerate(normalized):
+            positions.setdefault(line, []).append(position)
+        normalized_cache[level] = (normalized, positions)
+    normalized, positions = normalized_cache[level]
+    target = [normalize(line) for line in block]
+    candidates = positions.get(target[0], [])
+    if not candidates:
+        return None
+    # Walk outwards from the expected position so the nearest match is found first
+    split = bisect.bisect_left(candidates, expected)
+    before, after = split - 1, split
+    size = len(target)
+    while before >= 0 or after < len(candidates):
+        if after < len(candidates) and (before < 0 or candidates[after] - expected <= expected - candidates[before]):
+            position = candidates[after]
+            after += 1
+        else:
+            position = candidates[before]
+            before -= 1
+        if normalized[position:position + size] == target:
+            return position
+    return None
+
+
+def _locate_hunk(file_lines, normalized_cache, hunk, expected):
+    """
+    Returns (start, hunk_lines) where hunk_lines may have had unmatched edge context trimmed.
+    Raises PatchApplyError if the hunk matches nowhere.
+    """
+    lines = hunk.lines
+    leading = next((i for i, (op, _) in enumerate(lines) if op != ' '), len(lines))
+    trailing = next((i for i, (op, _) in enumerate(reversed(lines)) if op != ' '), len(lines))
+    for fuzz in range(MAX_FUZZ + 1):
+        trimmed = lines[min(fuzz, leading):len(lines) - min(fuzz, trailing)]
+        old_block = [text for op, text in trimmed if op != '+']
+        if not old_block:
+            # Pure insertion without context: trust the header position
+            return max(0, min(expected, len(file_lines))), trimmed
+        for level in range(len(_NORMALIZERS)):
+            start = _find_block(file_lines, normalized_cache, old_block, expected - min(fuzz, leading), level)
+            if start is not None:
+                return start, trimmed
+        if fuzz >= leading and fuzz >= trailing:
+            break # Nothing left to trim
+    first_line = next((text for op, text in lines if op != '+'), '')
+    raise PatchApplyError(f"hunk at line {hunk.old_start or '?'} does not match the file "
+                          f"(first context line: {first_line.strip()[:60]!r})")
+
+
+def apply_unified_diff(original, patch_text):
+    """
+    Applies the unified diff in patch_text to the string `original` and returns the patched string.
+    Line endings and the final-newline state of `original` are preserved. A patch without any hunk
+    returns `original` unchanged. Raises PatchApplyError if a hunk cannot be placed.
+    """
+    hunks = parse_unified_diff(patch_text)
+    if not hunks:
+        return original
+    newline = '\r\n' if '\r\n' in original else '\n'
+    file_lines = original.splitlines()
+    normalized_cache = {}
+
+    placed = []
+    for hunk in hunks:
+        if hunk.old_start is not None:
+            # '-start' counts lines of the original content; a context-free insertion '-N,0' goes after line N
+            pure_insertion = all(op == '+' for op, _ in hunk.lines)
+            expected = hunk.old_start if pure_insertion else hunk.old_start - 1
+        else:
+            expected = placed[-1][0] + placed[-1][1] if placed else 0 # Headerless: right after the previous hunk
+        start, hunk_lines = _locate_hunk(file_lines, normalized_cache, hunk, expected)
+        placed.append((start, sum(1 for op, _ in hunk_lines if op != '+'), hunk_lines))
+
+    placed.sort(key=lambda item: item[0])
+    result = []
+    cursor = 0
+    for start, old_length, hunk_lines in placed:
+        if start < cursor:
+            raise PatchApplyError(f"overlapping hunks around line {start + 1}")
+        result.extend(file_lines[cursor:start])
+        position = start
+        for op, text in hunk_lines:
+            if op == ' ':
+                result.append(file_lines[position]) # Keep the file's own whitespace for context
+                position += 1
+            elif op == '-':
+                position += 1
+            else:
+                result.append(text)
+        cursor = start + old_length
+
+    result.extend(file_lines[cursor:])
+    patched = newline.join(result)
+    if original.endswith(('\n', '\r')) and result:
+        patched += newline
+    return patched
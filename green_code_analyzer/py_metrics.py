@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+In-process Python metrics engine.
+
+Produces the same metric keys get_static_metrics collects for Python from lizard, cloc, radon
+and the import regex, from a single regex token scan instead of three subprocesses:
+
+  - cyclomatic_complexity_max/avg, function_loc_max  (lizard: per-function CCN and NLOC)
+  - loc_code/comment/blank/total_cloc                  (cloc: triple-quoted strings count as comments)
+  - loc_logical_radon                                  (radon raw LLOC rules)
+  - dependency_count                                   (count_python_dependencies' import regex)
+
+The scanner deliberately mirrors lizard's own tokenizer (regex based, indentation decides where
+a function ends) rather than the stdlib tokenize module, which is both slower and sees a few
+constructs differently than lizard does.
+
+compute_python_metrics returns None when the source can't be tokenized (unterminated string,
+unbalanced brackets), so callers can fall back to the external tools.
+"""
+import re
+
+_TOKEN_PATTERN = re.compile(r'''
+    (?P<string>[rRbBuUfF]{0,2}(?:
+        """(?:\\.|[^\\"]|"(?!""))*"""
+      | \'\'\'(?:\\.|[^\\']|'(?!''))*\'\'\'
+      | "(?:\\.|[^\\"\n])*"
+      | '(?:\\.|[^\\'\n])*'))
+  | (?P<comment>\#[^\n]*)
+  | (?P<newline>\n)
+  | (?P<continuation>\\\n)
+  | (?P<number>(?:\d\w*(?:\.\w*)?|\.\d\w*)(?:(?<=[eE])[-+]\d\w*)?)
+  | (?P<name>\w+)
+  | (?P<op>\*\*=?|//=?|>>=?|<<=?|\.\.\.|->|:=|[-+*/%&|^@<>=!]=|[^\s\w])
+''', re.VERBOSE | re.DOTALL)
+
+# count_python_dependencies' pattern, applied per physical line
+_IMPORT_PATTERN = re.compile(r"^[^\S\n]*(?:import|from)[^\S\n]+([a-zA-Z0-9_]+)", re.MULTILINE)
+
+_CONDITION_KEYWORDS = frozenset(('if', 'elif', 'for', 'while', 'except', 'finally', 'and', 'or'))
+_OPEN_BRACKETS = frozenset('([{')
+_CLOSE_BRACKETS = frozenset(')]}')
+# lizard keeps a triple-quoted string in NLOC only right after one of these tokens (assignment,
+# call argument, return, ...); anywhere else it is treated as a comment (see PythonReader.process_token)
+_EXPRESSION_TOKENS = frozenset(('=', '+=', '-=', '*=', '/=', '%=', '//=', '**=', '&=', '|=', '^=',
+                                '<<=', '>>=', '(', 'return', ',', '[', '+', '-', '*', '/', '%'))
+# Augmented assignments lizard splits into '<op>' '=' (so the '=' is what it sees last)
+_SPLIT_ASSIGNMENTS = frozenset(('@=', '**=', '%='))
+# 'case' followed by one of these is a variable, not the match statement soft keyword
+_CASE_VARIABLE_NEXT = frozenset(('=', '.', ':', ',', '+=', '-=', '*=', '/=', '%=', '//=', '**=',
+                                 '&=', '|=', '^=', '<<=', '>>=', ':='))
+
+
+def _string_prefix_and_quote(token_string):
+    """Splits a string token into (prefix letters, opening quote)."""
+    index = 0
+    while token_string[index] not in '\'"':
+        index += 1
+    body = token_string[index:]
+    return token_string[:index], body[:3] if body[:3] in ('"""', "'''") else body[:1]
+
+
+def _is_expression_token(token):
+    return token in _EXPRESSION_TOKENS or token in _SPLIT_ASSIGNMENTS
+
+
+def _scan_fstring(body, triple_quoted):
+    """
+    lizard re-tokenizes every {interpolation} of an f-string (so keywords inside count towards
+    CCN) and turns each literal chunk in between into its own string token.
+    Returns (condition keywords in the interpolations, NLOC lizard drops for the literal chunks).
+    """
+    chunks = [] # (newlines in chunk, last token before the chunk)
+    conditions = 0
+    literal_newlines, has_literal, previous_token = 0, False, 'f'
+    index, length = 0, len(body)
+    while index < length:
+        if body[index:index + 2] in ('{{', '}}'):
+            has_literal = True
+            index += 2
+            continue
+        if body[index] == '{':
+            end = _interpolation_end(body, index)
+            if has_literal:
+                chunks.append((literal_newlines, previous_token))
+            literal_newlines, has_literal = 0, False
+            for match in _TOKEN_PATTERN.finditer(body, index + 1, end - 1):
+                kind, token = match.lastgroup, match.group()
+                if kind == 'comment' or kind == 'newline':
+                    continue
+                if token in _CONDITION_KEYWORDS:
+                    conditions += 1
+                elif kind == 'string':
+                    prefix, quote = _string_prefix_and_quote(token)
+                    if 'f' in prefix.lower():
+                        conditions += _scan_fstring(token[len(prefix) + len(quote):-len(quote)], False)[0]
+                previous_token = token
+            index = end
+            continue
+        if body[index] == '\n':
+            literal_newlines += 1
+        has_literal = True
+        index += 1
+    if has_literal:
+        chunks.append((literal_newlines, previous_token))
+    if not triple_quoted or not chunks:
+        return conditions, 0
+    if len(chunks) == 1 and previous_token == 'f':
+        # No interpolation at all: lizard keeps the original token, preceded by the prefix
+        return conditions, body.count('\n') + 1
+    # Each chunk is rebuilt as quote + literal + quote, so it is always a 6+ character triple-quoted token
+    return conditions, sum(newlines + 1 for newlines, previous in chunks if not _is_expression_token(previous))
+
+
+def _interpolation_end(body, start):
+    """Index just after the '}' closing the interpolation opened at body[start] (lizard's rules)."""
+    depth, index, length = 1, start + 1, len(body)
+    while index < length and depth:
+        character = body[index]
+        if character in '"\'':
+            quote = body[index:index + 3] if body[index:index + 3] in ('"""', "'''") else character
+            index += len(quote)
+            while index < length and body[index:index + len(quote)] != quote:
+                index += 2 if body[index] == '\\' else 1
+            index += len(quote)
+            continue
+        if character == '{':
+            depth += 1
+        elif character == '}':
+            depth -= 1
+        index += 1
+    return index
+
+
+def _radon_logical_count(line_tokens):
+    """radon.raw._logical: segments split on ';'; a ':' not at the end of a segment adds a second line."""
+    if not line_tokens:
+        return 0
+    segments = [[]]
+    for token in line_tokens:
+        if token == ';':
+            segments.append([])
+        else:
+            segments[-1].append(token)
+
+    count = 0
+    for index, segment in enumerate(segments):
+        # radon's last segment still carries the ENDMARKER token, which shifts its colon check
+        length = len(segment) + (1 if index == len(segments) - 1 else 0)
+        colon_position = None
+        for position in range(len(segment) - 1, -1, -1):
+            if segment[position] == ':':
+                colon_position = position
+                break
+        if colon_position is not None:
+            count += 2 - (colon_position == length - 2)
+        elif segment:
+            count += 1
+    return count
+
+
+def _scan(source):
+    """
+    One pass over the token stream. Returns (code_rows, dropped_rows, functions, cloc_code_rows, logical_lines)
+    or None if the source doesn't tokenize cleanly.
+
+      code_rows     1 for every row lizard sees a code token on
+      dropped_rows  NLOC lizard subtracts again on a row (triple-quoted strings it takes for comments)
+      functions     [start_row, end_row, conditions, [indexes of nested functions], has_body_lines] per def
+    """
+    row_count = source.count('\n') + 2
+    code_rows = [0] * (row_count + 1)
+    dropped_rows = [0] * (row_count + 1)
+    cloc_code_rows = set()
+    functions = []
+    open_functions = [] # (indent, index into functions), innermost last
+    logical_lines = 0
+    logical_tokens = [] # Tokens of the current logical line (radon grouping)
+    row, line_start, depth = 1, 0, 0
+    last_code_row = 0
+    at_line_start = True
+    line_indent = 0
+    previous_token = None # Last token lizard would consider meaningful
+
+    for match in _TOKEN_PATTERN.finditer(source):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'comment':
+            continue
+        if kind == 'newline':
+            row += 1
+            line_start = match.end()
+            if depth == 0:
+                logical_lines += _radon_logical_count(logical_tokens)
+                if logical_tokens and logical_tokens[0] == 'case' and logical_tokens[-1] == ':' and \
+                        len(logical_tokens) > 2 and logical_tokens[1] not in _CASE_VARIABLE_NEXT and open_functions:
+                    functions[open_functions[-1][1]][2] += 1
+                logical_tokens = []
+                at_line_start = True
+            continue
+        if kind == 'continuation':
+            code_rows[row] = code_rows[row + 1] = 1
+            row += 1
+            line_start = match.end()
+            previous_token = token
+            continue
+        if kind == 'op' and token in '\'"':
+            return None # Unterminated string literal
+
+        if at_line_start:
+            # Indentation decides where lizard ends a function
+            at_line_start = False
+            line_indent = match.start() - line_start
+            while open_functions and open_functions[-1][0] >= line_indent:
+                functions[open_functions.pop()[1]][1] = last_code_row
+            if open_functions:
+                functions[open_functions[-1][1]][4] = True
+
+        start_row = row
+        if kind == 'string':
+            newlines = token.count('\n')
+            prefix, quote = _string_prefix_and_quote(token)
+            if newlines:
+                for covered_row in range(row, row + newlines + 1):
+                    code_rows[covered_row] = 1
+                row += newlines
+                line_start = match.start() + token.rfind('\n') + 1
+            else:
+                code_rows[row] = 1
+            if 'f' in prefix.lower():
+                conditions, dropped = _scan_fstring(token[len(prefix) + len(quote):-len(quote)], len(quote) == 3)
+                if conditions and open_functions:
+                    functions[open_functions[-1][1]][2] += conditions
+            elif len(quote) == 3 and (prefix or not _is_expression_token(previous_token)):
+                dropped = newlines + 1 # For a prefixed string lizard's previous token is the prefix itself
+            else:
+                dropped = 0
+            dropped_rows[start_row] += dropped
+            if len(quote) == 3:
+                # cloc turns every triple-quoted string into a C comment; only a prefix other than u/U stays as code
+                if prefix.lower() not in ('', 'u'):
+                    cloc_code_rows.add(start_row)
+            else:
+                cloc_code_rows.add(start_row)
+                cloc_code_rows.add(row)
+        else:
+            code_rows[row] = 1
+            cloc_code_rows.add(row)
+            if kind == 'op':
+                if token in _OPEN_BRACKETS:
+                    depth += 1
+                elif token in _CLOSE_BRACKETS:
+                    depth -= 1
+                    if depth < 0:
+                        return None
+            elif kind == 'name':
+                if token in _CONDITION_KEYWORDS:
+                    if open_functions:
+                        functions[open_functions[-1][1]][2] += 1
+                elif token == 'def' and (not logical_tokens or logical_tokens == ['async']):
+                    if open_functions:
+                        functions[open_functions[-1][1]][3].append(len(functions))
+                    open_functions.append((line_indent, len(functions)))
+                    functions.append([row, None, 0, [], False])
+        logical_tokens.append(token)
+        previous_token = token
+        last_code_row = row
+
+    if depth != 0:
+        return None
+    logical_lines += _radon_logical_count(logical_tokens)
+    for _, index in open_functions:
+        functions[index][1] = last_code_row
+    return code_rows, dropped_rows, functions, cloc_code_rows, logical_lines
+
+
+def compute_python_metrics(source):
+    """
+    Returns a metrics dict for Python source (same keys as the tool-based path), or None if the
+    source can't be tokenized.
+    """
+    source = source.replace('\r\n', '\n').replace('\r', '\n')
+    scanned = _scan(source)
+    if scanned is None:
+        return None
+    code_rows, dropped_rows, functions, cloc_code_rows, logical_lines = scanned
+
+    running_total = 0
+    cumulative = [0] * len(code_rows) # cumulative[r] = lizard NLOC of rows 1..r
+    for index in range(len(code_rows)):
+        running_total += code_rows[index] - dropped_rows[index]
+        cumulative[index] = running_total
+
+    metrics = {}
+    complexities, function_locs = [], []
+    for start_row, end_row, conditions, nested, has_body_lines in functions:
+        if not has_body_lines:
+            continue # lizard doesn't report one-line definitions such as 'def f(): pass'
+        nloc = cumulative[end_row] - cumulative[start_row - 1]
+        # lizard counts a nested function's 'def' line for both functions, the rest only for the inner one
+        for nested_index in nested:
+            nested_start, nested_end = functions[nested_index][0], functions[nested_index][1]
+            nloc -= cumulative[nested_end] - cumulative[nested_start]
+        complexities.append(1 + conditions)
+        function_locs.append(nloc)
+    if complexities:
+        metrics['cyclomatic_complexity_max'] = max(complexities)
+        metrics['cyclomatic_complexity_avg'] = round(sum(complexities) / len(complexities), 2)
+    if function_locs:
+        metrics['function_loc_max'] = max(function_locs)
+
+    lines = source.splitlines()
+    blank_lines = sum(1 for line in lines if not line.strip())
+    code_lines = len(cloc_code_rows)
+    metrics['loc_blank_cloc'] = blank_lines
+    metrics['loc_comment_cloc'] = len(lines) - blank_lines - code_lines
+    metrics['loc_code_cloc'] = code_lines
+    metrics['loc_total_cloc'] = len(lines)
+    metrics['loc_logical_radon'] = logical_lines
+    metrics['dependency_count'] = len(set(_IMPORT_PATTERN.findall(source)))
+    return metrics
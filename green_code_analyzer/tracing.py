@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight span tracing for the analysis pipeline: where does commit time go?
+
+Functions decorated with @traced(stage) (or code inside `with span(name, stage)`) record one
+complete event per call: name, stage, start, duration, process/thread and free-form args.
+annotate_span(**args) adds args (model, token counts, tool name, ...) to the innermost open span
+of the calling thread. Events are kept in a process-wide Tracer and can be
+  - summarized per stage (summary_lines),
+  - written in Chrome trace-event format (write_chrome_trace), viewable in chrome://tracing or
+    https://ui.perfetto.dev, or
+  - passed to listeners as each span ends (add_listener; the JSON-lines event log uses this).
+Worker processes hand their events to the parent with drain_events/add_events.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    """Thread-safe collector of complete ('X') trace events."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._listeners = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name, stage, **args):
+        event = {'name': name, 'cat': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'ts': time.time() * 1e6, 'args': dict(args)}
+        stack = self._stack()
+        stack.append(event)
+        started = time.perf_counter()
+        try:
+            yield event['args']
+        except BaseException as e:
+            event['args']['error'] = type(e).__name__
+            raise
+        finally:
+            event['dur'] = (time.perf_counter() - started) * 1e6
+            stack.pop()
+            with self._lock:
+                self.events.append(event)
+            for listener in self._listeners:
+                listener(event)
+
+    def annotate(self, **args):
+        stack = self._stack()
+        if stack:
+            stack[-1]['args'].update(args)
+
+    def current_stage(self):
+        """Stage of the innermost open span of the calling thread, or None."""
+        stack = self._stack()
+        return stack[-1]['cat'] if stack else None
+
+    def add_listener(self, listener):
+        """Calls listener(event) in the recording thread whenever a span ends."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def drain(self):
+        """Returns and forgets the recorded events."""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def add_events(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def stage_totals(self):
+        """{stage: (calls, total seconds, max seconds)} over the recorded events."""
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            calls, total, longest = totals.get(event['cat'], (0, 0.0, 0.0))
+            seconds = event['dur'] / 1e6
+            totals[event['cat']] = (calls + 1, total + seconds, max(longest, seconds))
+        return totals
+
+    def summary_lines(self):
+        """Per-stage table (calls, total, mean, max), slowest stage first."""
+        totals = self.stage_totals()
+        if not totals:
+            return []
+        lines = [f"{'stage':<12} {'calls':>6} {'total':>9} {'mean':>9} {'max':>9}"]
+        for stage, (calls, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{stage:<12} {calls:>6} {total:>8.3f}s {total / calls:>8.3f}s {longest:>8.3f}s")
+        return lines
+
+    def write_chrome_trace(self, path):
+        """Writes the events as a Chrome trace-event JSON file."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        with open(path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        return len(events)
+
+
+_TRACER = Tracer()
+
+
+def get_tracer():
+    """The process-wide Tracer."""
+    return _TRACER
+
+
+def span(name, stage, **args):
+    """Context manager recording one span on the process-wide Tracer; yields its args dict."""
+    return _TRACER.span(name, stage, **args)
+
+
+def annotate_span(**args):
+    """Adds args to the innermost open span of the calling thread (no-op outside a span)."""
+    _TRACER.annotate(**args)
+
+
+def traced(stage, name=None):
+    """Decorator recording every call of the function as a span of `stage`."""
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _TRACER.span(span_name, stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
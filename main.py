@@ -3,36 +3,118 @@ import sys
 import io
 try:
     # Ensure UTF-8 encoding for stdout/stderr, especially in non-UTF-8 environments
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+    # stdout is block-buffered: the event log flushes it per file (see green_code_analyzer/event_log.py)
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=False)
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True)
 except (AttributeError, ValueError):
     # Handle environments where buffer might not exist or other issues
     pass
 
 import re
-import requests
 import subprocess
 import os
 import sys
 import argparse
-import difflib
 import tempfile
 import shutil
 import json
 import math
+import functools
+import threading
+import contextlib
+import time
+import concurrent.futures
+import importlib.util
 import ast # For Python Syntax Check
 
+from green_code_analyzer.git_utils import GitRepoSnapshot, GitError, decode_blob
+from green_code_analyzer.diff_utils import compute_diff_opcodes, build_change_context, DIFF_BACKENDS
+from green_code_analyzer.cache_utils import DiskCache, get_git_cache_dir, make_cache_key
+from green_code_analyzer.py_metrics import compute_python_metrics
+from green_code_analyzer.patch_utils import apply_unified_diff, parse_unified_diff, PatchApplyError
+from green_code_analyzer.comment_compaction import (compact_python_source, restore_python_source,
+                                                     PLACEHOLDER_PROMPT_NOTE, PlaceholderMismatch)
+from green_code_analyzer.chunk_utils import (split_into_chunks, chunk_syntax_ok, restore_chunk_padding,
+                                             python_statement_units, expand_to_statement_units, estimate_tokens,
+                                             split_source_lines)
+from green_code_analyzer.model_routing import route_llm_model, load_routing_config, DEFAULT_ROUTING
+from green_code_analyzer.tracing import get_tracer, traced, span, annotate_span
+from green_code_analyzer.event_log import (get_event_log, log_debug, log_info, log_result, log_warning, log_error,
+                                           log_captured, VERBOSITY_LEVELS)
+from green_code_analyzer.hedging import LatencyTracker, HedgeStats, run_hedged
+from green_code_analyzer.http_client import (get_http_client, configure_http_client,
+                                              read_chat_completion_stream, abort_response, LLMStreamAborted)
+
 # --- Constants ---
 LLM_LOC_LIMIT = 1000 # Maximum Lines of Code to send to LLM for full file analysis
+LLM_CONTEXT_DIFF_LINES = 2 # Context lines around each hunk of the HEAD-vs-staged diff sent with full-file prompts
+LLM_DIFF_LOC_LIMIT = 3000 # Same limit with --llm-output diff: the reply no longer has to echo the whole file
+LLM_OUTPUT_FORMATS = ('code', 'diff') # code: model returns the whole file, diff: unified-diff hunks against it
+LLM_FULL_FILE_MAX_TOKENS = 4096 # Output allowance when the model rewrites the entire file
+LLM_DIFF_MAX_TOKENS = 2048 # Output allowance for a full-file patch (hunks only)
+# Files above the LOC limit are split at top-level boundaries and optimized chunk by chunk
+LLM_CHUNK_MAX_TOKENS = 1500 # Estimated input tokens packed into one chunk
+LLM_CHUNK_RESPONSE_MAX_TOKENS = 3072 # Output allowance per chunk (a chunk may grow a little)
+LLM_MAX_CHUNKS = 64 # Files needing more chunks than this are still skipped
 PERFECT_SCORE_THRESHOLD = 99.9 # Skip LLM if score is already near perfect
+PYTHON_METRICS_ENGINES = ('native', 'tools') # native: in-process single-pass token scan, tools: lizard + cloc + radon
+METRICS_CACHE_SCHEMA = 2 # Bump whenever metric collection/parsing changes so stale cached metrics are ignored
+METRICS_CACHE_MAX_BYTES = 16 * 1024 * 1024 # Size bound for the .git/green_code_cache/metrics LRU cache
+GROQ_DEFAULT_BASE_URL = "https://api.groq.com/openai/v1"
+GROQ_DEFAULT_CHAT_COMPLETIONS_URL = f"{GROQ_DEFAULT_BASE_URL}/chat/completions" # Left out of cache/latency keys
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", GROQ_DEFAULT_BASE_URL).rstrip('/') # e.g. benchmarks/mock_llm_server.py for offline runs
+GROQ_CHAT_COMPLETIONS_URL = f"{GROQ_BASE_URL}/chat/completions"
+GROQ_MODEL = "llama3-8b-8192" # Model used when routing is disabled (--no-llm-routing)
+LLM_TEMPERATURE = 0.1 # Low temperature for more deterministic output
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Size bound for the .git/green_code_cache/llm_responses LRU cache
+LLM_CACHE_TTL_SECONDS = 14 * 24 * 3600 # Cached LLM responses expire after two weeks
+LLM_REQUEST_BUDGET = 0 # Max LLM API requests per run, retries included (--llm-request-budget); 0 = unlimited
+LLM_HEDGE_PERCENTILE = 90 # Hedge a request once it runs longer than this percentile of the model's recent latencies
+LLM_HEDGE_MIN_SAMPLES = 5 # Latencies needed before that percentile is trusted...
+LLM_HEDGE_DEFAULT_DELAY = 20.0 # ...seconds waited before hedging until then
+LLM_HEDGE_MIN_DELAY = 2.0 # Never hedge sooner than this
+LLM_LATENCY_SAMPLES = 200 # Recent latencies kept per model (in .git/green_code_cache/llm_latency)
+LLM_FULL_FILE_MAX_LATENCY = 180 # Seconds for a whole streamed full-file response (first byte to last token)
+LLM_STREAM_READ_TIMEOUT = 60 # Seconds of silence tolerated between streamed chunks
+LLM_STREAM_MAX_LENGTH_RATIO = 2.0 # Abort a streamed rewrite once it is this many times longer than its input...
+LLM_STREAM_LENGTH_SLACK = 2000 # ...plus this many characters (small inputs may legitimately grow)
+# Lines the response cleanup strips from the start of LLM output (see the full-file step)
+LLM_PREAMBLE_PATTERNS = (
+    r"^\s*here[' i]*s the (optimized|updated|modified)?\s*code:?\s*$",
+    r"^\s*okay, here[' i]*s the code:?\s*$",
+    r"^\s*sure, here[' i]*s the code:?\s*$",
+    # Add more common patterns if observed
+)
+# A first line like this is an explanation, not code: the rest of the stream will not survive the syntax check.
+# Prose shape only (capitalized opener, a lowercase word, no '=', '(' or ':' before the end) so that code
+# such as 'in_progress = ...' or 'This = Thing(...)' is never taken for a preamble
+LLM_PROSE_OPENING = re.compile(
+    r"^(?:I|I'm|I've|I'll|Sure|Certainly|Okay|Ok|Unfortunately|As an|Below|Here|The|This|To|In order to),? "
+    r"[a-z][^\s=(:]*(?:\s+[^\s=(:]+)+[.:!]$")
+# Small --changes-only blocks share one multi-segment request, across files in batch mode without --jobs
+# (--no-llm-pack sends each block alone)
+LLM_PACK_MAX_BLOCK_LINES = 30 # Larger blocks always get a request of their own
+LLM_PACK_MAX_TOKENS = 1500 # Estimated code tokens per packed request
+LLM_PACK_MAX_SEGMENTS = 12 # Blocks per packed request
+LLM_PACK_RESPONSE_MAX_TOKENS = 3072 # Output allowance for a packed request
+LLM_MAX_CONCURRENT_REQUESTS = 4 # Change blocks in flight at once (--llm-concurrency); keep under the provider's rate limits
+STATIC_TOOL_TIMEOUTS = {'lizard': 60, 'cloc': 60, 'radon': 60} # Seconds, enforced per tool
+STATIC_TOOLS_MAX_WORKERS = 3 # lizard, cloc and radon can all run at the same time
+BATCH_TOOL_TIMEOUT_PER_FILE = 2 # Extra seconds per file when one tool run covers a whole batch
+# Extensions picked up by --staged (mirrors FILE_PATTERNS in .husky/pre-commit)
+STAGED_FILE_EXTENSIONS = ('.py', '.js', '.jsx', '.ts', '.tsx', '.java', '.c', '.cpp', '.h', '.hpp',
+                          '.cs', '.go', '.rb', '.php', '.swift', '.rs', '.kt', '.sh')
 
 # --- CodeCarbon Import ---
-try:
-    from codecarbon import EmissionsTracker
-    CODECARBON_AVAILABLE = True
-except ImportError:
-    CODECARBON_AVAILABLE = False
-    EmissionsTracker = None # Define it as None if not available
+# codecarbon pulls in pandas and friends, so only measure_python_emissions imports it; everything
+# else just checks that it is installed. requests is deferred the same way (see http_client.py).
+@functools.lru_cache(maxsize=None)
+def codecarbon_available():
+    """True if the codecarbon package is installed (looked up without importing it)."""
+    try:
+        return importlib.util.find_spec("codecarbon") is not None
+    except (ImportError, ValueError):
+        return False
 
 # --- REVISED SCORING CONFIGURATION (Stricter Python + Density, No Semgrep) ---
 SCORING_CONFIG = {
@@ -92,137 +174,460 @@ SCORING_CONFIG = {
 
 # --- Helper Functions ---
 
+# Shared state for batch runs: tool lookups, the API key and the HTTP client (connection pool,
+# retries, rate limiting; see green_code_analyzer/http_client.py) are resolved once per process
+# instead of once per analyzed file.
+_SHARED_STATE_LOCK = threading.Lock() # Concurrent block requests may create shared objects at the same time
+
+# --- LLM Response Cache (model + prompts + sampling settings -> response text) ---
+_LLM_CACHE = None
+
+def get_llm_cache():
+    """Return the shared LLM response DiskCache under .git/, or None outside a Git repository."""
+    global _LLM_CACHE
+    with _SHARED_STATE_LOCK:
+        if _LLM_CACHE is None:
+            cache_dir = get_git_cache_dir("llm_responses")
+            _LLM_CACHE = DiskCache(cache_dir, LLM_CACHE_MAX_BYTES, ttl_seconds=LLM_CACHE_TTL_SECONDS) if cache_dir else False
+    return _LLM_CACHE or None
+
+# --- LLM Latencies (per model, persisted so one-shot hook runs know the usual response times) ---
+_LATENCY_TRACKERS = {}
+_LATENCY_CACHE = None
+_HEDGE_STATS = HedgeStats()
+
+def get_latency_cache():
+    """Return the DiskCache holding recent LLM latencies under .git/, or None outside a Git repository."""
+    global _LATENCY_CACHE
+    with _SHARED_STATE_LOCK:
+        if _LATENCY_CACHE is None:
+            cache_dir = get_git_cache_dir("llm_latency")
+            _LATENCY_CACHE = DiskCache(cache_dir, 1024 * 1024) if cache_dir else False
+    return _LATENCY_CACHE or None
+
+def backend_key_parts(model, url):
+    """Identifies a model on an endpoint for cache/latency keys; api.groq.com keeps the bare model name."""
+    return (model,) if url == GROQ_DEFAULT_CHAT_COMPLETIONS_URL else (url, model)
+
+def get_latency_tracker(model, url=GROQ_CHAT_COMPLETIONS_URL):
+    """The LatencyTracker of `model` at `url`, seeded from the latency cache on first use."""
+    backend = backend_key_parts(model, url)
+    with _SHARED_STATE_LOCK:
+        tracker = _LATENCY_TRACKERS.get(backend)
+    if tracker is None:
+        cache = get_latency_cache()
+        samples = (cache.get(make_cache_key("latency", *backend)) if cache else None) or []
+        with _SHARED_STATE_LOCK:
+            tracker = _LATENCY_TRACKERS.setdefault(backend, LatencyTracker(LLM_LATENCY_SAMPLES, samples))
+    return tracker
+
+def record_llm_latency(model, seconds, url=GROQ_CHAT_COMPLETIONS_URL):
+    """Adds one completed request's latency to the tracker of `model` at `url` and the latency cache."""
+    tracker = get_latency_tracker(model, url)
+    tracker.record(seconds)
+    cache = get_latency_cache()
+    if cache:
+        cache.put(make_cache_key("latency", *backend_key_parts(model, url)), tracker.samples())
+
+def store_llm_replies(replies):
+    """Writes the (cache key, content) pairs collected through pending_cache once the caller accepted them."""
+    cache = get_llm_cache()
+    if cache:
+        for cache_key, content in replies:
+            cache.put(cache_key, content)
+
+@traced("llm")
+def request_llm_completion(api_key, system_prompt, user_prompt, max_tokens, timeout, use_cache=True,
+                           stream=False, max_latency=None, on_delta=None, model=GROQ_MODEL,
+                           url=GROQ_CHAT_COMPLETIONS_URL, cancelled=None, pending_cache=None):
+    """
+    Sends one chat completion request to Groq (or another OpenAI-compatible endpoint at `url`)
+    with `model` and returns the raw message content. Latencies of answered requests are
+    recorded per model and endpoint (see get_latency_tracker).
+    Identical requests (same model, prompts, temperature and max_tokens) are answered from the
+    LLM response cache when use_cache is set, which also makes re-runs deterministic. With a
+    pending_cache list the new reply's (key, content) is appended to it instead of being cached,
+    so a reply the caller rejects later (syntax error, bad patch, lost hedge) is never replayed;
+    store_llm_replies writes the accepted ones.
+    Transient failures (429/5xx, dropped connections) are retried by the shared HTTP client.
+    With stream set, tokens are read as they arrive: on_delta(delta, text_so_far) may raise
+    LLMStreamAborted to stop early, and max_latency bounds the whole request in seconds.
+    cancelled (a hedging.CancelEvent) closes a streamed response as soon as it is set, even mid-stall.
+    Raises requests exceptions on transport/HTTP errors (including RequestBudgetExceeded once the
+    run's request budget is used up, and Timeout once max_latency is exceeded) and ValueError on an
+    unexpected response shape or an aborted stream.
+    """
+    annotate_span(model=model, prompt_tokens=estimate_tokens(system_prompt + user_prompt), max_tokens=max_tokens, stream=stream)
+    cache = get_llm_cache() if use_cache else None
+    cache_key = None
+    if cache:
+        # A mock server or another endpoint (GROQ_BASE_URL, --llm-hedge-url) never shares Groq's entries
+        cache_key = make_cache_key(*backend_key_parts(model, url), system_prompt, user_prompt,
+                                   repr(LLM_TEMPERATURE), str(max_tokens))
+        cached_content = cache.get(cache_key)
+        if cached_content is not None:
+            log_debug(f"    LLM cache hit ({len(cached_content)} chars), skipping API request.")
+            annotate_span(cache_hit=True, completion_tokens=estimate_tokens(cached_content))
+            return cached_content
+
+    started = time.monotonic()
+    response = get_http_client().post(
+        url,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        },
+        json={
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": max_tokens,
+            "stream": stream,
+        },
+        timeout=timeout,
+        stream=stream
+    )
+    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+
+    if stream:
+        if cancelled is not None:
+            cancelled.on_set(lambda: abort_response(response))
+        content = read_chat_completion_stream(response, on_delta=on_delta, max_latency=max_latency, started=started)
+    else:
+        response_data = response.json()
+        if not response_data.get("choices") or not response_data["choices"][0].get("message"):
+            raise ValueError("LLM response format unexpected (missing choices/message)")
+        content = response_data["choices"][0]["message"]["content"]
+    annotate_span(completion_tokens=estimate_tokens(content or ''))
+    record_llm_latency(model, time.monotonic() - started, url)
+    if cache and content:
+        if pending_cache is not None:
+            pending_cache.append((cache_key, content))
+        else:
+            cache.put(cache_key, content)
+    return content
+
+def request_llm_completion_hedged(api_key, system_prompt, user_prompt, max_tokens, timeout, hedge, accept=None,
+                                  use_cache=True, max_latency=None, on_delta=None, model=GROQ_MODEL, pending_cache=None):
+    """
+    request_llm_completion with a hedge: if the primary request has not answered within the
+    model's p90 latency (LLM_HEDGE_PERCENTILE; hedge['delay'] seconds if set), the same prompts go to
+    hedge['model'] at hedge['url'] (with hedge['api_key']; None: api_key) and the first reply that
+    accept(text) approves wins. Both requests are streamed so the loser's connection can be closed. on_delta
+    only watches the primary stream. Only the winner's reply is cached (or added to pending_cache).
+    Errors are raised as by request_llm_completion.
+    """
+    delay = hedge.get('delay') or get_latency_tracker(model).percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+    delay = max(LLM_HEDGE_MIN_DELAY, delay or LLM_HEDGE_DEFAULT_DELAY)
+
+    def cancellable(cancelled, watch=None):
+        def check(delta, text):
+            if cancelled.is_set():
+                raise LLMStreamAborted("the other hedged request answered first")
+            if watch is not None:
+                watch(delta, text)
+        return check
+
+    replies = {'primary': [], 'secondary': []} # Cache entries held back until the winner is known
+
+    def primary(cancelled):
+        return request_llm_completion(api_key, system_prompt, user_prompt, max_tokens, timeout, use_cache=use_cache,
+                                      stream=True, max_latency=max_latency, on_delta=cancellable(cancelled, on_delta),
+                                      model=model, cancelled=cancelled, pending_cache=replies['primary'])
+
+    def secondary(cancelled):
+        log_info(f"    No reply from {model} after {delay:.1f}s, hedging to {hedge['model']}")
+        hedge_api_key = api_key if hedge.get('api_key') is None else hedge['api_key']
+        return request_llm_completion(hedge_api_key, system_prompt, user_prompt, max_tokens, timeout,
+                                      use_cache=use_cache, stream=True, max_latency=max_latency,
+                                      on_delta=cancellable(cancelled), model=hedge['model'],
+                                      url=hedge.get('url') or GROQ_CHAT_COMPLETIONS_URL, cancelled=cancelled,
+                                      pending_cache=replies['secondary'])
+
+    content, winner = run_hedged(primary, secondary, delay, accept=accept, stats=_HEDGE_STATS)
+    if accept is None or accept(content): # Neither reply accepted: the primary's is returned but not cached
+        if pending_cache is not None:
+            pending_cache.extend(replies[winner])
+        else:
+            store_llm_replies(replies[winner])
+    if winner == 'secondary':
+        log_info(f"    Hedged request to {hedge['model']} answered first")
+    return content
+
+def make_stream_divergence_check(input_content):
+    """
+    Returns an on_delta callback for request_llm_completion that raises LLMStreamAborted as soon as a
+    streamed rewrite of input_content clearly diverges: the output is already much longer than the
+    input, or its first line is a prose explanation rather than code (or a preamble the cleanup strips).
+    """
+    max_length = int(len(input_content) * LLM_STREAM_MAX_LENGTH_RATIO) + LLM_STREAM_LENGTH_SLACK
+    state = {'first_line_checked': False}
+
+    def check(delta, text):
+        if len(text) > max_length:
+            raise LLMStreamAborted(f"streamed output ({len(text)} chars) is far longer than the "
+                                   f"{len(input_content)}-char input")
+        if not state['first_line_checked'] and '\n' in text.lstrip():
+            state['first_line_checked'] = True
+            first_line = text.lstrip().split('\n', 1)[0].strip()
+            if first_line.startswith('```') or any(re.match(pattern, first_line, re.IGNORECASE)
+                                                   for pattern in LLM_PREAMBLE_PATTERNS):
+                return # Handled by the response cleanup
+            if LLM_PROSE_OPENING.match(first_line):
+                raise LLMStreamAborted(f"output starts with a prose preamble: {first_line[:80]!r}")
+    return check
+
+@functools.lru_cache(maxsize=None)
+def find_tool(tool_name):
+    """Cached shutil.which lookup so batch runs probe PATH once per tool."""
+    return shutil.which(tool_name)
+
+@functools.lru_cache(maxsize=None)
 def get_api_key(api_key_file="api_key.txt"):
-    """Read the API key from a file."""
+    """Read the API key from a file (cached for the lifetime of the process)."""
     try:
         with open(api_key_file, "r", encoding='utf-8') as file:
             api_key = file.read().strip()
             if not api_key:
-                print(f"WARNING: API key file '{api_key_file}' is empty. LLM step will fail if needed.")
+                log_warning(f"WARNING: API key file '{api_key_file}' is empty. LLM step will fail if needed.")
                 return None
             # print(f"Successfully loaded API key from {api_key_file}") # Less verbose
             return api_key
     except FileNotFoundError:
-        print(f"WARNING: API key file '{api_key_file}' not found. LLM step will fail if needed.")
+        log_warning(f"WARNING: API key file '{api_key_file}' not found. LLM step will fail if needed.")
         return None
     except Exception as e:
-        print(f"ERROR: Failed to read API key file '{api_key_file}': {e}")
+        log_error(f"ERROR: Failed to read API key file '{api_key_file}': {e}")
         return None
 
+# Lazily created repository snapshot shared by every file of a run (False = unavailable)
+_GIT_SNAPSHOT = None
+
+def get_git_snapshot():
+    """
+    Return the shared GitRepoSnapshot (one 'ls-files -s' + 'diff-index --cached' + a persistent
+    'cat-file --batch' pipe), or None if we're not inside a usable Git repository.
+    """
+    global _GIT_SNAPSHOT
+    if _GIT_SNAPSHOT is None:
+        try:
+            _GIT_SNAPSHOT = GitRepoSnapshot()
+            log_debug(f"GIT INFO: Loaded index snapshot ({len(_GIT_SNAPSHOT.index_blobs)} tracked, "
+                  f"{len(_GIT_SNAPSHOT.staged_paths)} staged path(s))")
+        except GitError as e:
+            log_debug(f"GIT INFO: Snapshot backend unavailable ({e}). Falling back to per-file git commands.")
+            _GIT_SNAPSHOT = False
+    return _GIT_SNAPSHOT or None
+
+def close_git_snapshot():
+    """Shut down the persistent cat-file process, if one was started."""
+    global _GIT_SNAPSHOT
+    if _GIT_SNAPSHOT:
+        _GIT_SNAPSHOT.close()
+    _GIT_SNAPSHOT = None
+
 def get_git_file_info(file_path):
     """Get detailed information about a file in Git."""
-    print(f"\nGIT INFO: Analyzing Git status for {file_path}")
+    log_debug(f"\nGIT INFO: Analyzing Git status for {file_path}")
+    snapshot = get_git_snapshot()
+    if snapshot:
+        info = snapshot.get_file_info(file_path)
+        log_debug(f"  • Is file tracked by Git? {'Yes' if info['is_tracked'] else 'No'}")
+        if info["is_tracked"]:
+            log_debug(f"  • Is file staged? {'Yes' if info['is_staged'] else 'No'}")
+            log_debug(f"  • Does file exist in HEAD? {'Yes' if info['exists_in_head'] else 'No (likely new file)'}")
+        else:
+            log_debug("  • File not tracked by Git. Cannot determine staged status or HEAD existence.")
+        return info
+
     info = {"is_tracked": False, "is_staged": False, "exists_in_head": False}
     try:
         # Check if file is tracked by Git
         is_tracked_cmd = ["git", "ls-files", "--error-unmatch", file_path]
         info["is_tracked"] = subprocess.run(is_tracked_cmd, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False).returncode == 0
-        print(f"  • Is file tracked by Git? {'Yes' if info['is_tracked'] else 'No'}")
+        log_debug(f"  • Is file tracked by Git? {'Yes' if info['is_tracked'] else 'No'}")
 
         if info["is_tracked"]:
             # Check if file is staged (changes added to index)
             is_staged_cmd = ["git", "diff", "--cached", "--quiet", "--", file_path]
             info["is_staged"] = subprocess.run(is_staged_cmd, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False).returncode != 0
-            print(f"  • Is file staged? {'Yes' if info['is_staged'] else 'No'}")
+            log_debug(f"  • Is file staged? {'Yes' if info['is_staged'] else 'No'}")
 
             # Check if file exists in HEAD (was committed before)
             exists_in_head_cmd = ["git", "cat-file", "-e", f"HEAD:{file_path}"]
             info["exists_in_head"] = subprocess.run(exists_in_head_cmd, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=False).returncode == 0
-            print(f"  • Does file exist in HEAD? {'Yes' if info['exists_in_head'] else 'No (likely new file)'}")
+            log_debug(f"  • Does file exist in HEAD? {'Yes' if info['exists_in_head'] else 'No (likely new file)'}")
         else:
-             print("  • File not tracked by Git. Cannot determine staged status or HEAD existence.")
+             log_debug("  • File not tracked by Git. Cannot determine staged status or HEAD existence.")
 
     except FileNotFoundError:
-         print("  ERROR: 'git' command not found. Cannot get Git info.")
+         log_error("  ERROR: 'git' command not found. Cannot get Git info.")
     except Exception as e:
-         print(f"  ERROR: Unexpected error getting Git info: {e}")
+         log_error(f"  ERROR: Unexpected error getting Git info: {e}")
     return info
 
+def read_file_from_disk(file_path):
+    """Fallback for files that are not in the index: read the working tree copy."""
+    log_debug(f"  Attempting to read file directly from disk.")
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+            log_debug(f"  Read directly from disk ({len(content)} bytes)")
+            return content
+    except Exception as read_err:
+        log_error(f"  ERROR: Failed to read file directly: {read_err}")
+        return None # Indicate failure
+
+@traced("git")
 def get_staged_file_content(file_path):
     """Get the content of a staged file from Git index."""
+    snapshot = get_git_snapshot()
+    if snapshot:
+        log_debug(f"GIT CONTENT: Retrieving staged version from Git index for {os.path.basename(file_path)}...")
+        try:
+            staged_bytes = snapshot.get_staged_bytes(file_path)
+            if staged_bytes is None:
+                log_debug(f"  INFO: {file_path} is not in the Git index.")
+                return read_file_from_disk(file_path)
+            staged_content = decode_blob(staged_bytes)
+            log_debug(f"  Successfully retrieved staged version ({len(staged_content)} bytes, {staged_content.count(chr(10))+1} lines)")
+            return staged_content
+        except (GitError, UnicodeDecodeError) as e:
+            log_error(f"  ERROR: Failed to read staged blob for {file_path}: {e}")
+            return None
+
     try:
-        print(f"GIT CONTENT: Retrieving staged version from Git index for {os.path.basename(file_path)}...")
+        log_debug(f"GIT CONTENT: Retrieving staged version from Git index for {os.path.basename(file_path)}...")
         staged_content = subprocess.check_output(
             ["git", "show", f":{file_path}"],
             stderr=subprocess.STDOUT, # Capture stderr too, in case of warnings/errors
             universal_newlines=True,
             encoding='utf-8' # Ensure correct decoding
         )
-        print(f"  Successfully retrieved staged version ({len(staged_content)} bytes, {staged_content.count(chr(10))+1} lines)")
+        log_debug(f"  Successfully retrieved staged version ({len(staged_content)} bytes, {staged_content.count(chr(10))+1} lines)")
         return staged_content
     except subprocess.CalledProcessError as e:
         # This often means the file is not staged or not tracked
-        print(f"  INFO: Could not get staged content via 'git show :{file_path}'. Error: {e.output.strip()}")
-        print(f"  Attempting to read file directly from disk.")
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                print(f"  Read directly from disk ({len(content)} bytes)")
-                return content
-        except Exception as read_err:
-            print(f"  ERROR: Failed to read file directly: {read_err}")
-            return None # Indicate failure
+        log_debug(f"  INFO: Could not get staged content via 'git show :{file_path}'. Error: {e.output.strip()}")
+        return read_file_from_disk(file_path)
     except FileNotFoundError:
-        print("  ERROR: 'git' command not found. Cannot get staged content.")
+        log_error("  ERROR: 'git' command not found. Cannot get staged content.")
         return None
     except Exception as e:
-        print(f"  ERROR: Unexpected error getting staged content: {e}")
+        log_error(f"  ERROR: Unexpected error getting staged content: {e}")
         return None
 
+@traced("git")
 def get_head_file_content(file_path):
     """Get the content of a file from HEAD (last commit)."""
+    snapshot = get_git_snapshot()
+    if snapshot:
+        log_debug(f"GIT CONTENT: Retrieving HEAD version for {os.path.basename(file_path)}...")
+        try:
+            head_bytes = snapshot.get_head_bytes(file_path)
+            if head_bytes is None:
+                log_debug(f"  INFO: Could not get HEAD content (likely a new file or not committed).")
+                return None
+            head_content = decode_blob(head_bytes)
+            log_debug(f"  Successfully retrieved HEAD version ({len(head_content)} bytes, {head_content.count(chr(10))+1} lines)")
+            return head_content
+        except (GitError, UnicodeDecodeError) as e:
+            log_error(f"  ERROR: Failed to read HEAD blob for {file_path}: {e}")
+            return None
+
     try:
-        print(f"GIT CONTENT: Retrieving HEAD version for {os.path.basename(file_path)}...")
+        log_debug(f"GIT CONTENT: Retrieving HEAD version for {os.path.basename(file_path)}...")
         head_content = subprocess.check_output(
             ["git", "show", f"HEAD:{file_path}"],
             stderr=subprocess.STDOUT,
             universal_newlines=True,
             encoding='utf-8' # Ensure correct decoding
         )
-        print(f"  Successfully retrieved HEAD version ({len(head_content)} bytes, {head_content.count(chr(10))+1} lines)")
+        log_debug(f"  Successfully retrieved HEAD version ({len(head_content)} bytes, {head_content.count(chr(10))+1} lines)")
         return head_content
     except subprocess.CalledProcessError:
         # This is common for new files, don't make it look like a severe error
-        print(f"  INFO: Could not get HEAD content (likely a new file or not committed).")
+        log_debug(f"  INFO: Could not get HEAD content (likely a new file or not committed).")
         return None
     except FileNotFoundError:
-        print("  ERROR: 'git' command not found. Cannot get HEAD content.")
+        log_error("  ERROR: 'git' command not found. Cannot get HEAD content.")
         return None
     except Exception as e:
-        print(f"  ERROR: Unexpected error getting HEAD content: {e}")
+        log_error(f"  ERROR: Unexpected error getting HEAD content: {e}")
         return None
 
-def analyze_code_changes(file_path):
+@traced("git")
+def get_staged_file_paths(extensions=STAGED_FILE_EXTENSIONS):
+    """
+    List staged (Added/Copied/Modified) files via a single 'git diff --cached --name-only -z'.
+    Only files with an analyzable extension that still exist on disk are returned.
+    """
+    log_debug("GIT INFO: Collecting staged files from the index...")
+    try:
+        output = subprocess.check_output(
+            ["git", "diff", "--cached", "--name-only", "-z", "--diff-filter=ACM"],
+            stderr=subprocess.DEVNULL
+        )
+    except subprocess.CalledProcessError as e:
+        log_error(f"  ERROR: 'git diff --cached' failed (Exit Code {e.returncode}). Cannot list staged files.")
+        return None
+    except FileNotFoundError:
+        log_error("  ERROR: 'git' command not found. Cannot list staged files.")
+        return None
+
+    staged_paths = []
+    # -z output is NUL separated and unquoted, so paths with spaces/unicode are kept intact
+    for raw_path in output.split(b'\0'):
+        if not raw_path:
+            continue
+        path = raw_path.decode('utf-8', errors='surrogateescape')
+        if not path.lower().endswith(extensions):
+            continue
+        if not os.path.isfile(path):
+            log_debug(f"  Skipping staged path not present on disk: {path}")
+            continue
+        staged_paths.append(path)
+    log_debug(f"  Found {len(staged_paths)} staged file(s) to analyze")
+    return staged_paths
+
+@traced("diff")
+def analyze_code_changes(file_path, diff_backend='auto'):
     """
     Analyze changes between HEAD and staged versions using Git.
     Returns a dictionary with original content, modified content, and change blocks.
+    diff_backend selects the line diff engine (see green_code_analyzer.diff_utils).
     """
     git_info = get_git_file_info(file_path)
     staged_content = get_staged_file_content(file_path)
 
     if staged_content is None:
-        print(f"ERROR: Could not retrieve current/staged file content for {file_path}. Cannot analyze.")
+        log_error(f"ERROR: Could not retrieve current/staged file content for {file_path}. Cannot analyze.")
         return None
 
     original_content = None
     if git_info["exists_in_head"]:
         original_content = get_head_file_content(file_path)
         if original_content is None:
-             print(f"  WARNING: File exists in HEAD, but failed to retrieve HEAD content for {file_path}. Treating as new file for diff.")
+             log_warning(f"  WARNING: File exists in HEAD, but failed to retrieve HEAD content for {file_path}. Treating as new file for diff.")
 
     if original_content is not None:
-        print("DIFF ANALYSIS: Comparing HEAD and staged versions")
-        original_lines = original_content.splitlines()
-        staged_lines = staged_content.splitlines()
+        log_debug("DIFF ANALYSIS: Comparing HEAD and staged versions")
+        # Lines as ast/tokenize count them, so statement and chunk line numbers index the same lists
+        original_lines = split_source_lines(original_content)
+        staged_lines = split_source_lines(staged_content)
 
         if original_lines == staged_lines:
-            print("  INFO: No changes detected between HEAD and staged versions.")
+            log_debug("  INFO: No changes detected between HEAD and staged versions.")
             # Still return content, might be needed for full file analysis
 
-        # Use difflib to find changed blocks
-        s = difflib.SequenceMatcher(None, original_lines, staged_lines, autojunk=False)
+        # Find changed blocks with the selected diff backend (difflib, patience or git hunks)
+        opcodes, backend_used = compute_diff_opcodes(original_lines, staged_lines, diff_backend, file_path)
+        log_debug(f"  Diff backend: {backend_used}")
         change_blocks = []
-        for tag, i1, i2, j1, j2 in s.get_opcodes():
+        for tag, i1, i2, j1, j2 in opcodes:
             # We only care about blocks that are not 'equal' for optimization purposes
             if tag != 'equal':
                 # Extract the lines involved in the change from the *staged* version
@@ -238,9 +643,9 @@ def analyze_code_changes(file_path):
                     'modified_end_line': j2,
                     'modified_lines': modified_lines_in_block, # Content of the block in the staged version
                 })
-                print(f"  - Found change block ({tag}): Original lines {i1+1}-{i2}, Staged lines {j1+1}-{j2}")
+                log_debug(f"  - Found change block ({tag}): Original lines {i1+1}-{i2}, Staged lines {j1+1}-{j2}")
 
-        print(f"  Identified {len(change_blocks)} changed block(s)")
+        log_debug(f"  Identified {len(change_blocks)} changed block(s)")
         return {
             "original": original_content,
             "modified": staged_content,
@@ -249,8 +654,8 @@ def analyze_code_changes(file_path):
         }
     else:
         # Case: New file (not in HEAD or HEAD content retrieval failed)
-        print(f"  INFO: Using only staged content for analysis (likely a new file or HEAD unavailable)")
-        staged_lines = staged_content.splitlines()
+        log_debug(f"  INFO: Using only staged content for analysis (likely a new file or HEAD unavailable)")
+        staged_lines = split_source_lines(staged_content)
         # Treat the entire file as one big 'insert' block
         change_blocks = [{
             'tag': 'insert',
@@ -268,26 +673,160 @@ def analyze_code_changes(file_path):
         }
 
 
+def expand_change_blocks_to_statements(staged_content, change_blocks):
+    """
+    Widens Python change blocks to the smallest enclosing complete statements (a whole function,
+    class, loop or multi-line expression statement when the diff cuts into one), then merges blocks
+    that overlap or touch. Returns the new block list, or change_blocks unchanged if the staged
+    content does not parse.
+    """
+    try:
+        units = python_statement_units(staged_content)
+    except (SyntaxError, ValueError) as e:
+        log_debug(f"  INFO: Staged content does not parse ({e.__class__.__name__}); keeping raw diff blocks.")
+        return change_blocks
+
+    staged_lines = split_source_lines(staged_content)
+    expanded = []
+    for block in change_blocks:
+        start, end = expand_to_statement_units(units, block['modified_start_line'], block['modified_end_line'])
+        expanded.append(dict(block, modified_start_line=start, modified_end_line=end))
+    expanded.sort(key=lambda block: (block['modified_start_line'], block['modified_end_line']))
+
+    merged = []
+    for block in expanded:
+        previous = merged[-1] if merged else None
+        overlaps = previous is not None and (
+            block['modified_start_line'] < previous['modified_end_line']
+            or (block['modified_start_line'] == previous['modified_end_line']
+                and block['modified_start_line'] < block['modified_end_line']
+                and previous['modified_start_line'] < previous['modified_end_line']))
+        if overlaps:
+            previous['tag'] = previous['tag'] if previous['tag'] == block['tag'] else 'replace'
+            previous['original_start_line'] = min(previous['original_start_line'], block['original_start_line'])
+            previous['original_end_line'] = max(previous['original_end_line'], block['original_end_line'])
+            previous['modified_end_line'] = max(previous['modified_end_line'], block['modified_end_line'])
+        else:
+            merged.append(block)
+    for block in merged:
+        block['modified_lines'] = staged_lines[block['modified_start_line']:block['modified_end_line']]
+
+    widened = sum(1 for old, new in zip(change_blocks, expanded)
+                  if (old['modified_start_line'], old['modified_end_line']) != (new['modified_start_line'], new['modified_end_line']))
+    log_debug(f"  Expanded change blocks to whole statements: {len(change_blocks)} block(s) -> {len(merged)} "
+          f"({widened} widened)")
+    for block in merged:
+        log_debug(f"  - Block: Staged lines {block['modified_start_line']+1}-{block['modified_end_line']}")
+    return merged
+
+# Change data computed by prefetch_batch_block_packs, handed to the file's own pass (file path -> data)
+_BATCH_CHANGE_DATA = {}
+
+def get_change_data(file_path, diff_backend, expand_statements):
+    """
+    analyze_code_changes for file_path, with the change blocks of a modified file widened to whole
+    statements when expand_statements is set (Python --changes-only: send whole statements, not
+    fragments that cannot survive the syntax check). Reuses the batch prefetch's result if there is one.
+    """
+    content_data = _BATCH_CHANGE_DATA.pop(file_path, None)
+    if content_data is not None:
+        return content_data
+    content_data = analyze_code_changes(file_path, diff_backend)
+    if (expand_statements and content_data and content_data.get("modified") is not None
+            and content_data.get("is_modified") and content_data.get("change_blocks")):
+        content_data["change_blocks"] = expand_change_blocks_to_statements(content_data["modified"],
+                                                                           content_data["change_blocks"])
+    return content_data
+
+# Delimiters around each segment of a packed block request; the ID is the 1-based block number
+PACKED_SEGMENT_TEMPLATE = "<<<SEGMENT {id}>>>\n{code}\n<<<END SEGMENT {id}>>>"
+# Rules shared by single-block and packed requests
+BLOCK_SEGMENT_CONSTRAINTS = """- Do NOT add any explanations, comments about changes, or markdown formatting (like ```).
+- Ensure all original comments within the segment are retained. # <--- Added
+- Do NOT introduce new library imports/requires.
+- Do NOT define new functions or classes outside the original scope of the segment.
+- Preserve the core functionality and intended purpose of the segment.
+- Preserve the exact observable output and side effects (e.g., print statements) of the segment. # <--- Added
+- Minor efficiency improvements unrelated to the core sustainability anti-patterns are acceptable ONLY IF they strictly adhere to all other constraints (especially preserving output, comments, and functionality). The primary focus remains sustainability optimization. # <--- Added nuance
+- Try to maintain the relative indentation of the code within the segment.
+- Ensure the returned segment is syntactically valid IN THE CONTEXT where it will be placed back into the original file."""
+
+def build_block_pack_prompt(language_name, code_block_lang_hint, segments_text, segment_count, cross_file=False):
+    """User prompt for a packed block request; cross_file when the segments come from several files."""
+    source = f"several larger {language_name} files" if cross_file else f"a larger {language_name} file"
+    return f"""You are optimizing ONLY the following {segment_count} independent code segments from {source} for sustainability and efficiency.
+Focus on CPU, memory, I/O reduction, and algorithm optimization within each segment.
+Specifically look for and refactor common performance anti-patterns *within each segment* (like inefficient loops, unnecessary calculations, poor data structure use, resource handling relevant to {language_name}).
+
+Constraints for optimizing EACH SEGMENT (segments are optimized independently; never move code between them):
+{BLOCK_SEGMENT_CONSTRAINTS}
+
+Output format:
+- Return EVERY segment, in the same order, each wrapped in the same markers it was given in:
+<<<SEGMENT id>>>
+optimized code of that segment
+<<<END SEGMENT id>>>
+- Do NOT write anything outside the markers.
+
+Code Segments to Optimize (language: {code_block_lang_hint}):
+
+{segments_text}"""
+_PACKED_SEGMENT = re.compile(r'^[ \t]*<<<SEGMENT (\d+)>>>[ \t]*\n(.*?)^[ \t]*<<<END SEGMENT \1>>>',
+                             re.MULTILINE | re.DOTALL)
+
+def group_blocks_into_packs(pending_blocks, max_tokens=LLM_PACK_MAX_TOKENS, max_segments=LLM_PACK_MAX_SEGMENTS,
+                            max_block_lines=LLM_PACK_MAX_BLOCK_LINES):
+    """
+    Splits pending {block index: code} into packs (lists of block indices, in block order) of small
+    blocks within the token and segment budgets, and the blocks that go out alone.
+    Returns (packs, single_block_indices); a pack always holds at least two blocks.
+    """
+    packs, single_blocks = [], []
+    current, current_tokens = [], 0
+    for i in sorted(pending_blocks):
+        code = pending_blocks[i]
+        if code.count('\n') + 1 > max_block_lines:
+            single_blocks.append(i)
+            continue
+        tokens = estimate_tokens(code)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_segments):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    single_blocks.extend(pack[0] for pack in packs if len(pack) == 1)
+    return [pack for pack in packs if len(pack) > 1], sorted(single_blocks)
+
+def parse_packed_segments(response_text):
+    """Returns {segment id: code} for every well-formed segment in a packed LLM response."""
+    segments = {}
+    for match in _PACKED_SEGMENT.finditer(response_text):
+        segment_code = re.sub(r'^```[\w]*\n?|\n?```$', '', match.group(2), flags=re.MULTILINE)
+        segments.setdefault(int(match.group(1)), segment_code.lstrip('\n').rstrip()) # Keep the first line's indentation
+    return segments
+
 def apply_selective_changes(original_staged_content, change_blocks, optimized_blocks):
     """
     Reconstructs the file content by replacing modified blocks with optimized blocks.
     Operates on lists of lines for easier manipulation.
     """
-    print("  INFO: Reconstructing file with selective optimized changes")
+    log_debug("  INFO: Reconstructing file with selective optimized changes")
 
     if len(change_blocks) != len(optimized_blocks):
-        print(f"  ERROR: Mismatch between number of change blocks ({len(change_blocks)}) "
+        log_error(f"  ERROR: Mismatch between number of change blocks ({len(change_blocks)}) "
               f"and optimized blocks ({len(optimized_blocks)}). Cannot apply changes.")
         return None # Indicate failure
 
-    original_lines = original_staged_content.splitlines()
+    original_lines = split_source_lines(original_staged_content)
     result_lines = []
     last_copied_line_index = -1 # Keep track of where we are in the original staged lines
 
     for i, (block, optimized_code) in enumerate(zip(change_blocks, optimized_blocks)):
         start_line_in_staged = block['modified_start_line']
         end_line_in_staged = block['modified_end_line']
-        optimized_lines = optimized_code.splitlines() # Split the LLM output
+        optimized_lines = split_source_lines(optimized_code) # Split the LLM output
 
         # Copy the unchanged lines *before* the current block
         if start_line_in_staged > last_copied_line_index + 1:
@@ -300,7 +839,7 @@ def apply_selective_changes(original_staged_content, change_blocks, optimized_bl
         last_copied_line_index = end_line_in_staged - 1
 
         num_original_lines_in_block = end_line_in_staged - start_line_in_staged
-        print(f"    Applied optimization to block {i+1}: Staged lines {start_line_in_staged+1}-{end_line_in_staged} "
+        log_debug(f"    Applied optimization to block {i+1}: Staged lines {start_line_in_staged+1}-{end_line_in_staged} "
               f"({num_original_lines_in_block} lines) -> replaced with {len(optimized_lines)} optimized lines")
 
     # Copy any remaining lines *after* the last change block
@@ -315,7 +854,7 @@ def apply_selective_changes(original_staged_content, change_blocks, optimized_bl
          # Handle case where LLM added a newline unnecessarily (less common)
          pass # Keep the added newline for now, might be intentional
 
-    print(f"  Successfully reconstructed content.")
+    log_debug(f"  Successfully reconstructed content.")
     return updated_content
 
 
@@ -348,13 +887,13 @@ def detect_language(file_path, forced_language=None):
         lang_lower = forced_language.lower()
         if lang_lower in lang_key_map_force:
             language_name, language_key = lang_key_map_force[lang_lower]
-            print(f"  Forced language: {language_name} (Scoring Key: {language_key})")
+            log_debug(f"  Forced language: {language_name} (Scoring Key: {language_key})")
             return language_name, language_key
         else:
             # Use the forced name directly, but key remains None if not mapped
             language_name = forced_language
             language_key = None
-            print(f"  Forced language: {language_name} (No specific scoring key found, using defaults if available)")
+            log_debug(f"  Forced language: {language_name} (No specific scoring key found, using defaults if available)")
             return language_name, language_key
 
     # --- Automatic Detection ---
@@ -377,7 +916,7 @@ def detect_language(file_path, forced_language=None):
 
     if file_extension in language_map_ext:
         language_name, language_key = language_map_ext[file_extension]
-        print(f"  Detected language by extension ({file_extension}): {language_name} (Scoring Key: {language_key})")
+        log_debug(f"  Detected language by extension ({file_extension}): {language_name} (Scoring Key: {language_key})")
         return language_name, language_key
 
     # Shebang detection as fallback
@@ -398,17 +937,17 @@ def detect_language(file_path, forced_language=None):
                 # Add more as needed
 
                 if language_key: # If we found a mapping
-                     print(f"  Detected language by shebang: {language_name} (Scoring Key: {language_key})")
+                     log_debug(f"  Detected language by shebang: {language_name} (Scoring Key: {language_key})")
                      return language_name, language_key
                 elif language_name != 'Unknown': # If name identified but no key
-                     print(f"  Detected language by shebang: {language_name} (No specific scoring key)")
+                     log_debug(f"  Detected language by shebang: {language_name} (No specific scoring key)")
                      return language_name, None
 
     except Exception as e:
-        print(f"  Warning: Could not read file head for shebang detection: {e}")
+        log_warning(f"  Warning: Could not read file head for shebang detection: {e}")
 
     # Final fallback
-    print(f"  Warning: Could not determine specific language for {os.path.basename(file_path)}. Using default '{language_name}'.")
+    log_warning(f"  Warning: Could not determine specific language for {os.path.basename(file_path)}. Using default '{language_name}'.")
     return language_name, language_key
 
 
@@ -452,10 +991,39 @@ Return ONLY the optimized code. Do not include any explanations, comments about
     # Return specific prompt if found, otherwise the enhanced default
     return prompts.get(language_name, default_prompt)
 
-def run_tool(command, working_dir=None, check=False, timeout=60):
-    """Runs an external tool, captures output, handles errors."""
+def get_llm_system_prompt(language_name, compact_comments):
+    """System prompt for a file's LLM requests, with the placeholder note when comments are compacted."""
+    system_prompt = get_language_specific_system_prompt(language_name)
+    if compact_comments:
+        system_prompt += "\n\n" + PLACEHOLDER_PROMPT_NOTE
+    return system_prompt
+
+def compact_code_for_prompt(code, placeholders, issued=None):
+    """
+    compact_python_source, falling back to the raw code (without issuing placeholders) if the
+    compacted text does not restore to it exactly.
+    """
+    new_ids = set()
+    compacted = compact_python_source(code, placeholders, new_ids)
+    try:
+        round_trip_ok = restore_python_source(compacted, {i: placeholders[i] for i in new_ids}) == code
+    except PlaceholderMismatch:
+        round_trip_ok = False
+    if not round_trip_ok:
+        for placeholder_id in new_ids: # The newest IDs, so later ones keep counting from here
+            del placeholders[placeholder_id]
+        log_warning("  WARNING: Comment compaction did not round-trip; sending this code uncompacted.")
+        return code
+    if issued is not None:
+        issued.update(new_ids)
+    return compacted
+
+@traced("tool")
+def run_tool(command, working_dir=None, check=False, timeout=60, log=log_captured):
+    """Runs an external tool, captures output, handles errors. Log lines go through `log` (the event log by default)."""
     command_str = ' '.join(command)
-    print(f"    Executing: {command_str}" + (f" in {working_dir}" if working_dir else ""))
+    annotate_span(tool=command[0], command=command_str[:200])
+    log(f"    Executing: {command_str}" + (f" in {working_dir}" if working_dir else ""))
     try:
         process = subprocess.run(
             command,
@@ -467,38 +1035,70 @@ def run_tool(command, working_dir=None, check=False, timeout=60):
             check=check, # Raise CalledProcessError if return code != 0 if True
             timeout=timeout # Add a timeout
         )
+        annotate_span(returncode=process.returncode)
         # Log warnings for non-zero exit codes if not checking
         if process.returncode != 0 and not check:
-            print(f"    WARNING: Tool '{command[0]}' exited with code {process.returncode}.")
+            log(f"    WARNING: Tool '{command[0]}' exited with code {process.returncode}.")
             if process.stderr:
                 # Limit stderr length in logs to avoid flooding
                 stderr_preview = process.stderr.strip()[:500]
-                print(f"    Tool Stderr (preview):\n{stderr_preview}{'...' if len(process.stderr.strip()) > 500 else ''}")
+                log(f"    Tool Stderr (preview):\n{stderr_preview}{'...' if len(process.stderr.strip()) > 500 else ''}")
         # Return stdout on success or non-checked failure
         return process.stdout
 
     except FileNotFoundError:
-        print(f"    ERROR: Command not found: '{command[0]}'. Is it installed and in PATH?")
+        log(f"    ERROR: Command not found: '{command[0]}'. Is it installed and in PATH?")
         return None
     except subprocess.TimeoutExpired:
-        print(f"    ERROR: Tool '{command[0]}' timed out after {timeout} seconds.")
+        log(f"    ERROR: Tool '{command[0]}' timed out after {timeout} seconds.")
         return None
     except subprocess.CalledProcessError as e:
         # This happens if check=True and return code is non-zero
-        print(f"    ERROR: Tool '{command[0]}' failed (Exit Code {e.returncode}).")
+        log(f"    ERROR: Tool '{command[0]}' failed (Exit Code {e.returncode}).")
         # stderr/stdout are captured in the exception object
-        if e.stdout: print(f"    Tool Stdout:\n{e.stdout.strip()}")
-        if e.stderr: print(f"    Tool Stderr:\n{e.stderr.strip()}")
+        if e.stdout: log(f"    Tool Stdout:\n{e.stdout.strip()}")
+        if e.stderr: log(f"    Tool Stderr:\n{e.stderr.strip()}")
         return None # Indicate failure
     except Exception as e:
         # Catch other potential errors (e.g., permissions)
-        print(f"    ERROR: Failed running tool '{command[0]}': {e}")
+        log(f"    ERROR: Failed running tool '{command[0]}': {e}")
         return None
 
+def run_tools_concurrently(tool_commands, max_workers=STATIC_TOOLS_MAX_WORKERS):
+    """
+    Runs several external tools at once (one thread per tool; the work happens in the child
+    processes, so threads are enough). tool_commands maps tool name -> (command, timeout).
+    Returns tool name -> (stdout or None, [log lines]) so callers can report each tool in a fixed order.
+    Each tool keeps its own timeout and error handling from run_tool.
+    """
+    def _run_one(command, timeout):
+        log_lines = []
+        output = run_tool(command, timeout=timeout, log=log_lines.append)
+        return output, log_lines
+
+    results = {}
+    if not tool_commands:
+        return results
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tool_commands)))) as executor:
+        futures = {name: executor.submit(_run_one, command, timeout)
+                   for name, (command, timeout) in tool_commands.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = (None, [f"    ERROR: Failed running tool '{name}': {e}"])
+    return results
+
 # --- Metric Parsing Functions ---
 
-def parse_lizard_output(lizard_output):
-    """Parses Lizard complexity and function length output."""
+def parse_lizard_output(lizard_output, by_file=False):
+    """
+    Parses Lizard complexity and function length output.
+    With by_file=True (lizard run over many files) returns {file path: metrics} instead, built from
+    the file named in each function row's location column.
+    """
+    if by_file:
+        return parse_lizard_output_by_file(lizard_output)
     metrics = {}
     if not lizard_output: return metrics
     lines = lizard_output.strip().split('\n')
@@ -525,16 +1125,9 @@ def parse_lizard_output(lizard_output):
         if total_nloc > 0 : metrics['loc_code_lizard'] = total_nloc # Use Lizard's NLOC if available
 
         # Parse function details from the main table part
-        for line in lines:
-             # Look for lines starting with numbers (line no, CCN, token CCN, NLOC, name, ...)
-             parts = line.split()
-             if len(parts) >= 5 and parts[0].isdigit() and parts[1].isdigit() and parts[3].isdigit():
-                 # Assuming format: line_no CCN tCCN NLOC func_name ...
-                 try:
-                     complexities.append(int(parts[1])) # Cyclomatic Complexity
-                     function_locs.append(int(parts[3])) # NLOC for the function
-                 except ValueError:
-                     continue # Skip lines that don't parse correctly
+        for nloc, ccn, _ in lizard_function_rows(lines):
+             complexities.append(ccn) # Cyclomatic Complexity
+             function_locs.append(nloc) # NLOC for the function
 
         if complexities:
             metrics['cyclomatic_complexity_max'] = max(complexities)
@@ -543,47 +1136,113 @@ def parse_lizard_output(lizard_output):
             metrics['function_loc_max'] = max(function_locs) # Max function length (NLOC)
 
     except Exception as e:
-        print(f"    ERROR: Parsing Lizard output failed: {e}\nOutput was:\n{lizard_output[:500]}...")
+        log_error(f"    ERROR: Parsing Lizard output failed: {e}\nOutput was:\n{lizard_output[:500]}...")
     return metrics
 
-def parse_cloc_output(cloc_json_output):
-    """Parses cloc JSON output for LOC metrics."""
+def lizard_function_rows(lines):
+    """Yields (nloc, ccn, location) for each function row of lizard's table."""
+    for line in lines:
+        # The function table ends at the "N file(s) analyzed." line; the warnings
+        # section further down repeats the same rows and must not be counted twice
+        if "file analyzed" in line or "files analyzed" in line:
+            break
+        # Function rows: NLOC CCN token PARAM length location (name@start-end@file)
+        parts = line.split()
+        if len(parts) >= 6 and all(part.isdigit() for part in parts[:5]) and '@' in parts[5]:
+            yield int(parts[0]), int(parts[1]), ' '.join(parts[5:])
+
+def parse_lizard_output_by_file(lizard_output):
+    """Per-file version of parse_lizard_output: {normalized file path: metrics}."""
+    per_file = {}
+    if not lizard_output: return per_file
+    try:
+        complexities, function_locs = {}, {}
+        for nloc, ccn, location in lizard_function_rows(lizard_output.strip().split('\n')):
+            location_parts = location.split('@', 2) # name@start-end@file (the file may contain '@')
+            if len(location_parts) != 3:
+                continue
+            file_key = os.path.normpath(location_parts[2])
+            complexities.setdefault(file_key, []).append(ccn)
+            function_locs.setdefault(file_key, []).append(nloc)
+        for file_key, file_complexities in complexities.items():
+            per_file[file_key] = {
+                'cyclomatic_complexity_max': max(file_complexities),
+                'cyclomatic_complexity_avg': round(sum(file_complexities) / len(file_complexities), 2),
+                'function_loc_max': max(function_locs[file_key]),
+            }
+    except Exception as e:
+        log_error(f"    ERROR: Parsing batched Lizard output failed: {e}\nOutput was:\n{lizard_output[:500]}...")
+    return per_file
+
+def cloc_block_metrics(block):
+    """LOC metrics from one cloc JSON block (a file entry or the SUM block)."""
+    metrics = {
+        'loc_blank_cloc': block.get('blank', 0),
+        'loc_comment_cloc': block.get('comment', 0),
+        'loc_code_cloc': block.get('code', 0),
+    }
+    # Calculate total LOC from components
+    metrics['loc_total_cloc'] = sum([metrics['loc_blank_cloc'], metrics['loc_comment_cloc'], metrics['loc_code_cloc']])
+    return metrics
+
+def parse_cloc_output(cloc_json_output, by_file=False):
+    """
+    Parses cloc JSON output for LOC metrics.
+    With by_file=True (output of 'cloc --by-file --json' over many files) returns
+    {normalized file path: metrics} for every file block, ignoring 'header' and 'SUM'.
+    """
     metrics = {}
     if not cloc_json_output: return metrics
     try:
         cloc_data = json.loads(cloc_json_output)
+        if by_file:
+            for file_key, block in cloc_data.items():
+                if file_key not in ("header", "SUM") and isinstance(block, dict):
+                    metrics[os.path.normpath(file_key)] = cloc_block_metrics(block)
+            log_debug(f"    - Parsed cloc per-file blocks for {len(metrics)} file(s).")
+            return metrics
         summary = cloc_data.get('SUM') # Summary block for multiple files/languages
         target_data = None
 
         if summary:
              target_data = summary # Use the summary if present
-             print("    - Parsed cloc SUM block.")
+             log_debug("    - Parsed cloc SUM block.")
         elif len(cloc_data) == 2 and "header" in cloc_data: # Check for single file case more reliably
             file_key = next((key for key in cloc_data if key != "header"), None)
             if file_key:
                  target_data = cloc_data[file_key]
-                 print(f"    - Parsed cloc single file block ('{file_key}').")
+                 log_debug(f"    - Parsed cloc single file block ('{file_key}').")
         elif len(cloc_data) == 1 and "header" not in cloc_data: # Older single file case without header
             file_key = list(cloc_data.keys())[0]
             target_data = cloc_data[file_key]
-            print(f"    - Parsed cloc legacy single file block ('{file_key}').")
+            log_debug(f"    - Parsed cloc legacy single file block ('{file_key}').")
 
 
         if target_data:
-             metrics['loc_blank_cloc'] = target_data.get('blank', 0)
-             metrics['loc_comment_cloc'] = target_data.get('comment', 0)
-             metrics['loc_code_cloc'] = target_data.get('code', 0)
-             # Calculate total LOC from components
-             metrics['loc_total_cloc'] = sum([metrics['loc_blank_cloc'], metrics['loc_comment_cloc'], metrics['loc_code_cloc']])
+             metrics.update(cloc_block_metrics(target_data))
         else:
-             print(f"    WARNING: Could not find SUM or single file data block in cloc JSON output.")
+             log_warning(f"    WARNING: Could not find SUM or single file data block in cloc JSON output.")
 
     except json.JSONDecodeError:
-        print(f"    ERROR: Decoding cloc JSON failed. Output (start):\n{cloc_json_output[:500]}...")
+        log_error(f"    ERROR: Decoding cloc JSON failed. Output (start):\n{cloc_json_output[:500]}...")
     except Exception as e:
-        print(f"    ERROR: Processing cloc output failed: {e}")
+        log_error(f"    ERROR: Processing cloc output failed: {e}")
     return metrics
 
+def parse_radon_raw_json(radon_json_output):
+    """Parses 'radon raw -j' output into {normalized file path: {'loc_logical_radon': LLOC}}."""
+    per_file = {}
+    if not radon_json_output: return per_file
+    try:
+        for file_key, block in json.loads(radon_json_output).items():
+            if isinstance(block, dict) and 'lloc' in block:
+                per_file[os.path.normpath(file_key)] = {'loc_logical_radon': block['lloc']}
+            elif isinstance(block, dict) and 'error' in block:
+                log_warning(f"    WARNING: Radon could not analyze {os.path.basename(file_key)}: {block['error']}")
+    except (json.JSONDecodeError, AttributeError) as e:
+        log_error(f"    ERROR: Decoding Radon JSON failed ({e}). Output (start):\n{radon_json_output[:500]}...")
+    return per_file
+
 # --- Dependency Counting Functions ---
 
 def count_python_dependencies(file_path):
@@ -604,10 +1263,10 @@ def count_python_dependencies(file_path):
                     base_module = match.group(1) # No need to split, pattern captures base
                     if base_module: modules.add(base_module)
         count = len(modules)
-        print(f"    - Python Dependencies Found (base module count): {count} {sorted(list(modules)) if modules else ''}")
+        log_debug(f"    - Python Dependencies Found (base module count): {count} {sorted(list(modules)) if modules else ''}")
         return count
     except Exception as e:
-        print(f"    ERROR: Counting Python dependencies failed: {e}")
+        log_error(f"    ERROR: Counting Python dependencies failed: {e}")
         return 0 # Return 0 on error
 
 def count_javascript_dependencies(file_path):
@@ -630,10 +1289,10 @@ def count_javascript_dependencies(file_path):
         for match in imp_pattern.finditer(content):
             modules.add(match.group(1))
         count = len(modules)
-        print(f"    - JS/TS Dependencies Found (non-relative count): {count} {sorted(list(modules)) if modules else ''}")
+        log_debug(f"    - JS/TS Dependencies Found (non-relative count): {count} {sorted(list(modules)) if modules else ''}")
         return count
     except Exception as e:
-        print(f"    ERROR: Counting JS/TS dependencies failed: {e}")
+        log_error(f"    ERROR: Counting JS/TS dependencies failed: {e}")
         return 0
 
 def count_c_cpp_dependencies(file_path):
@@ -654,27 +1313,32 @@ def count_c_cpp_dependencies(file_path):
                 if match:
                     modules.add(match.group(1)) # Add the header name (e.g., 'stdio.h', 'vector')
         count = len(modules)
-        print(f"    - C/C++ System Dependencies Found (#include <...> count): {count} {sorted(list(modules)) if modules else ''}")
+        log_debug(f"    - C/C++ System Dependencies Found (#include <...> count): {count} {sorted(list(modules)) if modules else ''}")
         return count
     except Exception as e:
-        print(f"    ERROR: Counting C/C++ dependencies failed: {e}")
+        log_error(f"    ERROR: Counting C/C++ dependencies failed: {e}")
         return 0
 
 
 # --- Function to get static metrics ---
-def get_static_metrics(file_path, language_key):
-    """Calculate static analysis metrics using external tools."""
+def get_static_metrics(file_path, language_key, concurrent_tools=True):
+    """
+    Calculate static analysis metrics using external tools.
+    All applicable tools (lizard, cloc, radon) are launched together, so the wall time is that of
+    the slowest tool rather than the sum; concurrent_tools=False runs them one after another.
+    """
     metrics = {}
     if not os.path.exists(file_path):
-        print(f"  ERROR: File not found for static analysis: {file_path}")
+        log_error(f"  ERROR: File not found for static analysis: {file_path}")
         return metrics
 
-    print(f"\n  STATIC METRICS: Calculating for '{language_key or 'unknown lang'}' file: {os.path.basename(file_path)}")
+    log_debug(f"\n  STATIC METRICS: Calculating for '{language_key or 'unknown lang'}' file: {os.path.basename(file_path)}")
+    tool_commands = {} # tool name -> (command, timeout), in reporting order
 
     # --- Lizard (Complexity, Function Length, NLOC) ---
-    lizard_path = shutil.which("lizard")
+    lizard_path = find_tool("lizard")
     if language_key and lizard_path: # Only run if language known and lizard installed
-        print("    Running Lizard...")
+        log_debug("    Running Lizard...")
         # Basic command
         lizard_cmd = [lizard_path, file_path]
         # Add language flag if supported by Lizard for potentially better parsing
@@ -684,91 +1348,362 @@ def get_static_metrics(file_path, language_key):
                                   'go', 'lua', 'rust']
         if language_key in supported_lizard_langs:
             lizard_cmd.extend(["-l", language_key])
-            print(f"      (Using language flag: -l {language_key})")
+            log_debug(f"      (Using language flag: -l {language_key})")
         else:
-             print("      (Language not directly supported by Lizard flag, using auto-detection)")
-
-        lizard_output = run_tool(lizard_cmd)
-        if lizard_output is not None: # Check if run_tool succeeded
-             metrics.update(parse_lizard_output(lizard_output))
-             # Log what was parsed
-             parsed_lizard = {k:v for k,v in metrics.items() if 'cyclomatic' in k or 'function_loc' in k or 'lizard' in k}
-             print(f"    - Lizard Metrics Parsed: {parsed_lizard}")
-        else:
-             print("    - Lizard execution failed or returned no output.")
+             log_debug("      (Language not directly supported by Lizard flag, using auto-detection)")
+        tool_commands["lizard"] = (lizard_cmd, STATIC_TOOL_TIMEOUTS['lizard'])
 
     elif language_key:
-         print(f"    INFO: 'lizard' command not found or language key '{language_key}' unknown. Skipping Lizard metrics.")
+         log_debug(f"    INFO: 'lizard' command not found or language key '{language_key}' unknown. Skipping Lizard metrics.")
     else:
-         print("    INFO: Language key unknown. Skipping Lizard metrics.")
-
+         log_debug("    INFO: Language key unknown. Skipping Lizard metrics.")
 
     # --- cloc (Code/Comment/Blank Lines) ---
-    cloc_path = shutil.which("cloc")
+    cloc_path = find_tool("cloc")
     if cloc_path:
-        print("    Running cloc...")
+        log_debug("    Running cloc...")
         # Use --json for easy parsing, --quiet to suppress progress messages
-        cloc_output_json = run_tool([cloc_path, "--json", "--quiet", file_path])
+        tool_commands["cloc"] = ([cloc_path, "--json", "--quiet", file_path], STATIC_TOOL_TIMEOUTS['cloc'])
+    else:
+        log_warning("    WARNING: 'cloc' command not found. Skipping cloc LOC metrics. (Install cloc for line counts)")
+
+    # --- Radon (Logical LOC for Python) ---
+    if language_key == 'python':
+        radon_path = find_tool("radon")
+        if radon_path:
+            log_debug("    Running Radon (Logical LOC)...")
+            # Use 'raw' command, '-s' to show summary including LLOC
+            # Ensure python executable is found correctly
+            python_exe = sys.executable or "python" # Fallback to just 'python'
+            tool_commands["radon"] = ([python_exe, "-m", "radon", "raw", "-s", file_path], STATIC_TOOL_TIMEOUTS['radon'])
+        else:
+            log_warning("    WARNING: 'radon' command not found. Skipping Python LLOC metric. (Install: pip install radon)")
+
+    # --- Run the tools (concurrently by default) ---
+    if concurrent_tools and len(tool_commands) > 1:
+        log_debug(f"    Launching {len(tool_commands)} tools concurrently: {', '.join(tool_commands)}")
+        started = time.perf_counter()
+        tool_results = run_tools_concurrently(tool_commands)
+        log_debug(f"    Tools finished in {time.perf_counter() - started:.2f}s (wall time of the slowest tool)")
+    else:
+        tool_results = {}
+        for name, (command, timeout) in tool_commands.items():
+            log_lines = []
+            tool_results[name] = (run_tool(command, timeout=timeout, log=log_lines.append), log_lines)
+
+    # Each tool's buffered log is printed in a fixed order, followed by its parsed metrics
+    if "lizard" in tool_results:
+        lizard_output, log_lines = tool_results["lizard"]
+        for line in log_lines: log_captured(line)
+        if lizard_output is not None: # Check if run_tool succeeded
+             metrics.update(parse_lizard_output(lizard_output))
+             # Log what was parsed
+             parsed_lizard = {k:v for k,v in metrics.items() if 'cyclomatic' in k or 'function_loc' in k or 'lizard' in k}
+             log_debug(f"    - Lizard Metrics Parsed: {parsed_lizard}")
+        else:
+             log_debug("    - Lizard execution failed or returned no output.")
+
+    if "cloc" in tool_results:
+        cloc_output_json, log_lines = tool_results["cloc"]
+        for line in log_lines: log_captured(line)
         if cloc_output_json is not None:
             cloc_metrics = parse_cloc_output(cloc_output_json)
             metrics.update(cloc_metrics)
             # Log parsed cloc metrics
             parsed_cloc = {k:v for k,v in metrics.items() if 'cloc' in k}
-            print(f"    - cloc Metrics Parsed: {parsed_cloc}")
+            log_debug(f"    - cloc Metrics Parsed: {parsed_cloc}")
             if 'loc_code_cloc' not in metrics:
-                 print(f"    WARNING: Could not parse 'code' lines from cloc output.")
+                 log_warning(f"    WARNING: Could not parse 'code' lines from cloc output.")
         else:
-             print("    - cloc execution failed or returned no output.")
-    else:
-        print("    WARNING: 'cloc' command not found. Skipping cloc LOC metrics. (Install cloc for line counts)")
+             log_debug("    - cloc execution failed or returned no output.")
+
+    if "radon" in tool_results:
+        radon_raw_output, log_lines = tool_results["radon"]
+        for line in log_lines: log_captured(line)
+        if radon_raw_output:
+            # Regex to find the LLOC value in the summary output
+            match = re.search(r"^\s*LLOC:\s*(\d+)", radon_raw_output, re.MULTILINE)
+            if match:
+                try:
+                    metrics['loc_logical_radon'] = int(match.group(1))
+                    log_debug(f"    - Logical LOC (radon): {metrics['loc_logical_radon']}")
+                except ValueError:
+                    log_error("    ERROR: Could not parse LLOC value from Radon output.")
+            else:
+                log_warning("    WARNING: Could not find LLOC in Radon output.")
 
     # --- Language Specific Metrics ---
     if language_key == 'python':
-        # Radon (Logical LOC for Python)
-        radon_path = shutil.which("radon")
-        if radon_path:
-            print("    Running Radon (Logical LOC)...")
-            # Use 'raw' command, '-s' to show summary including LLOC
-            # Ensure python executable is found correctly
-            python_exe = sys.executable or "python" # Fallback to just 'python'
-            radon_raw_output = run_tool([python_exe, "-m", "radon", "raw", "-s", file_path])
-            if radon_raw_output:
-                # Regex to find the LLOC value in the summary output
-                match = re.search(r"^\s*LLOC:\s*(\d+)", radon_raw_output, re.MULTILINE)
-                if match:
-                    try:
-                        metrics['loc_logical_radon'] = int(match.group(1))
-                        print(f"    - Logical LOC (radon): {metrics['loc_logical_radon']}")
-                    except ValueError:
-                        print("    ERROR: Could not parse LLOC value from Radon output.")
-                else:
-                    print("    WARNING: Could not find LLOC in Radon output.")
-        else:
-            print("    WARNING: 'radon' command not found. Skipping Python LLOC metric. (Install: pip install radon)")
-
         # Dependency Count (Python)
-        print("    Counting Python Dependencies...")
+        log_debug("    Counting Python Dependencies...")
         metrics['dependency_count'] = count_python_dependencies(file_path)
 
     elif language_key == 'javascript':
          # Dependency Count (JS/TS)
-         print("    Counting JS/TS Dependencies...")
+         log_debug("    Counting JS/TS Dependencies...")
          metrics['dependency_count'] = count_javascript_dependencies(file_path)
          # Could add ESLint complexity check here if needed later
 
     elif language_key in ['c', 'cpp']:
          # Dependency Count (C/C++)
-         print("    Counting C/C++ System Dependencies...")
+         log_debug("    Counting C/C++ System Dependencies...")
          metrics['dependency_count'] = count_c_cpp_dependencies(file_path)
          # Could add cppcheck integration here if needed later
 
     # --- Log final metrics collected ---
     # Filter out None values before printing
     final_metrics_log = {k: v for k, v in metrics.items() if v is not None}
-    print(f"  STATIC METRICS collected: {json.dumps(final_metrics_log)}")
+    log_debug(f"  STATIC METRICS collected: {json.dumps(final_metrics_log)}")
+    return metrics
+
+
+# --- Metrics Cache (content hash + language + tool versions -> metrics) ---
+_METRICS_CACHE = None
+_BATCH_METRICS = {} # Metrics cache key -> metrics computed by precompute_batch_metrics for this run
+
+def get_metrics_cache():
+    """Return the shared metrics DiskCache under .git/, or None outside a Git repository."""
+    global _METRICS_CACHE
+    if _METRICS_CACHE is None:
+        cache_dir = get_git_cache_dir("metrics")
+        _METRICS_CACHE = DiskCache(cache_dir, METRICS_CACHE_MAX_BYTES) if cache_dir else False
+    return _METRICS_CACHE or None
+
+@functools.lru_cache(maxsize=None)
+def get_metrics_tool_fingerprint():
+    """
+    Identify the installed lizard/cloc/radon without spawning them: executable path, size and mtime
+    change whenever a tool is upgraded, which is enough to invalidate cached metrics.
+    """
+    parts = [f"schema={METRICS_CACHE_SCHEMA}", f"python={sys.version_info[:3]}"]
+    for tool in ("lizard", "cloc", "radon"):
+        tool_path = find_tool(tool)
+        if tool_path:
+            try:
+                stat = os.stat(tool_path)
+                parts.append(f"{tool}={tool_path}:{stat.st_size}:{int(stat.st_mtime)}")
+            except OSError:
+                parts.append(f"{tool}={tool_path}")
+        else:
+            parts.append(f"{tool}=missing")
+    return ";".join(parts)
+
+def get_metrics_cache_key(code_content, file_path, language_key, use_native):
+    """Cache key for metrics of code_content: content, language, extension (cloc), engine and tool versions."""
+    return make_cache_key(code_content, language_key or "", os.path.splitext(file_path)[1],
+                          "native" if use_native else "tools", get_metrics_tool_fingerprint())
+
+def get_native_python_metrics(code_content):
+    """Python metrics from the in-process engine (one token scan, no subprocesses), or None if it cannot tokenize the code."""
+    log_debug("    Running built-in Python metrics engine (single token scan, no subprocesses)...")
+    try:
+        metrics = compute_python_metrics(code_content)
+    except Exception as e:
+        log_error(f"    ERROR: Built-in Python metrics engine failed: {e}")
+        return None
+    if metrics is None:
+        log_warning("    WARNING: Built-in engine could not tokenize the code. Falling back to external tools.")
+        return None
+    log_debug(f"  STATIC METRICS collected: {json.dumps(metrics)}")
+    return metrics
+
+@traced("metrics")
+def get_metrics_for_content(code_content, file_path, language_key, stage_name, use_cache=True, python_engine='native'):
+    """
+    Static metrics for in-memory code: consults the metrics cache first, then the built-in Python
+    engine, otherwise writes the content to a temp file (keeping the original extension for cloc)
+    and runs get_static_metrics.
+    """
+    suffix = os.path.splitext(file_path)[1]
+    use_native = language_key == 'python' and python_engine == 'native'
+    cache = get_metrics_cache() if use_cache else None
+    cache_key = None
+    if cache or _BATCH_METRICS:
+        cache_key = get_metrics_cache_key(code_content, file_path, language_key, use_native)
+    if cache_key in _BATCH_METRICS:
+        batch_metrics = _BATCH_METRICS[cache_key]
+        log_debug(f"  STATIC METRICS ({stage_name}): Reusing metrics from the batched tool run.")
+        log_debug(f"  STATIC METRICS collected: {json.dumps({k: v for k, v in batch_metrics.items() if v is not None})}")
+        return batch_metrics
+    if cache:
+        cached_metrics = cache.get(cache_key)
+        if cached_metrics is not None:
+            log_debug(f"  STATIC METRICS ({stage_name}): Cache hit, reusing metrics for identical content.")
+            log_debug(f"  STATIC METRICS collected: {json.dumps({k: v for k, v in cached_metrics.items() if v is not None})}")
+            return cached_metrics
+
+    if use_native:
+        log_debug(f"\n  STATIC METRICS ({stage_name}): Calculating for 'python' content in-process")
+        metrics = get_native_python_metrics(code_content)
+        if metrics is not None:
+            if cache:
+                cache.put(cache_key, metrics)
+            return metrics
+
+    temp_file = None
+    try:
+        # Use context manager for temporary file creation
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=suffix, encoding='utf-8') as temp_f:
+            temp_f.write(code_content)
+            temp_file = temp_f.name
+        log_debug(f"  STATIC METRICS ({stage_name}): Analyzing temp file: {temp_file}")
+        metrics = get_static_metrics(temp_file, language_key)
+    finally:
+        # Ensure cleanup of the temporary file
+        if temp_file and os.path.exists(temp_file):
+            try: os.remove(temp_file)
+            except OSError: log_warning(f"Warning: Failed to remove temp file {temp_file}")
+
+    # Empty results usually mean every tool failed; don't pin that in the cache
+    if cache and metrics:
+        cache.put(cache_key, metrics)
     return metrics
 
 
+# --- Batched Tool Runs (one lizard/cloc/radon invocation for many files) ---
+def batch_tool_timeout(tool_name, file_count):
+    """Timeout for one tool run over file_count files: the single-file budget plus a per-file allowance."""
+    return STATIC_TOOL_TIMEOUTS[tool_name] + BATCH_TOOL_TIMEOUT_PER_FILE * file_count
+
+def get_static_metrics_batch(file_entries):
+    """
+    Batched get_static_metrics: file_entries is a list of (file_path, language_key) on disk.
+    Runs 'cloc --by-file --json' once, lizard once per language and 'radon raw -j' once for the
+    Python files (all concurrently), then splits every report back into per-file metric dicts
+    with the same keys get_static_metrics produces. Returns {file_path: metrics}.
+    """
+    per_file = {file_path: {} for file_path, _ in file_entries}
+    if not file_entries:
+        return per_file
+    log_debug(f"\n  STATIC METRICS (batch): Calculating for {len(file_entries)} file(s) with one run per tool")
+    supported_lizard_langs = ['python', 'c', 'cpp', 'java', 'javascript', 'objectivec',
+                              'swift', 'csharp', 'ruby', 'ttcn', 'php', 'scala', 'gdscript',
+                              'go', 'lua', 'rust']
+    tool_commands = {}
+
+    lizard_path = find_tool("lizard")
+    if lizard_path:
+        # Same language flag as the single-file path; unknown languages stay out, as they do there
+        lizard_groups = {}
+        for file_path, language_key in file_entries:
+            if language_key:
+                lizard_groups.setdefault(language_key if language_key in supported_lizard_langs else None, []).append(file_path)
+        for language_key, group_paths in lizard_groups.items():
+            lizard_cmd = [lizard_path] + (["-l", language_key] if language_key else []) + group_paths
+            tool_commands[f"lizard:{language_key or 'auto'}"] = (lizard_cmd, batch_tool_timeout('lizard', len(group_paths)))
+    else:
+        log_debug("    INFO: 'lizard' command not found. Skipping Lizard metrics.")
+
+    cloc_path = find_tool("cloc")
+    if cloc_path:
+        # --skip-uniqueness: cloc would otherwise report identical files only once
+        cloc_cmd = [cloc_path, "--by-file", "--json", "--quiet", "--skip-uniqueness"] + [path for path, _ in file_entries]
+        tool_commands["cloc"] = (cloc_cmd, batch_tool_timeout('cloc', len(file_entries)))
+    else:
+        log_warning("    WARNING: 'cloc' command not found. Skipping cloc LOC metrics. (Install cloc for line counts)")
+
+    python_paths = [path for path, language_key in file_entries if language_key == 'python']
+    if python_paths:
+        if find_tool("radon"):
+            python_exe = sys.executable or "python"
+            tool_commands["radon"] = ([python_exe, "-m", "radon", "raw", "-j"] + python_paths,
+                                      batch_tool_timeout('radon', len(python_paths)))
+        else:
+            log_warning("    WARNING: 'radon' command not found. Skipping Python LLOC metric. (Install: pip install radon)")
+
+    log_debug(f"    Launching {len(tool_commands)} tool run(s) for the batch: {', '.join(tool_commands)}")
+    started = time.perf_counter()
+    tool_results = run_tools_concurrently(tool_commands, max_workers=len(tool_commands) or 1)
+    log_debug(f"    Batched tools finished in {time.perf_counter() - started:.2f}s")
+
+    normalized_paths = {os.path.normpath(file_path): file_path for file_path, _ in file_entries}
+    for name, (output, log_lines) in tool_results.items():
+        for line in log_lines: log_captured(line)
+        if output is None:
+            log_debug(f"    - {name} execution failed or returned no output.")
+            continue
+        if name.startswith("lizard"):
+            parsed = parse_lizard_output(output, by_file=True)
+        elif name == "cloc":
+            parsed = parse_cloc_output(output, by_file=True)
+        else:
+            parsed = parse_radon_raw_json(output)
+        for file_key, file_metrics in parsed.items():
+            file_path = normalized_paths.get(file_key)
+            if file_path is not None:
+                per_file[file_path].update(file_metrics)
+
+    # Dependency counting is a cheap in-process regex scan, same as in get_static_metrics
+    dependency_counters = {'python': count_python_dependencies, 'javascript': count_javascript_dependencies,
+                           'c': count_c_cpp_dependencies, 'cpp': count_c_cpp_dependencies}
+    for file_path, language_key in file_entries:
+        if language_key in dependency_counters:
+            per_file[file_path]['dependency_count'] = dependency_counters[language_key](file_path)
+    return per_file
+
+@traced("metrics")
+def precompute_batch_metrics(file_paths, full_file_mode=False, forced_language=None, use_metrics_cache=True,
+                             python_metrics_engine='native'):
+    """
+    Computes the BEFORE metrics of every file in the batch that needs the external tools with a
+    single run per tool (instead of one lizard/cloc/radon launch per file), and stores them in
+    _BATCH_METRICS (and the metrics cache) under the keys get_metrics_for_content looks up.
+    Python files handled by the native engine and cache hits are skipped.
+    """
+    cache = get_metrics_cache() if use_metrics_cache else None
+    snapshot = None if full_file_mode else get_git_snapshot()
+    pending = [] # (file_path, language_key, content, cache_key)
+    for file_path in file_paths:
+        with contextlib.redirect_stdout(io.StringIO()): # detect_language logs again during the per-file run
+            _, language_key = detect_language(file_path, forced_language)
+        if language_key == 'python' and python_metrics_engine == 'native':
+            continue
+        try:
+            if full_file_mode or not snapshot:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            else:
+                staged_bytes = snapshot.get_staged_bytes(file_path)
+                if staged_bytes is None:
+                    continue
+                content = decode_blob(staged_bytes)
+        except (OSError, UnicodeDecodeError, GitError):
+            continue # The per-file run reports the problem
+        cache_key = get_metrics_cache_key(content, file_path, language_key, False)
+        if cache_key in _BATCH_METRICS or (cache and cache.contains(cache_key)):
+            continue
+        pending.append((file_path, language_key, content, cache_key))
+
+    if len(pending) < 2:
+        return 0 # Nothing to gain over the per-file path
+    batch_dir = tempfile.mkdtemp(prefix="green_code_batch_")
+    try:
+        file_entries = []
+        for index, (file_path, language_key, content, _) in enumerate(pending):
+            # One sub-directory per file keeps the original name and extension (cloc/lizard detect by it)
+            temp_path = os.path.join(batch_dir, str(index), os.path.basename(file_path))
+            os.makedirs(os.path.dirname(temp_path))
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            file_entries.append((temp_path, language_key))
+        batch_results = get_static_metrics_batch(file_entries)
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+    stored = 0
+    for (temp_path, _), (_, _, _, cache_key) in zip(file_entries, pending):
+        metrics = batch_results.get(temp_path)
+        # Empty results usually mean every tool failed; leave those files to the per-file path
+        if metrics:
+            _BATCH_METRICS[cache_key] = metrics
+            if cache:
+                cache.put(cache_key, metrics)
+            stored += 1
+    log_debug(f"  STATIC METRICS (batch): Stored metrics for {stored}/{len(pending)} file(s)")
+    return stored
+
+
+@traced("syntax")
 def check_python_syntax(code_content, file_path_hint=""):
     """
     Checks Python code content for syntax errors using the 'ast' module.
@@ -782,27 +1717,28 @@ def check_python_syntax(code_content, file_path_hint=""):
         bool: True if syntax is valid, False otherwise.
     """
     if not code_content:
-        print("  SYNTAX CHECK: Skipping check for empty content.")
+        log_debug("  SYNTAX CHECK: Skipping check for empty content.")
         return True # Treat empty content as valid syntax-wise
 
-    print(f"  SYNTAX CHECK: Running 'ast.parse' on proposed code (from {os.path.basename(file_path_hint)})")
+    log_debug(f"  SYNTAX CHECK: Running 'ast.parse' on proposed code (from {os.path.basename(file_path_hint)})")
     try:
         ast.parse(code_content)
-        print("  SYNTAX CHECK: Passed.")
+        log_debug("  SYNTAX CHECK: Passed.")
         return True
     except SyntaxError as e:
-        print(f"  ERROR: Syntax check failed. LLM output will be rejected.")
+        log_error(f"  ERROR: Syntax check failed. LLM output will be rejected.")
         # Provide specific error details from the exception
-        print(f"    Error: {e.msg}")
-        print(f"    Line:  {e.lineno}")
-        print(f"    Offset:{e.offset}")
+        log_error(f"    Error: {e.msg}")
+        log_error(f"    Line:  {e.lineno}")
+        log_error(f"    Offset:{e.offset}")
         # Show the problematic line if possible
-        if e.lineno and e.lineno <= len(code_content.splitlines()):
-             print(f"    Code:  {code_content.splitlines()[e.lineno-1].strip()}")
+        code_lines = split_source_lines(code_content)
+        if e.lineno and e.lineno <= len(code_lines):
+             log_error(f"    Code:  {code_lines[e.lineno-1].strip()}")
         return False
     except Exception as general_err:
         # Catch other potential errors during parsing (though less likely)
-        print(f"  ERROR: Unexpected error during syntax check with 'ast.parse': {general_err}")
+        log_error(f"  ERROR: Unexpected error during syntax check with 'ast.parse': {general_err}")
         return False
 
 
@@ -844,6 +1780,7 @@ def calculate_normalized_score(metric_name, value, config_details):
     score = max(0.0, min(100.0, score))
     return score, weight
 
+@traced("score")
 def calculate_total_score(metrics, language_key):
     """
     Calculates the total weighted sustainability score based on collected metrics.
@@ -851,7 +1788,7 @@ def calculate_total_score(metrics, language_key):
     Returns the score (0-100) and a dictionary of individual metric scores.
     """
     if not language_key or language_key not in SCORING_CONFIG:
-        print(f"  SCORE: No scoring configuration found for language key '{language_key}'. Cannot calculate score.")
+        log_debug(f"  SCORE: No scoring configuration found for language key '{language_key}'. Cannot calculate score.")
         return 0, {}
 
     lang_config = SCORING_CONFIG[language_key]
@@ -860,7 +1797,7 @@ def calculate_total_score(metrics, language_key):
     individual_scores = {}
     processed_metrics = metrics.copy() # Work on a copy to add derived metrics
 
-    print(f"  SCORE: Calculating score using config for '{language_key}'")
+    log_debug(f"  SCORE: Calculating score using config for '{language_key}'")
 
     # --- Calculate Derived Metrics (Complexity Density) ---
     avg_ccn = processed_metrics.get('cyclomatic_complexity_avg') # Need average CCN
@@ -872,9 +1809,9 @@ def calculate_total_score(metrics, language_key):
             density = avg_ccn / lloc
             # Store using the standard 'complexity_density' key for Python
             processed_metrics['complexity_density'] = round(density, 4)
-            print(f"    - Calculated Complexity Density (Python: CCN Avg / Radon LLOC): {processed_metrics['complexity_density']:.4f}")
+            log_debug(f"    - Calculated Complexity Density (Python: CCN Avg / Radon LLOC): {processed_metrics['complexity_density']:.4f}")
         elif lloc == 0:
-             print("    - INFO: Radon LLOC is 0, cannot calculate Python complexity density.")
+             log_debug("    - INFO: Radon LLOC is 0, cannot calculate Python complexity density.")
         # else: # avg_ccn or lloc is None
              # print("    - INFO: Missing avg CCN or Radon LLOC for Python density calculation.") # Optional debug
 
@@ -893,9 +1830,9 @@ def calculate_total_score(metrics, language_key):
                     density_cloc = avg_ccn / cloc_loc
                     # Store using the specific 'complexity_density_cloc' key
                     processed_metrics[density_metric_name_cloc] = round(density_cloc, 4)
-                    print(f"    - Calculated Complexity Density ({language_key}: CCN Avg / cloc LOC): {processed_metrics[density_metric_name_cloc]:.4f}")
+                    log_debug(f"    - Calculated Complexity Density ({language_key}: CCN Avg / cloc LOC): {processed_metrics[density_metric_name_cloc]:.4f}")
                 elif cloc_loc == 0:
-                     print(f"    - INFO: cloc LOC is 0, cannot calculate {language_key} complexity density.")
+                     log_debug(f"    - INFO: cloc LOC is 0, cannot calculate {language_key} complexity density.")
                 # else: # avg_ccn or cloc_loc is None
                      # print(f"    - INFO: Missing avg CCN or cloc LOC for {language_key} density calculation.") # Optional debug
 
@@ -929,13 +1866,13 @@ def calculate_total_score(metrics, language_key):
     else:
         # Handle case where no metrics were scored (e.g., all tools failed, or config was empty)
         final_score = 0
-        print("  SCORE: Warning - Total weight considered is 0. No metrics were scored.")
+        log_warning("  SCORE: Warning - Total weight considered is 0. No metrics were scored.")
 
 
     # Ensure final score is within bounds [0, 100] and round
     final_score = max(0.0, min(100.0, round(final_score, 1)))
 
-    print(f"  SCORE: Calculated Total Score = {final_score:.1f} (Total Weight Considered: {total_weight:.1f})")
+    log_info(f"  SCORE: Calculated Total Score = {final_score:.1f} (Total Weight Considered: {total_weight:.1f})")
     # Optional: Print individual scores for debugging
     # print("  Individual Scores:")
     # for name, data in individual_scores.items():
@@ -945,21 +1882,27 @@ def calculate_total_score(metrics, language_key):
 
 
 # --- CodeCarbon Measurement Function (Keep as before) ---
+@traced("emissions")
 def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_seconds=60):
     """ Measures Python emissions using CodeCarbon. Requires executable script."""
-    if not CODECARBON_AVAILABLE:
-        print("  MEASUREMENT: CodeCarbon library not found. Skipping emission measurement.")
+    if not codecarbon_available():
+        log_debug("  MEASUREMENT: CodeCarbon library not found. Skipping emission measurement.")
         return None
     if not code_content:
-        print("  MEASUREMENT: No code content provided. Skipping emission measurement.")
+        log_debug("  MEASUREMENT: No code content provided. Skipping emission measurement.")
         return None
     # Check for a main execution block - heuristic for executability
     if not re.search(r'if __name__\s*==\s*["\']__main__["\']\s*:', code_content):
-         print(f"  MEASUREMENT: No `if __name__ == '__main__':` block found in {os.path.basename(file_path_hint)}. "
+         log_debug(f"  MEASUREMENT: No `if __name__ == '__main__':` block found in {os.path.basename(file_path_hint)}. "
                "Assuming not directly executable. Skipping measurement.")
          return None
+    try:
+        from codecarbon import EmissionsTracker # Imported here only: measuring is the one path that needs it
+    except ImportError as e:
+        log_warning(f"  WARNING: CodeCarbon is installed but could not be imported ({e}). Skipping measurement.")
+        return None
 
-    print(f"\n===== CodeCarbon Measurement ({stage_name.upper()}) for {os.path.basename(file_path_hint)} =====")
+    log_info(f"\n===== CodeCarbon Measurement ({stage_name.upper()}) for {os.path.basename(file_path_hint)} =====")
     emissions_kg = None
     # Use a temporary directory for the script and potential CodeCarbon output within it
     temp_dir = tempfile.mkdtemp(prefix="codecarbon_exec_")
@@ -976,7 +1919,7 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
         output_dir = os.path.join(temp_dir, "codecarbon_report")
         os.makedirs(output_dir, exist_ok=True) # Ensure the output dir exists
 
-        print(f"  Starting CodeCarbon tracker (Project: {project_name}, Output Dir: {output_dir})")
+        log_debug(f"  Starting CodeCarbon tracker (Project: {project_name}, Output Dir: {output_dir})")
         # Lower log level to reduce console noise from CodeCarbon itself
         tracker = EmissionsTracker(
             project_name=project_name,
@@ -989,7 +1932,7 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
         process = None
         execution_success = False
         try:
-            print(f"  Executing: {sys.executable} {os.path.basename(temp_py_file_path)} (in {temp_dir})")
+            log_debug(f"  Executing: {sys.executable} {os.path.basename(temp_py_file_path)} (in {temp_dir})")
             process = subprocess.Popen(
                 [sys.executable, temp_py_file_path], # Execute the temp script
                 cwd=temp_dir, # Run from the temp directory
@@ -1001,19 +1944,19 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
             # Wait for process to finish, with timeout
             stdout, stderr = process.communicate(timeout=timeout_seconds)
 
-            print(f"  Execution finished with code: {process.returncode}")
+            log_debug(f"  Execution finished with code: {process.returncode}")
             if process.returncode == 0:
                 execution_success = True
             else:
-                print(f"  WARNING: Script execution failed ({stage_name}). Measurement might be inaccurate or incomplete.")
+                log_warning(f"  WARNING: Script execution failed ({stage_name}). Measurement might be inaccurate or incomplete.")
                 if stderr:
                     stderr_preview = stderr.strip()[:500]
-                    print(f"  Stderr (preview):\n{stderr_preview}{'...' if len(stderr.strip()) > 500 else ''}")
+                    log_debug(f"  Stderr (preview):\n{stderr_preview}{'...' if len(stderr.strip()) > 500 else ''}")
             # Optional stdout print for debugging
             # if stdout: print(f"  Stdout:\n{stdout.strip()}")
 
         except subprocess.TimeoutExpired:
-            print(f"  ERROR: Script execution timed out after {timeout_seconds} seconds ({stage_name}). Killing process.")
+            log_error(f"  ERROR: Script execution timed out after {timeout_seconds} seconds ({stage_name}). Killing process.")
             if process:
                 try: process.kill()
                 except OSError: pass # Ignore if already terminated
@@ -1022,7 +1965,7 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
                 except Exception: pass
             execution_success = False # Timed out, not successful
         except Exception as e:
-            print(f"  ERROR: Failed to execute script ({stage_name}): {e}")
+            log_error(f"  ERROR: Failed to execute script ({stage_name}): {e}")
             execution_success = False
         finally:
             # Stop the tracker regardless of execution success/failure
@@ -1031,22 +1974,22 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
                 emissions_data = tracker.stop()
                 if isinstance(emissions_data, float):
                     emissions_kg = emissions_data
-                    print(f"  CodeCarbon measurement complete ({stage_name}): {emissions_kg:.9f} kg CO₂eq")
+                    log_info(f"  CodeCarbon measurement complete ({stage_name}): {emissions_kg:.9f} kg CO₂eq")
                 elif execution_success: # Execution finished but tracker didn't return float
                     # This often happens if the script runs faster than CodeCarbon's measurement interval (default 15s)
-                    print(f"  WARNING: CodeCarbon tracker returned non-float ({emissions_data}) for emissions ({stage_name}). "
+                    log_warning(f"  WARNING: CodeCarbon tracker returned non-float ({emissions_data}) for emissions ({stage_name}). "
                           "Execution might have been too fast for measurement, or tracker encountered an issue.")
                     emissions_kg = 0.0 # Report as zero if execution was successful but too fast
                 else: # Execution failed AND tracker didn't return float
-                     print(f"  INFO: CodeCarbon tracker returned non-float ({emissions_data}) after failed execution ({stage_name}).")
+                     log_debug(f"  INFO: CodeCarbon tracker returned non-float ({emissions_data}) after failed execution ({stage_name}).")
                      emissions_kg = None # Report None if execution failed
 
             except Exception as e:
-                print(f"  ERROR: Failed to stop CodeCarbon tracker ({stage_name}): {e}")
+                log_error(f"  ERROR: Failed to stop CodeCarbon tracker ({stage_name}): {e}")
                 emissions_kg = None # Failed to stop, no valid data
 
     except Exception as e:
-        print(f"  ERROR: Unexpected error during emission measurement setup ({stage_name}): {e}")
+        log_error(f"  ERROR: Unexpected error during emission measurement setup ({stage_name}): {e}")
         emissions_kg = None
     finally:
         # Cleanup the temporary directory
@@ -1055,12 +1998,42 @@ def measure_python_emissions(code_content, file_path_hint, stage_name, timeout_s
                  shutil.rmtree(temp_dir)
                  # print(f"  Cleaned up temporary directory: {temp_dir}") # Less verbose
              except Exception as e:
-                 print(f"  WARNING: Failed to clean up temp dir {temp_dir}: {e}")
-    print(f"===== CodeCarbon Measurement ({stage_name.upper()}) END =====")
+                 log_warning(f"  WARNING: Failed to clean up temp dir {temp_dir}: {e}")
+    log_info(f"===== CodeCarbon Measurement ({stage_name.upper()}) END =====")
     return emissions_kg
 
 
+def llm_loc_limit(llm_output_format):
+    """Code LOC above which a file is not sent to the LLM in one request."""
+    return LLM_DIFF_LOC_LIMIT if llm_output_format == 'diff' else LLM_LOC_LIMIT
+
+def decide_llm_skip(staged_content, metrics_before, score_before, language_key, llm_output_format):
+    """
+    (skip reason, file chunks) for the LLM step of a file: the reason is None when the LLM runs, and
+    file_chunks holds (start_line, end_line) ranges when the file is over the LOC limit but can be
+    optimized in chunks.
+    """
+    loc_limit = llm_loc_limit(llm_output_format)
+    loc = metrics_before.get('loc_code_cloc')
+    if score_before >= PERFECT_SCORE_THRESHOLD:
+        return f"Initial score ({score_before:.1f}) meets/exceeds threshold ({PERFECT_SCORE_THRESHOLD:.1f})", None
+    # Check LOC limit using cloc data if available
+    if loc is not None and loc > loc_limit:
+        file_chunks = split_into_chunks(staged_content, language_key, LLM_CHUNK_MAX_TOKENS)
+        if file_chunks and len(file_chunks) <= LLM_MAX_CHUNKS:
+            return None, file_chunks
+        reason = f"Code LOC ({loc}) exceeds limit ({loc_limit})"
+        if file_chunks:
+            reason += f" and would need {len(file_chunks)} chunks (max {LLM_MAX_CHUNKS})"
+        return reason, None
+    if not language_key: # Also skip if language unknown (can't give good prompts)
+        return "Language could not be determined, cannot provide specific LLM guidance", None
+    if not staged_content.strip(): # Skip if file is empty or whitespace only
+        return "File content is empty", None
+    return None, None
+
 # --- Main Analysis Function (MODIFIED with Enhanced Prompts, No Semgrep) ---
+@traced("file")
 def analyze_and_update_code_for_sustainability(
     file_path,
     api_key_file="api_key.txt",
@@ -1069,45 +2042,63 @@ def analyze_and_update_code_for_sustainability(
     measure_emissions=False,
     execution_timeout=60,
     skip_llm_flag=False,
-    full_file_mode=False
+    full_file_mode=False,
+    diff_backend='auto',
+    use_metrics_cache=True,
+    python_metrics_engine='native',
+    llm_concurrency=LLM_MAX_CONCURRENT_REQUESTS,
+    use_llm_cache=True,
+    stream_llm=True,
+    llm_output_format='code',
+    pack_llm_blocks=True,
+    compact_prompts=True,
+    llm_routing=DEFAULT_ROUTING,
+    llm_hedge=None
     ):
     """
     Main analysis workflow: Enhanced metrics/scoring/density, Enhanced LLM prompts, Syntax Check.
+    llm_routing is the model routing table (see model_routing.py); None sends every request to GROQ_MODEL.
+    llm_hedge ({'model', 'url', 'api_key', 'delay'}) hedges slow requests to a second backend, see
+    request_llm_completion_hedged.
     """
-    print(f"\n===== SUSTAINABILITY ANALYSIS & UPDATE: {file_path} =====")
+    log_info(f"\n===== SUSTAINABILITY ANALYSIS & UPDATE: {file_path} =====")
+    annotate_span(file=file_path)
 
     # --- PREP ---
     language_name, language_key = detect_language(file_path, forced_language)
-    can_measure = measure_emissions and language_key == 'python' and CODECARBON_AVAILABLE
+    can_measure = measure_emissions and language_key == 'python' and codecarbon_available()
     if measure_emissions and language_key != 'python':
-        print("  INFO: Emission measurement requested, but only supported for Python scripts. Skipping.")
-    if measure_emissions and language_key == 'python' and not CODECARBON_AVAILABLE:
-        print("  WARNING: Emission measurement requested for Python, but CodeCarbon library not found. Skipping.")
+        log_debug("  INFO: Emission measurement requested, but only supported for Python scripts. Skipping.")
+    if measure_emissions and language_key == 'python' and not codecarbon_available():
+        log_warning("  WARNING: Emission measurement requested for Python, but CodeCarbon library not found. Skipping.")
 
     # --- STEP 1: Get Code Content ---
-    print("\nSTEP 1: Retrieving file content for analysis")
+    log_info("\nSTEP 1: Retrieving file content for analysis")
     staged_content, original_content, change_blocks = None, None, []
     is_modified_file = False # Flag to know if we're dealing with changes to an existing file
 
     if full_file_mode:
-         print("  Mode: Full File (reading directly from disk)")
+         log_info("  Mode: Full File (reading directly from disk)")
          try:
             # Use context manager for file reading
             with open(file_path, 'r', encoding='utf-8') as f:
                 staged_content = f.read()
-            print(f"  Successfully read file content ({len(staged_content)} bytes)")
+            log_debug(f"  Successfully read file content ({len(staged_content)} bytes)")
             # In full file mode, we don't compare to HEAD
             original_content, change_blocks, is_modified_file = None, [], False
          except Exception as e:
-             print(f"ERROR: Failed to read file {file_path}: {e}")
+             log_error(f"ERROR: Failed to read file {file_path}: {e}")
+             annotate_span(outcome="failed")
              return False # Cannot proceed without content
     else:
-        print("  Mode: Git Staged (comparing staged version to HEAD if possible)")
-        content_data = analyze_code_changes(file_path) # Uses Git commands
+        log_info("  Mode: Git Staged (comparing staged version to HEAD if possible)")
+        # Uses Git commands (or the batch prefetch's result for this file)
+        content_data = get_change_data(file_path, diff_backend, changes_only and language_key == 'python')
         if not content_data or content_data.get("modified") is None:
-            print("ERROR: Failed to retrieve file content using Git. Cannot analyze.")
+            log_error("ERROR: Failed to retrieve file content using Git. Cannot analyze.")
             # Attempt fallback to direct read? Or just fail? Let's fail for now.
             # If git fails, something is wrong with the setup or file state.
+            annotate_span(outcome="failed")
             return False
         staged_content = content_data["modified"] # The version we will analyze/optimize
         original_content = content_data.get("original") # HEAD version, if available
@@ -1115,30 +2106,22 @@ def analyze_and_update_code_for_sustainability(
         is_modified_file = content_data.get("is_modified", False) # Was it a change vs HEAD?
 
     if staged_content is None: # Should not happen if checks above are correct, but safeguard
-         print("FATAL ERROR: Staged content is None after retrieval step.")
+         log_error("FATAL ERROR: Staged content is None after retrieval step.")
+         annotate_span(outcome="failed")
          return False
 
     # --- STEP 1.5: Static Analysis & Scoring BEFORE ---
-    # Create a temporary file with the staged content for analysis tools
-    temp_before_file = None
+    # Metrics come from the content-addressed cache or from the tools run on a temp file
     metrics_before = {}
     score_before = 0
     individual_scores_before = {}
     try:
-        # Use context manager for temporary file creation
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=os.path.splitext(file_path)[1], encoding='utf-8') as temp_f:
-            temp_f.write(staged_content)
-            temp_before_file = temp_f.name
-        print(f"\nSTEP 1.5: Static Analysis & Scoring (BEFORE) on temp file: {temp_before_file}")
-        metrics_before = get_static_metrics(temp_before_file, language_key)
+        log_info(f"\nSTEP 1.5: Static Analysis & Scoring (BEFORE)")
+        metrics_before = get_metrics_for_content(staged_content, file_path, language_key, "before",
+                                                 use_metrics_cache, python_metrics_engine)
         score_before, individual_scores_before = calculate_total_score(metrics_before, language_key)
     except Exception as e:
-        print(f"ERROR: Failed during BEFORE static analysis: {e}")
-    finally:
-        # Ensure cleanup of the temporary file
-        if temp_before_file and os.path.exists(temp_before_file):
-            try: os.remove(temp_before_file)
-            except OSError: print(f"Warning: Failed to remove temp file {temp_before_file}")
+        log_error(f"ERROR: Failed during BEFORE static analysis: {e}")
 
 
     # --- STEP 1.6: Measure Emissions BEFORE ---
@@ -1149,23 +2132,16 @@ def analyze_and_update_code_for_sustainability(
     # --- STEP 2 & 3: Determine LLM Skip & Optimize ---
     optimized_full_code = None # This will hold the final code (optimized or original)
     llm_skip_reason = None
-    should_skip_llm = skip_llm_flag # Start with the command-line flag
+    file_chunks = None # (start_line, end_line) ranges when the file is too large for one request
 
     # Check other skip conditions only if the flag didn't already force skip
-    if not should_skip_llm:
-        if score_before >= PERFECT_SCORE_THRESHOLD:
-            should_skip_llm = True
-            llm_skip_reason = f"Initial score ({score_before:.1f}) meets/exceeds threshold ({PERFECT_SCORE_THRESHOLD:.1f})"
-        # Check LOC limit using cloc data if available
-        elif 'loc_code_cloc' in metrics_before and metrics_before['loc_code_cloc'] is not None and metrics_before['loc_code_cloc'] > LLM_LOC_LIMIT:
-            should_skip_llm = True
-            llm_skip_reason = f"Code LOC ({metrics_before['loc_code_cloc']}) exceeds limit ({LLM_LOC_LIMIT})"
-        elif not language_key: # Also skip if language unknown (can't give good prompts)
-            should_skip_llm = True
-            llm_skip_reason = "Language could not be determined, cannot provide specific LLM guidance"
-        elif not staged_content.strip(): # Skip if file is empty or whitespace only
-             should_skip_llm = True
-             llm_skip_reason = "File content is empty"
+    if not skip_llm_flag:
+        llm_skip_reason, file_chunks = decide_llm_skip(staged_content, metrics_before, score_before,
+                                                       language_key, llm_output_format)
+        if file_chunks:
+            log_debug(f"  INFO: Code LOC ({metrics_before['loc_code_cloc']}) exceeds limit "
+                  f"({llm_loc_limit(llm_output_format)}), optimizing in {len(file_chunks)} chunk(s) instead.")
+    should_skip_llm = skip_llm_flag or llm_skip_reason is not None
 
 
     if skip_llm_flag and not llm_skip_reason:
@@ -1173,19 +2149,50 @@ def analyze_and_update_code_for_sustainability(
 
     # --- LLM Optimization or Skip ---
     if should_skip_llm:
-        print(f"\nSTEP 2 & 3: Skipping LLM Optimization ({llm_skip_reason})")
+        log_info(f"\nSTEP 2 & 3: Skipping LLM Optimization ({llm_skip_reason})")
         # If skipping LLM, the "optimized" code is just the original staged content
         optimized_full_code = staged_content
     else:
         # --- Proceed with LLM Optimization ---
-        print("\nSTEP 2: Preparing API access for LLM")
+        log_info("\nSTEP 2: Preparing API access for LLM")
         api_key = get_api_key(api_key_file)
         if not api_key:
-             print("ERROR: No API key found or loaded. Skipping LLM optimization.")
+             log_error("ERROR: No API key found or loaded. Skipping LLM optimization.")
              optimized_full_code = staged_content # Fallback to original
         else:
-            print("\nSTEP 3: Optimizing code with Groq API")
-            system_prompt = get_language_specific_system_prompt(language_name) # Includes anti-pattern guidance
+            log_info("\nSTEP 3: Optimizing code with Groq API")
+            import requests # Deferred import (slow to load): only runs that reach the LLM need its exceptions
+            # Python comments/docstrings travel as placeholders and are restored from the reply
+            compact_comments = compact_prompts and language_key == 'python'
+            system_prompt = get_llm_system_prompt(language_name, compact_comments) # Includes anti-pattern guidance
+
+            def compact_for_prompt(code, placeholders, issued=None):
+                """Code as sent to the LLM: comments/docstrings swapped for placeholders when compacting."""
+                return compact_code_for_prompt(code, placeholders, issued) if compact_comments else code
+
+            def pick_model(prompt, code, max_tokens, label):
+                """Routes one request by code size, the file's scores and language (GROQ_MODEL without routing)."""
+                if not llm_routing:
+                    return GROQ_MODEL
+                model, reason = route_llm_model(estimate_tokens(system_prompt + prompt), estimate_tokens(code), max_tokens,
+                                                score_before, individual_scores_before, language_key, llm_routing)
+                log_info(f"    Model for {label}: {model} ({reason})")
+                return model
+
+            # Cache entries of this file's LLM replies, written only once the output passes the syntax check
+            pending_llm_replies = []
+            batch_pack_replies = [] # Cross-file packed replies this file took blocks from (see prefetch_batch_block_packs)
+            llm_replies_used = False # True once temp_llm_output is built from the replies (not a fallback)
+
+            def complete(prompt, max_tokens, timeout, model, accept=None, replies=pending_llm_replies, **stream_options):
+                """One LLM request for this file; hedged to llm_hedge's backend when configured (accept validates replies)."""
+                if llm_hedge:
+                    return request_llm_completion_hedged(api_key, system_prompt, prompt, max_tokens, timeout, llm_hedge,
+                                                         accept=accept, use_cache=use_llm_cache, model=model,
+                                                         max_latency=stream_options.get('max_latency'),
+                                                         on_delta=stream_options.get('on_delta'), pending_cache=replies)
+                return request_llm_completion(api_key, system_prompt, prompt, max_tokens, timeout,
+                                              use_cache=use_llm_cache, model=model, pending_cache=replies, **stream_options)
             # Use language key for code block hint if available, else simplified name
             code_block_lang_hint = language_key or language_name.lower().split()[0]
 
@@ -1200,21 +2207,14 @@ def analyze_and_update_code_for_sustainability(
             # The anti-pattern guidance is now part of the get_language_specific_system_prompt
 
             if analyze_llvm_changes:
-                print(f"  LLM Mode: Analyzing only {len(change_blocks)} changed block(s)")
-                optimized_blocks = [] # Store optimized version of each block
+                log_info(f"  LLM Mode: Analyzing only {len(change_blocks)} changed block(s)")
                 all_blocks_processed_successfully = True
 
-                # --- Loop through change blocks ---
-                for i, block in enumerate(change_blocks):
-                    code_to_optimize = '\n'.join(block['modified_lines'])
-                    # Skip empty blocks (e.g., only deletions)
-                    if not code_to_optimize.strip():
-                       # If the block was purely a deletion, the "optimized" version is empty
-                       # If it was whitespace, keep it empty
-                       optimized_blocks.append("")
-                       print(f"    Skipping empty block {i+1}")
-                       continue
-
+                # --- Send change blocks concurrently (bounded), reassemble in block order ---
+                def optimize_block(i, code_to_optimize):
+                    """Runs the LLM request for one change block and returns the cleaned segment."""
+                    placeholders = {}
+                    code_to_optimize = compact_for_prompt(code_to_optimize, placeholders)
                     # --- Enhanced Block-Level User Prompt ---
                     # Focuses on the segment and asks for anti-pattern fixing within it
                     block_prompt = f"""You are optimizing ONLY the following code segment from a larger {language_name} file for sustainability and efficiency.
@@ -1223,139 +2223,303 @@ Specifically look for and refactor common performance anti-patterns *within this
 
 Constraints for optimizing THIS SEGMENT:
 - Return ONLY the optimized code segment.
-- Do NOT add any explanations, comments about changes, or markdown formatting (like ```).
-- Ensure all original comments within the segment are retained. # <--- Added
-- Do NOT introduce new library imports/requires.
-- Do NOT define new functions or classes outside the original scope of the segment.
-- Preserve the core functionality and intended purpose of the segment.
-- Preserve the exact observable output and side effects (e.g., print statements) of the segment. # <--- Added
-- Minor efficiency improvements unrelated to the core sustainability anti-patterns are acceptable ONLY IF they strictly adhere to all other constraints (especially preserving output, comments, and functionality). The primary focus remains sustainability optimization. # <--- Added nuance
-- Try to maintain the relative indentation of the code within the segment.
-- Ensure the returned segment is syntactically valid IN THE CONTEXT where it will be placed back into the original file.
+{BLOCK_SEGMENT_CONSTRAINTS}
 
 Code Segment to Optimize:
 ```""" + code_block_lang_hint + f"""
 {code_to_optimize}
 ```"""
-                    try:
-                        print(f"    Sending block {i+1} ({len(code_to_optimize)} chars) to Groq API...")
-                        response = requests.post(
-                            "https://api.groq.com/openai/v1/chat/completions",
-                            headers={
-                                "Authorization": f"Bearer {api_key}",
-                                "Content-Type": "application/json",
-                            },
-                            json={
-                                "model": "llama3-8b-8192", # Or other suitable model
-                                "messages": [
-                                    {"role": "system", "content": system_prompt},
-                                    {"role": "user", "content": block_prompt},
-                                ],
-                                "temperature": 0.1, # Low temperature for more deterministic output
-                                "max_tokens": 2048, # Adjust as needed for block size
-                            },
-                             timeout=60 # Timeout for API call
-                        )
-                        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-                        response_data = response.json()
-                        if not response_data.get("choices") or not response_data["choices"][0].get("message"):
-                             raise ValueError("LLM response format unexpected (missing choices/message)")
-
-                        optimized_code_segment = response_data["choices"][0]["message"]["content"]
-                        # Clean up potential markdown code blocks returned by the LLM
-                        optimized_code_segment = re.sub(r'^```[\w]*\n?|\n?```$', '', optimized_code_segment, flags=re.MULTILINE).strip()
-
-                        optimized_blocks.append(optimized_code_segment)
-                        print(f"    Block {i+1} optimization received ({len(optimized_code_segment)} chars)")
-
-                    except requests.exceptions.Timeout:
-                        print(f"    ERROR: API request timed out for block {i+1}. Aborting LLM optimization.")
-                        all_blocks_processed_successfully = False; break
-                    except requests.exceptions.RequestException as e:
-                        print(f"    ERROR: API request failed for block {i+1}: {e}. Aborting LLM optimization.")
-                        all_blocks_processed_successfully = False; break
-                    except (ValueError, KeyError) as e:
-                         print(f"    ERROR: Failed to parse LLM response for block {i+1}: {e}. Aborting LLM optimization.")
-                         all_blocks_processed_successfully = False; break
-                    except Exception as e:
-                        print(f"    ERROR: Unexpected error processing block {i+1}: {e}. Aborting LLM optimization.")
-                        all_blocks_processed_successfully = False; break
-                # --- End block loop ---
+                    log_debug(f"    Sending block {i+1} ({len(code_to_optimize)} chars) to Groq API...")
+                    optimized_code_segment = complete(
+                        block_prompt,
+                        max_tokens=2048, # Adjust as needed for block size
+                        timeout=60, # Timeout for API call
+                        model=pick_model(block_prompt, code_to_optimize, 2048, f"block {i+1}"),
+                        accept=lambda text: bool(text.strip())
+                    )
+                    # Clean up potential markdown code blocks returned by the LLM
+                    optimized_code_segment = re.sub(r'^```[\w]*\n?|\n?```$', '', optimized_code_segment, flags=re.MULTILINE).strip()
+                    optimized_code_segment = restore_python_source(optimized_code_segment, placeholders)
+                    log_debug(f"    Block {i+1} optimization received ({len(optimized_code_segment)} chars)")
+                    return optimized_code_segment
+
+                def optimize_block_pack(block_indices):
+                    """Sends several small blocks as delimited segments of one request; returns {block index: code}."""
+                    placeholders = {} # Shared by all segments of the pack
+                    segment_ids = {i: set() for i in block_indices} # Placeholders each segment must give back
+                    segments_text = "\n\n".join(PACKED_SEGMENT_TEMPLATE.format(id=i + 1, code=compact_for_prompt(pending_blocks[i], placeholders, segment_ids[i]))
+                                                for i in block_indices)
+                    pack_prompt = build_block_pack_prompt(language_name, code_block_lang_hint, segments_text, len(block_indices))
+                    block_numbers = ", ".join(str(i + 1) for i in block_indices)
+                    log_debug(f"    Sending blocks {block_numbers} as one packed request ({len(segments_text)} chars) to Groq API...")
+                    response_text = complete(
+                        pack_prompt,
+                        max_tokens=LLM_PACK_RESPONSE_MAX_TOKENS,
+                        timeout=60, # Timeout for API call
+                        model=pick_model(pack_prompt, segments_text, LLM_PACK_RESPONSE_MAX_TOKENS, f"packed blocks {block_numbers}"),
+                        accept=lambda text: all((i + 1) in parse_packed_segments(text) for i in block_indices)
+                    )
+                    segments = parse_packed_segments(response_text)
+                    optimized = {i: restore_python_source(segments[i + 1], placeholders, segment_ids[i])
+                                 for i in block_indices if (i + 1) in segments}
+                    log_debug(f"    Packed request for blocks {block_numbers} returned {len(optimized)}/{len(block_indices)} segment(s)")
+                    return optimized
+
+                optimized_blocks = [None] * len(change_blocks) # Optimized version of each block, in block order
+                pending_blocks = {} # block index -> code to send
+                for i, block in enumerate(change_blocks):
+                    code_to_optimize = '\n'.join(block['modified_lines'])
+                    # Skip empty blocks (e.g., only deletions)
+                    if not code_to_optimize.strip():
+                       # If the block was purely a deletion, the "optimized" version is empty
+                       # If it was whitespace, keep it empty
+                       optimized_blocks[i] = ""
+                       log_debug(f"    Skipping empty block {i+1}")
+                       continue
+                    pending_blocks[i] = code_to_optimize
+
+                batch_answered = take_batch_block_replies(file_path, pending_blocks)
+                for i, (optimized_code_segment, pack_reply) in batch_answered.items():
+                    optimized_blocks[i] = optimized_code_segment
+                    del pending_blocks[i]
+                    if pack_reply not in batch_pack_replies:
+                        batch_pack_replies.append(pack_reply)
+                if batch_answered:
+                    log_debug(f"  {len(batch_answered)} block(s) answered by cross-file packed request(s), "
+                              f"{len(pending_blocks)} left to send")
+
+                if pending_blocks:
+                    if pack_llm_blocks:
+                        block_packs, single_blocks = group_blocks_into_packs(pending_blocks)
+                    else:
+                        block_packs, single_blocks = [], sorted(pending_blocks)
+                    request_count = len(block_packs) + len(single_blocks)
+                    worker_count = max(1, min(llm_concurrency, request_count))
+                    if block_packs:
+                        log_debug(f"  Packed {sum(len(pack) for pack in block_packs)} small block(s) into "
+                              f"{len(block_packs)} multi-segment request(s)")
+                    log_debug(f"  Dispatching {request_count} block request(s), up to {worker_count} at a time")
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+                        # future -> (is_pack, block indices); segments missing from a pack are re-sent alone
+                        block_futures = {executor.submit(optimize_block_pack, pack): (True, pack) for pack in block_packs}
+                        block_futures.update({executor.submit(optimize_block, i, pending_blocks[i]): (False, [i])
+                                              for i in single_blocks})
+                        while block_futures and all_blocks_processed_successfully:
+                            done, _ = concurrent.futures.wait(block_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in done:
+                                is_pack, block_indices = block_futures.pop(future)
+                                label = (f"packed blocks {', '.join(str(i + 1) for i in block_indices)}" if is_pack
+                                         else f"block {block_indices[0]+1}")
+                                try:
+                                    result = future.result()
+                                except requests.exceptions.Timeout:
+                                    log_error(f"    ERROR: API request timed out for {label}. Aborting LLM optimization.")
+                                except requests.exceptions.RequestException as e:
+                                    log_error(f"    ERROR: API request failed for {label}: {e}. Aborting LLM optimization.")
+                                except (ValueError, KeyError) as e:
+                                     log_error(f"    ERROR: Failed to parse LLM response for {label}: {e}. Aborting LLM optimization.")
+                                except Exception as e:
+                                    log_error(f"    ERROR: Unexpected error processing {label}: {e}. Aborting LLM optimization.")
+                                else:
+                                    if not is_pack:
+                                        optimized_blocks[block_indices[0]] = result
+                                        continue
+                                    for i, optimized_code_segment in result.items():
+                                        optimized_blocks[i] = optimized_code_segment
+                                    missing_blocks = [i for i in block_indices if i not in result]
+                                    if missing_blocks:
+                                        log_debug(f"    {len(missing_blocks)} segment(s) missing from the packed response, "
+                                              f"sending block(s) {', '.join(str(i + 1) for i in missing_blocks)} individually")
+                                        block_futures.update({executor.submit(optimize_block, i, pending_blocks[i]): (False, [i])
+                                                              for i in missing_blocks})
+                                    continue
+                                # One failed request fails the whole file: don't start the requests still queued
+                                all_blocks_processed_successfully = False
+                                for other_future in block_futures:
+                                    other_future.cancel()
+                                break
+                # --- End block dispatch ---
 
                 # If any block failed, fallback to original content
                 if not all_blocks_processed_successfully:
                     temp_llm_output = staged_content # Fallback
-                    print("  INFO: Reverting to original staged content due to error during block processing.")
+                    log_debug("  INFO: Reverting to original staged content due to error during block processing.")
                 else:
                     # Reconstruct the file from original + optimized blocks
-                    print("\nSTEP 3.5: Reconstructing file from optimized blocks")
+                    log_info("\nSTEP 3.5: Reconstructing file from optimized blocks")
                     temp_llm_output = apply_selective_changes(staged_content, change_blocks, optimized_blocks)
                     if temp_llm_output is None:
-                        print("  ERROR: Failed to reconstruct file from optimized blocks. Reverting to original.")
+                        log_error("  ERROR: Failed to reconstruct file from optimized blocks. Reverting to original.")
                         temp_llm_output = staged_content # Fallback on reconstruction error
+                    else:
+                        llm_replies_used = True
+
+            elif file_chunks: # File too large for one request: optimize top-level chunks independently
+                log_info(f"  LLM Mode: Analyzing {len(file_chunks)} top-level chunk(s) (file exceeds the LOC limit)")
+                staged_lines = split_source_lines(staged_content, keepends=True) # As split_into_chunks counts them
+                chunk_texts = [''.join(staged_lines[start:end]) for start, end in file_chunks]
+                chunk_replies = {} # chunk index -> its pending cache entries, kept only if the chunk is accepted
+
+                def optimize_chunk(i, chunk_code):
+                    """Runs the LLM request for one chunk and returns the cleaned chunk."""
+                    start, end = file_chunks[i]
+                    placeholders = {}
+                    chunk_code = compact_for_prompt(chunk_code, placeholders)
+                    chunk_prompt = f"""You are optimizing ONLY the following part (lines {start + 1}-{end}) of a larger {language_name} file for sustainability and efficiency.
+It consists of complete top-level definitions and statements; the rest of the file is not shown and stays unchanged.
+Focus on CPU, memory, I/O reduction, and algorithm optimization within this part.
+Specifically look for and refactor common performance anti-patterns *within this part* (like inefficient loops, unnecessary calculations, poor data structure use, resource handling relevant to {language_name}).
+
+Constraints for optimizing THIS PART:
+- Return ONLY the optimized code of this part, keeping every definition it contains with the same names and signatures.
+- Do NOT add any explanations, comments about changes, or markdown formatting (like ```).
+- Ensure all original comments within this part are retained.
+- Do NOT introduce new library imports/requires.
+- Preserve the exact observable output and side effects (e.g., print statements) of this part.
+- Minor efficiency improvements unrelated to the core sustainability anti-patterns are acceptable ONLY IF they strictly adhere to all other constraints (especially preserving output, comments, and functionality). The primary focus remains sustainability optimization.
+- The returned code must be syntactically valid on its own.
+
+Code to Optimize:
+```""" + code_block_lang_hint + f"""
+{chunk_code}
+```"""
+                    log_debug(f"    Sending chunk {i+1} (lines {start + 1}-{end}, {len(chunk_code)} chars) to Groq API...")
+                    def strip_fences(text):
+                        # Clean up potential markdown code blocks returned by the LLM
+                        return re.sub(r'^```[\w]*\n?|\n?```$', '', text, flags=re.MULTILINE).strip()
+                    optimized_chunk = complete(
+                        chunk_prompt,
+                        max_tokens=LLM_CHUNK_RESPONSE_MAX_TOKENS,
+                        timeout=LLM_FULL_FILE_MAX_LATENCY,
+                        model=pick_model(chunk_prompt, chunk_code, LLM_CHUNK_RESPONSE_MAX_TOKENS, f"chunk {i+1}"),
+                        accept=lambda text: bool(strip_fences(text)) and chunk_syntax_ok(strip_fences(text), language_key),
+                        replies=chunk_replies.setdefault(i, [])
+                    )
+                    optimized_chunk = strip_fences(optimized_chunk)
+                    return restore_python_source(optimized_chunk, placeholders)
+
+                # Every chunk starts as its staged code; a failed or invalid chunk simply keeps it
+                optimized_chunks = list(chunk_texts)
+                pending_chunks = {}
+                for i, chunk_code in enumerate(chunk_texts):
+                    if not chunk_code.strip():
+                        continue
+                    if not chunk_syntax_ok(chunk_code, language_key):
+                        log_debug(f"    Skipping chunk {i+1}: it does not parse on its own")
+                        continue
+                    pending_chunks[i] = chunk_code
+
+                accepted_chunks = 0
+                if pending_chunks:
+                    worker_count = max(1, min(llm_concurrency, len(pending_chunks)))
+                    log_debug(f"  Dispatching {len(pending_chunks)} chunk request(s), up to {worker_count} at a time")
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+                        chunk_futures = {executor.submit(optimize_chunk, i, code): i for i, code in pending_chunks.items()}
+                        for future in concurrent.futures.as_completed(chunk_futures):
+                            i = chunk_futures[future]
+                            try:
+                                optimized_chunk = future.result()
+                            except requests.exceptions.Timeout:
+                                log_error(f"    ERROR: API request timed out for chunk {i+1}. Keeping its staged code.")
+                                continue
+                            except requests.exceptions.RequestException as e:
+                                log_error(f"    ERROR: API request failed for chunk {i+1}: {e}. Keeping its staged code.")
+                                continue
+                            except (ValueError, KeyError) as e:
+                                log_error(f"    ERROR: Failed to parse LLM response for chunk {i+1}: {e}. Keeping its staged code.")
+                                continue
+                            except Exception as e:
+                                log_error(f"    ERROR: Unexpected error processing chunk {i+1}: {e}. Keeping its staged code.")
+                                continue
+                            if not optimized_chunk:
+                                log_warning(f"    WARNING: LLM returned empty content for chunk {i+1}. Keeping its staged code.")
+                            elif not chunk_syntax_ok(optimized_chunk, language_key):
+                                log_warning(f"    WARNING: Optimized chunk {i+1} failed its syntax check. Keeping its staged code.")
+                            else:
+                                optimized_chunks[i] = restore_chunk_padding(chunk_texts[i], optimized_chunk)
+                                pending_llm_replies.extend(chunk_replies.get(i, ()))
+                                accepted_chunks += 1
+                                log_debug(f"    Chunk {i+1} optimization received ({len(optimized_chunk)} chars)")
+
+                log_info("\nSTEP 3.5: Stitching optimized chunks back together")
+                log_debug(f"  {accepted_chunks}/{len(chunk_texts)} chunk(s) optimized, the others keep their staged code")
+                temp_llm_output = ''.join(optimized_chunks)
+                llm_replies_used = True
 
             else: # Full file LLM analysis
                  llm_mode_reason = "Full file mode requested (--full-file-mode)" if full_file_mode else \
                                    "Changes span too much or --changes-only not used" if is_modified_file else \
                                    "Analyzing a new file"
-                 print(f"  LLM Mode: Analyzing full file ({llm_mode_reason})")
+                 log_info(f"  LLM Mode: Analyzing full file ({llm_mode_reason})")
 
                  # --- Enhanced Full File User Prompt ---
                  # Contextualizes the request for the entire file, including anti-patterns
                  prompt_content_header = f"Optimize the following {language_name} code for sustainability and efficiency."
-                 code_section_to_optimize = staged_content
-
-                 # Provide original code as context if analyzing changes to an existing file
+                 placeholders = {} # Shared by the MODIFIED and ORIGINAL sections so either can be restored
+                 staged_ids = set() # ...but only the MODIFIED section's placeholders must come back
+                 staged_for_prompt = compact_for_prompt(staged_content, placeholders, staged_ids)
+                 if compact_comments and placeholders:
+                     log_debug(f"  Prompt compaction: {len(placeholders)} comment(s)/docstring(s) replaced by placeholders "
+                           f"({len(staged_content)} -> {len(staged_for_prompt)} chars)")
+                 code_section_to_optimize = staged_for_prompt
+
+                 # Provide what changed since HEAD as context if analyzing changes to an existing file:
+                 # a compact diff, or the whole ORIGINAL when the diff would not be any shorter
                  if original_content is not None and not full_file_mode:
-                     prompt_content_header = (f"The following {language_name} code was modified. "
-                                              f"Optimize the MODIFIED version for sustainability and efficiency, "
-                                              f"considering the ORIGINAL for context.")
-                     code_section_to_optimize = (f"--- ORIGINAL CODE ---\n"
-                                                 f"```{code_block_lang_hint}\n{original_content}\n```\n\n"
-                                                 f"--- MODIFIED CODE (Optimize This) ---\n"
-                                                 f"```{code_block_lang_hint}\n{staged_content}\n```")
+                     change_context = build_change_context(original_content, staged_content, diff_backend,
+                                                           file_path, LLM_CONTEXT_DIFF_LINES)
+                     if len(change_context) < len(original_content):
+                         log_debug(f"  Context: {len(change_context)} char diff against HEAD instead of the "
+                               f"{len(original_content)} char ORIGINAL file")
+                         prompt_content_header = (f"The following {language_name} code was modified. "
+                                                  f"Optimize the MODIFIED version for sustainability and efficiency, "
+                                                  f"considering the changes since the ORIGINAL version (given as a unified diff) for context.")
+                         code_section_to_optimize = (f"--- CHANGES SINCE ORIGINAL (unified diff, context only) ---\n"
+                                                     f"```diff\n{change_context or '(no changes)'}\n```\n\n"
+                                                     f"--- MODIFIED CODE (Optimize This) ---\n"
+                                                     f"```{code_block_lang_hint}\n{staged_for_prompt}\n```")
+                     else:
+                         prompt_content_header = (f"The following {language_name} code was modified. "
+                                                  f"Optimize the MODIFIED version for sustainability and efficiency, "
+                                                  f"considering the ORIGINAL for context.")
+                         code_section_to_optimize = (f"--- ORIGINAL CODE ---\n"
+                                                     f"```{code_block_lang_hint}\n{compact_for_prompt(original_content, placeholders)}\n```\n\n"
+                                                     f"--- MODIFIED CODE (Optimize This) ---\n"
+                                                     f"```{code_block_lang_hint}\n{staged_for_prompt}\n```")
+
+                 optimized_target = 'MODIFIED code section' if original_content is not None and not full_file_mode else 'entire code'
+                 if llm_output_format == 'diff':
+                     # Hunks only: output tokens (and latency) scale with the size of the change, not of the file
+                     output_instructions = (
+                         f"Return ONLY a unified diff (as produced by 'diff -u') that turns the {optimized_target} into its optimized version.\n"
+                         "Each hunk starts with a '@@ -start,count +start,count @@' header, followed by 3 unchanged context lines "
+                         "prefixed with a space, removed lines prefixed with '-' and added lines prefixed with '+'. "
+                         "Copy context and removed lines exactly as they appear in the code.\n"
+                         "Do NOT include any explanations, file headers or markdown formatting. If nothing should change, return an empty response.")
+                 else:
+                     output_instructions = (
+                         f"Return ONLY the fully optimized version of the {optimized_target}.\n"
+                         "Do NOT include any explanations, comments about the changes you made, or markdown formatting "
+                         "(like ```language ... ``` wrappers). Just output the raw, optimized code.")
+                 max_tokens = LLM_DIFF_MAX_TOKENS if llm_output_format == 'diff' else LLM_FULL_FILE_MAX_TOKENS
 
                  full_prompt = f"""{prompt_content_header}
 
 Focus on reducing CPU usage, minimizing memory consumption, optimizing algorithms and data structures, and reducing I/O operations.
 Specifically look for and refactor common performance anti-patterns appropriate for {language_name} throughout the code (e.g., inefficient loops/algorithms, unnecessary object creation, poor data structure choices, resource leaks if applicable).
 
-Return ONLY the fully optimized version of the {'MODIFIED code section' if original_content is not None and not full_file_mode else 'entire code'}.
-Do NOT include any explanations, comments about the changes you made, or markdown formatting (like ```language ... ``` wrappers). Just output the raw, optimized code.
+{output_instructions}
 Ensure all original comments are retained. # <--- Added
 Ensure the exact observable output and side effects (e.g., print statements) are preserved. # <--- Added
 Minor efficiency improvements unrelated to the core sustainability anti-patterns are acceptable ONLY IF they strictly adhere to all other constraints (especially preserving output, comments, and functionality). The primary focus remains sustainability optimization. # <--- Added nuance
 
 {code_section_to_optimize}"""
 
-                 try:
-                    print(f"  Sending full file prompt ({len(full_prompt)} chars) to Groq API...")
-                    response = requests.post(
-                        "https://api.groq.com/openai/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {api_key}",
-                            "Content-Type": "application/json",
-                        },
-                        json={
-                            "model": "llama3-8b-8192", # Adjust model if needed
-                            "messages": [
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": full_prompt},
-                            ],
-                            "temperature": 0.1,
-                            "max_tokens": 4096, # Larger allowance for full files
-                        },
-                         timeout=180 # Longer timeout for potentially larger files
-                    )
-                    response.raise_for_status()
-
-                    response_data = response.json()
-                    if not response_data.get("choices") or not response_data["choices"][0].get("message"):
-                        raise ValueError("LLM response format unexpected (missing choices/message)")
-
-                    llm_output_raw = response_data["choices"][0]["message"]["content"]
-
+                 def finish_full_file_output(llm_output_raw):
+                    """File content from a raw full-file reply (patched/cleaned, comments restored), or None if it is empty."""
+                    if llm_output_format == 'diff':
+                        # The model returned hunks against the code it was shown; the syntax check below still applies
+                        return restore_python_source(apply_unified_diff(staged_for_prompt, llm_output_raw), placeholders, staged_ids)
                     # --- BUG FIX START ---
                     # Initialize cleaned_output from the raw LLM output FIRST
                     cleaned_output = llm_output_raw
@@ -1364,12 +2528,7 @@ Minor efficiency improvements unrelated to the core sustainability anti-patterns
                     cleaned_output = re.sub(r'^```[\w]*\n?|\n?```$', '', cleaned_output, flags=re.MULTILINE).strip()
 
                     # 2. Remove common preamble lines (case-insensitive)
-                    preamble_patterns = [
-                        r"^\s*here[' i]*s the (optimized|updated|modified)?\s*code:?\s*$",
-                        r"^\s*okay, here[' i]*s the code:?\s*$",
-                        r"^\s*sure, here[' i]*s the code:?\s*$",
-                        # Add more common patterns if observed
-                    ]
+                    preamble_patterns = LLM_PREAMBLE_PATTERNS
                     lines = cleaned_output.splitlines() # Use the result from step 1
                     found_code = False
                     start_index = 0
@@ -1393,39 +2552,89 @@ Minor efficiency improvements unrelated to the core sustainability anti-patterns
                     cleaned_output = cleaned_output.strip()
                     # --- BUG FIX END ---
 
-                    # Assign to temp_llm_output only if cleaning resulted in non-empty string
-                    if cleaned_output:
-                        temp_llm_output = cleaned_output
-                        # Try to preserve trailing newline consistency
-                        if staged_content.endswith('\n') and not temp_llm_output.endswith('\n'):
-                            temp_llm_output += '\n'
-                        print(f"  Full file optimization received ({len(temp_llm_output)} chars)")
+                    if not cleaned_output:
+                        return None
+                    finished_output = restore_python_source(cleaned_output, placeholders, staged_ids)
+                    # Try to preserve trailing newline consistency
+                    if staged_content.endswith('\n') and not finished_output.endswith('\n'):
+                        finished_output += '\n'
+                    return finished_output
+
+                 def full_file_output_ok(llm_output_raw):
+                    """Hedged requests: a reply only wins if it survives cleanup and the syntax check below."""
+                    try:
+                        finished_output = finish_full_file_output(llm_output_raw)
+                    except ValueError: # PatchApplyError, PlaceholderMismatch
+                        return False
+                    return bool(finished_output) and (language_key != 'python' or check_python_syntax(finished_output, file_path))
+
+                 try:
+                    log_debug(f"  Sending full file prompt ({len(full_prompt)} chars) to Groq API...")
+                    full_file_model = pick_model(full_prompt, staged_for_prompt, max_tokens, "full file")
+                    if stream_llm:
+                        # Stream tokens so a hopeless response is dropped early instead of after the full wait
+                        llm_output_raw = complete(
+                            full_prompt,
+                            max_tokens=max_tokens, # Larger allowance for full files
+                            timeout=LLM_STREAM_READ_TIMEOUT,
+                            model=full_file_model,
+                            accept=full_file_output_ok,
+                            stream=True,
+                            max_latency=LLM_FULL_FILE_MAX_LATENCY,
+                            on_delta=make_stream_divergence_check(staged_for_prompt)
+                        )
+                    else:
+                        llm_output_raw = complete(
+                            full_prompt,
+                            max_tokens=max_tokens, # Larger allowance for full files
+                            timeout=LLM_FULL_FILE_MAX_LATENCY, # Longer timeout for potentially larger files
+                            model=full_file_model,
+                            accept=full_file_output_ok
+                        )
+
+                    temp_llm_output = finish_full_file_output(llm_output_raw)
+                    llm_replies_used = temp_llm_output is not None
+                    if llm_output_format == 'diff':
+                        hunk_count = len(parse_unified_diff(llm_output_raw))
+                        log_debug(f"  Applied {hunk_count} LLM diff hunk(s) ({len(llm_output_raw)} chars of patch)")
+                    elif temp_llm_output is not None:
+                        log_debug(f"  Full file optimization received ({len(temp_llm_output)} chars)")
                     else:
-                         print("  WARNING: LLM returned empty content after cleanup. Reverting.")
-                         temp_llm_output = staged_content # Fallback
+                        log_warning("  WARNING: LLM returned empty content after cleanup. Reverting.")
+                        temp_llm_output = staged_content # Fallback
 
+                 except PatchApplyError as e:
+                    log_error(f"  ERROR: Could not apply the LLM's diff to the file: {e}. Reverting.")
+                    temp_llm_output = staged_content # Fallback
+                 except PlaceholderMismatch as e:
+                    log_error(f"  ERROR: Comments/docstrings could not be restored in the LLM output ({e}); "
+                          f"treating it as a failed syntax check. Reverting.")
+                    temp_llm_output = staged_content # Fallback
+                 except LLMStreamAborted as e:
+                    log_warning(f"  WARNING: Stopped reading the LLM response early: {e}. Reverting.")
+                    temp_llm_output = staged_content # Fallback
                  except requests.exceptions.Timeout:
-                    print("  ERROR: API request timed out for full file. Reverting.")
+                    log_error("  ERROR: API request timed out for full file. Reverting.")
                     temp_llm_output = staged_content # Fallback
                  except requests.exceptions.RequestException as e:
-                    print(f"  ERROR: API request failed for full file: {e}. Reverting.")
+                    log_error(f"  ERROR: API request failed for full file: {e}. Reverting.")
                     temp_llm_output = staged_content # Fallback
                  except (ValueError, KeyError) as e:
-                    print(f"  ERROR: Failed to parse LLM response for full file: {e}. Reverting.")
+                    log_error(f"  ERROR: Failed to parse LLM response for full file: {e}. Reverting.")
                     temp_llm_output = staged_content # Fallback
                  except Exception as e:
                     # Catch the specific error observed if possible, otherwise general exception
                     # The original error was "local variable 'cleaned_output' referenced before assignment"
                     # which is now fixed, but keep general catch.
-                    print(f"  ERROR: Unexpected error during full file optimization: {e}. Reverting.")
+                    log_error(f"  ERROR: Unexpected error during full file optimization: {e}. Reverting.")
                     temp_llm_output = staged_content # Fallback
 
             # --- STEP 3.6: Syntax Check --- (Crucial Safety Net)
-            print("\nSTEP 3.6: Performing Syntax Check on LLM Output")
+            log_info("\nSTEP 3.6: Performing Syntax Check on LLM Output")
             syntax_is_valid = False
             # Check if LLM produced *any* output (could be None if errors occurred before assignment)
             if temp_llm_output is None or temp_llm_output == staged_content:
-                 print("  INFO: LLM output same as original or processing failed before check. Skipping syntax check.")
+                 log_debug("  INFO: LLM output same as original or processing failed before check. Skipping syntax check.")
                  # If it's the same as original, it's considered valid by definition here
                  # If it failed before, we are using original staged content
                  optimized_full_code = staged_content
@@ -1436,57 +2645,51 @@ Minor efficiency improvements unrelated to the core sustainability anti-patterns
                  if syntax_is_valid:
                      optimized_full_code = temp_llm_output # Accept LLM output
                  else:
-                     print("  Syntax check failed. REVERTING to original staged content.")
+                     log_warning("  Syntax check failed. REVERTING to original staged content.")
                      optimized_full_code = staged_content # REJECT LLM output
             else:
                  # For non-Python, assume valid for now (no check implemented)
-                 print(f"  INFO: Syntax check not implemented for language '{language_name}'. Assuming LLM output is valid.")
+                 log_debug(f"  INFO: Syntax check not implemented for language '{language_name}'. Assuming LLM output is valid.")
                  optimized_full_code = temp_llm_output # Accept LLM output
                  syntax_is_valid = True # Set true for non-python checks
 
             # Log final decision based on syntax check
             if optimized_full_code == staged_content and not should_skip_llm and temp_llm_output != staged_content:
-                 print("  Outcome: LLM changes were REVERTED due to syntax errors (or other failures).")
+                 log_info("  Outcome: LLM changes were REVERTED due to syntax errors (or other failures).")
             elif optimized_full_code != staged_content:
-                 print("  Outcome: LLM changes PASSED syntax check (or check not applicable).")
+                 log_info("  Outcome: LLM changes PASSED syntax check (or check not applicable).")
             # Else: LLM was skipped or produced identical code
+            if llm_replies_used and syntax_is_valid:
+                store_llm_replies(pending_llm_replies) # Only replies that made it into accepted output are replayed
+                for pack_reply in batch_pack_replies:
+                    pack_reply.accept(file_path)
 
 
     # --- Final Content Check ---
     # Ensure optimized_full_code is assigned (should always be either staged_content or valid LLM output by now)
     if optimized_full_code is None:
-         print("FATAL ERROR: optimized_full_code is None before final steps. Reverting to staged_content.")
+         log_error("FATAL ERROR: optimized_full_code is None before final steps. Reverting to staged_content.")
          optimized_full_code = staged_content
          if optimized_full_code is None: # If even staged_content was somehow None
-             print("FATAL ERROR: No code content available to proceed.")
+             log_error("FATAL ERROR: No code content available to proceed.")
+             annotate_span(outcome="failed")
              return False
 
-    # --- STEP 4 & 4.5: Write Final Code to Temp File & Analyze AFTER ---
-    # We need to analyze the final code that will be written, even if it's the original
-    temp_after_file = None
+    # --- STEP 4 & 4.5: Analyze Final Code AFTER ---
+    # We need to analyze the final code that will be written, even if it's the original.
+    # Unchanged content (LLM skipped/reverted) is a cache hit on the BEFORE metrics.
     metrics_after = {}
     score_after = 0
     individual_scores_after = {}
     try:
-        # Create a temporary file with the FINAL code content
-        # Use context manager for temporary file
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=os.path.splitext(file_path)[1], encoding='utf-8') as temp_f:
-            temp_f.write(optimized_full_code)
-            temp_after_file = temp_f.name
-        print(f"\nSTEP 4 & 4.5: Wrote final code to temp file for AFTER analysis: {temp_after_file}")
-
-        # Run static analysis on the final code in the temp file
-        metrics_after = get_static_metrics(temp_after_file, language_key)
+        log_info(f"\nSTEP 4 & 4.5: Static Analysis & Scoring (AFTER) on final code")
+        metrics_after = get_metrics_for_content(optimized_full_code, file_path, language_key, "after",
+                                                use_metrics_cache, python_metrics_engine)
         score_after, individual_scores_after = calculate_total_score(metrics_after, language_key)
 
     except Exception as e:
-        print(f"ERROR: Failed during AFTER static analysis: {e}")
+        log_error(f"ERROR: Failed during AFTER static analysis: {e}")
         # Metrics/score after will remain empty/zero
-    finally:
-        # Ensure cleanup of the temporary file
-        if temp_after_file and os.path.exists(temp_after_file):
-            try: os.remove(temp_after_file)
-            except OSError: print(f"Warning: Failed to remove temp file {temp_after_file}")
 
 
     # --- STEP 5: Measure Emissions AFTER ---
@@ -1499,54 +2702,378 @@ Minor efficiency improvements unrelated to the core sustainability anti-patterns
     update_needed = (optimized_full_code != staged_content)
     write_success = False
     if update_needed:
-        print("\nSTEP 6: Changes detected. Updating original file with modified code.")
+        log_info("\nSTEP 6: Changes detected. Updating original file with modified code.")
         try:
             # Write the final, validated code back to the original file path
             # Use context manager for writing
-            with open(file_path, 'w', encoding='utf-8') as output_file:
+            with span("write_file", "write", file=file_path, chars=len(optimized_full_code)), \
+                 open(file_path, 'w', encoding='utf-8') as output_file:
                 output_file.write(optimized_full_code)
-            print(f"  File successfully updated: {file_path}")
+            log_info(f"  File successfully updated: {file_path}")
             write_success = True
         except Exception as e:
-            print(f"ERROR: Failed to write updated code to {file_path}: {e}")
+            log_error(f"ERROR: Failed to write updated code to {file_path}: {e}")
             write_success = False # Failed to write the changes
     else:
-        print("\nSTEP 6: No changes applied (LLM skipped, reverted, or produced identical code). File not modified.")
+        log_info("\nSTEP 6: No changes applied (LLM skipped, reverted, or produced identical code). File not modified.")
         write_success = True # No write needed, so considered successful in terms of file state
 
     # --- STEP 7: Report Scores and Emissions Comparison ---
-    print("\n===== Sustainability Score Summary =====")
-    print(f"  Score BEFORE: {score_before:.1f}/100")
-    print(f"  Score AFTER:  {score_after:.1f}/100") # Will be same as before if no changes applied/kept
+    log_info("\n===== Sustainability Score Summary =====")
+    log_info(f"  Score BEFORE: {score_before:.1f}/100")
+    log_info(f"  Score AFTER:  {score_after:.1f}/100") # Will be same as before if no changes applied/kept
     score_diff = score_after - score_before
-    print(f"  Difference: {score_diff:+.1f} points")
+    log_info(f"  Difference: {score_diff:+.1f} points")
 
     # Report detailed metrics diff if verbose? (Optional future enhancement)
 
     if can_measure:
-        print("\n===== CO₂eq Emissions Summary (Experimental) =====")
+        log_info("\n===== CO₂eq Emissions Summary (Experimental) =====")
         if emissions_before is not None:
-            print(f"  Emissions BEFORE: {emissions_before:.9f} kg CO₂eq")
+            log_info(f"  Emissions BEFORE: {emissions_before:.9f} kg CO₂eq")
         else:
-            print("  Emissions BEFORE: Not measured or failed.")
+            log_info("  Emissions BEFORE: Not measured or failed.")
         if emissions_after is not None:
-             print(f"  Emissions AFTER:  {emissions_after:.9f} kg CO₂eq")
+             log_info(f"  Emissions AFTER:  {emissions_after:.9f} kg CO₂eq")
         else:
-             print("  Emissions AFTER:  Not measured or failed.")
+             log_info("  Emissions AFTER:  Not measured or failed.")
 
         if emissions_before is not None and emissions_after is not None:
              diff_emissions = emissions_after - emissions_before
              diff_percent = (diff_emissions / emissions_before * 100) if emissions_before != 0 else 0
-             print(f"  Difference: {diff_emissions:+.9f} kg CO₂eq ({diff_percent:+.2f}%)")
+             log_info(f"  Difference: {diff_emissions:+.9f} kg CO₂eq ({diff_percent:+.2f}%)")
         else:
-             print("  Difference: Cannot calculate emission difference.")
+             log_info("  Difference: Cannot calculate emission difference.")
 
-    print(f"\n===== Analysis Complete for {file_path} =====")
+    outcome = ("updated" if update_needed else "unchanged") if write_success else "write_failed"
+    annotate_span(outcome=outcome, score_before=round(score_before, 1), score_after=round(score_after, 1))
+    log_result(f"{file_path}: score {score_before:.1f} -> {score_after:.1f} ({score_diff:+.1f}), {outcome.replace('_', ' ')}")
+    log_info(f"\n===== Analysis Complete for {file_path} =====")
 
     # Overall success is true if we didn't encounter fatal errors AND file write (if needed) succeeded
     return write_success
 
 
+# Blocks answered by prefetch_batch_block_packs: (file path, block index) -> (block code, optimized code, BatchPackReply)
+_BATCH_BLOCK_REPLIES = {}
+
+class BatchPackReply:
+    """
+    Cache entries of one cross-file packed request. They are stored only once every file that took
+    a segment of the reply has accepted its output (see store_llm_replies).
+    """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.pending_files = set()
+
+    def accept(self, file_path):
+        self.pending_files.discard(file_path)
+        if not self.pending_files:
+            store_llm_replies(self.replies)
+
+def request_batch_block_pack(api_key, language_name, language_key, model, members, analysis_options):
+    """
+    Sends the (file path, block index, code) members as one cross-file packed request and returns
+    {(file path, block index): (code, optimized code, BatchPackReply)} for every segment that came
+    back and restores cleanly. Raises like request_llm_completion.
+    """
+    compact_comments = analysis_options.get('compact_prompts', True) and language_key == 'python'
+    system_prompt = get_llm_system_prompt(language_name, compact_comments)
+    placeholders = {} # Shared by all segments of the pack
+    segment_ids = [set() for _ in members] # Placeholders each segment must give back
+    segments_text = "\n\n".join(
+        PACKED_SEGMENT_TEMPLATE.format(id=n + 1, code=compact_code_for_prompt(code, placeholders, segment_ids[n])
+                                       if compact_comments else code)
+        for n, (_, _, code) in enumerate(members))
+    prompt = build_block_pack_prompt(language_name, language_key, segments_text, len(members), cross_file=True)
+    replies = [] # Cache entry of the reply, stored through BatchPackReply
+    use_cache = analysis_options.get('use_llm_cache', True)
+    accept = lambda text: all((n + 1) in parse_packed_segments(text) for n in range(len(members)))
+    if analysis_options.get('llm_hedge'):
+        response_text = request_llm_completion_hedged(api_key, system_prompt, prompt, LLM_PACK_RESPONSE_MAX_TOKENS, 60,
+                                                      analysis_options['llm_hedge'], accept=accept, use_cache=use_cache,
+                                                      model=model, pending_cache=replies)
+    else:
+        response_text = request_llm_completion(api_key, system_prompt, prompt, LLM_PACK_RESPONSE_MAX_TOKENS, 60,
+                                               use_cache=use_cache, model=model, pending_cache=replies)
+    segments = parse_packed_segments(response_text)
+    pack_reply = BatchPackReply(replies)
+    answered = {}
+    for n, (file_path, block_index, code) in enumerate(members):
+        if (n + 1) not in segments:
+            continue
+        try:
+            optimized = restore_python_source(segments[n + 1], placeholders, segment_ids[n])
+        except PlaceholderMismatch:
+            continue # The file sends this block itself
+        answered[(file_path, block_index)] = (code, optimized, pack_reply)
+        pack_reply.pending_files.add(file_path)
+    return answered
+
+def prefetch_batch_block_packs(file_paths, analysis_options):
+    """
+    Batch mode with --changes-only and packing (no --jobs): packs the small change blocks of
+    different files into shared multi-segment requests before the files are analyzed one by one,
+    so a commit touching many files with a hunk or two each pays for a few requests (and system
+    prompts) instead of one per file. Blocks are grouped by language and routed model; packs whose
+    blocks all come from one file are left to that file's own pass, which also re-sends any block
+    a cross-file reply missed. Returns the number of cross-file requests sent.
+    """
+    api_key = get_api_key(analysis_options.get('api_key_file', "api_key.txt"))
+    if not api_key:
+        return 0
+    diff_backend = analysis_options.get('diff_backend', 'auto')
+    use_metrics_cache = analysis_options.get('use_metrics_cache', True)
+    python_metrics_engine = analysis_options.get('python_metrics_engine', 'native')
+    llm_routing = analysis_options.get('llm_routing', DEFAULT_ROUTING)
+    candidates = {} # (language key, model) -> [(file path, block index, code)] in file and block order
+    language_names = {}
+    for file_path in file_paths:
+        language_name, language_key = detect_language(file_path, analysis_options.get('forced_language'))
+        if not language_key:
+            continue
+        content_data = get_change_data(file_path, diff_backend, language_key == 'python')
+        if not content_data or content_data.get("modified") is None:
+            continue
+        _BATCH_CHANGE_DATA[file_path] = content_data # The file's pass reuses it
+        if not content_data.get("is_modified") or not content_data.get("change_blocks"):
+            continue
+        staged_content = content_data["modified"]
+        metrics = get_metrics_for_content(staged_content, file_path, language_key, "before",
+                                          use_metrics_cache, python_metrics_engine)
+        # The file's pass scores the same content again: serve it from the batch, not the cache
+        _BATCH_METRICS[get_metrics_cache_key(staged_content, file_path, language_key,
+                                             language_key == 'python' and python_metrics_engine == 'native')] = metrics
+        score, individual_scores = calculate_total_score(metrics, language_key)
+        if decide_llm_skip(staged_content, metrics, score, language_key,
+                           analysis_options.get('llm_output_format', 'code'))[0]:
+            continue
+        language_names[language_key] = language_name
+        for block_index, block in enumerate(content_data["change_blocks"]):
+            code = '\n'.join(block['modified_lines'])
+            if not code.strip() or code.count('\n') + 1 > LLM_PACK_MAX_BLOCK_LINES:
+                continue
+            model = GROQ_MODEL
+            if llm_routing:
+                model, _ = route_llm_model(estimate_tokens(code), estimate_tokens(code), LLM_PACK_RESPONSE_MAX_TOKENS,
+                                           score, individual_scores, language_key, llm_routing)
+            candidates.setdefault((language_key, model), []).append((file_path, block_index, code))
+
+    packs = [] # (language key, model, members)
+    for (language_key, model), items in candidates.items():
+        item_packs, _ = group_blocks_into_packs({n: code for n, (_, _, code) in enumerate(items)})
+        for pack in item_packs:
+            members = [items[n] for n in pack]
+            if len({file_path for file_path, _, _ in members}) > 1:
+                packs.append((language_key, model, members))
+    if not packs:
+        return 0
+
+    file_count = len({file_path for _, _, members in packs for file_path, _, _ in members})
+    log_info(f"LLM PACKING: {sum(len(members) for _, _, members in packs)} small change block(s) of {file_count} "
+             f"file(s) in {len(packs)} cross-file request(s)")
+    worker_count = max(1, min(analysis_options.get('llm_concurrency', LLM_MAX_CONCURRENT_REQUESTS), len(packs)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = {executor.submit(request_batch_block_pack, api_key, language_names[language_key], language_key,
+                                   model, members, analysis_options): members
+                   for language_key, model, members in packs}
+        for future in concurrent.futures.as_completed(futures):
+            members = futures[future]
+            try:
+                answered = future.result()
+            except Exception as e:
+                # Not fatal: every file still sends the blocks nobody answered
+                log_warning(f"  WARNING: Cross-file packed request for {len(members)} block(s) failed ({e}); "
+                            f"their files will send them themselves.")
+                continue
+            log_debug(f"  Cross-file packed request returned {len(answered)}/{len(members)} segment(s)")
+            _BATCH_BLOCK_REPLIES.update(answered)
+    return len(packs)
+
+def take_batch_block_replies(file_path, pending_blocks):
+    """{block index: (optimized code, BatchPackReply)} for the pending blocks the batch prefetch answered."""
+    taken = {}
+    for block_index, code in pending_blocks.items():
+        entry = _BATCH_BLOCK_REPLIES.pop((file_path, block_index), None)
+        if entry is not None and entry[0] == code:
+            taken[block_index] = entry[1:]
+    return taken
+
+def init_analysis_worker(batch_metrics, http_settings, log_settings):
+    """
+    Process pool initializer: forget per-process state inherited from the parent (the cat-file
+    pipe, HTTP connections and the JSON log file must not be shared across processes) and adopt
+    the parent's batched metrics, HTTP client and log settings.
+    """
+    global _GIT_SNAPSHOT, _METRICS_CACHE, _LLM_CACHE
+    _GIT_SNAPSHOT = None
+    _METRICS_CACHE = None
+    _LLM_CACHE = None
+    configure_http_client(log=log_info, **http_settings) # Also drops the inherited client
+    get_event_log().configure_worker(**log_settings)
+    _BATCH_METRICS.update(batch_metrics)
+    get_tracer().drain() # Spans inherited from the parent are reported by the parent
+
+def analyze_file_buffered(file_path, analysis_options):
+    """
+    Worker task for --jobs: analyzes one file with stdout/stderr captured, so the parent can
+    print each file's log as one block. Returns (success, log_text, trace events, event log records,
+    run counters), the counters being this file's share of the totals in the run summary.
+    """
+    log_buffer = io.StringIO()
+    with contextlib.redirect_stdout(log_buffer), contextlib.redirect_stderr(log_buffer), \
+         get_event_log().file_context(file_path):
+        try:
+            success = analyze_and_update_code_for_sustainability(file_path, **analysis_options)
+        except Exception as file_e:
+            import traceback
+            log_error(f"\nFATAL ERROR during analysis of {file_path}: {file_e}")
+            log_error(traceback.format_exc().rstrip())
+            success = False
+    counters = {'hedge': _HEDGE_STATS.drain()}
+    # Caches and the HTTP client this worker actually used (never created just to report zeros)
+    for name, counted in (('metrics_cache', _METRICS_CACHE), ('llm_cache', _LLM_CACHE),
+                          ('http', get_http_client(create=False))):
+        if counted:
+            counters[name] = counted.drain()
+    return bool(success), log_buffer.getvalue(), get_tracer().drain(), get_event_log().drain_records(), counters
+
+def add_worker_counters(counters):
+    """Adds a worker's counters (see analyze_file_buffered) to this process's run summary totals."""
+    _HEDGE_STATS.add(counters['hedge'])
+    for name, get_counted in (('metrics_cache', get_metrics_cache), ('llm_cache', get_llm_cache),
+                              ('http', get_http_client)):
+        counted = get_counted() if name in counters else None
+        if counted:
+            counted.add(counters[name])
+
+def analyze_files_in_parallel(file_paths, jobs, analysis_options, http_settings=None):
+    """
+    Fans the files out over a pool of `jobs` worker processes (one file per task). Each file's
+    output is buffered in its worker and printed as a block, in input order, as soon as it and
+    every file before it have finished. Returns a dict mapping each file path to its success flag.
+    A request budget in http_settings is split evenly between the workers.
+    """
+    results = {}
+    total = len(file_paths)
+    event_log = get_event_log()
+    log_info(f"Analyzing {total} file(s) with {jobs} parallel worker(s)...")
+    event_log.flush() # Forked workers must not inherit (and later re-flush) buffered output
+    worker_http_settings = dict(http_settings or {})
+    if worker_http_settings.get('request_budget'):
+        # Each worker process has its own client, so each gets its share of the run's budget
+        worker_http_settings['request_budget'] = max(1, worker_http_settings['request_budget'] // jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_analysis_worker,
+                                                initargs=(dict(_BATCH_METRICS), worker_http_settings,
+                                                          event_log.worker_settings())) as executor:
+        futures = [executor.submit(analyze_file_buffered, file_path, analysis_options) for file_path in file_paths]
+        for index, (file_path, future) in enumerate(zip(file_paths, futures), start=1):
+            try:
+                success, log_text, trace_events, log_records, counters = future.result()
+                get_tracer().add_events(trace_events)
+                event_log.add_records(log_records)
+                add_worker_counters(counters)
+            except Exception as worker_e:
+                # A crashed worker (e.g. killed by the OS) fails its file, never the whole run silently
+                success, log_text = False, f"\nFATAL ERROR: Worker for {file_path} failed: {worker_e}\n"
+            log_info(f"\n--- [{index}/{total}] Analyzing: {file_path} ---")
+            sys.stdout.write(log_text)
+            event_log.flush()
+            results[file_path] = success
+    return results
+
+def analyze_files_for_sustainability(file_paths, jobs=1, llm_request_budget=LLM_REQUEST_BUDGET, trace_path=None,
+                                     **analysis_options):
+    """
+    Batch mode: runs analyze_and_update_code_for_sustainability for every path in one process,
+    so imports, tool lookups, the API key and HTTP connections are shared between files.
+    With jobs > 1 the files are spread over a process pool instead (see analyze_files_in_parallel).
+    llm_request_budget caps the LLM API requests of the whole run (0 = unlimited).
+    Per-stage timings are printed at the end; trace_path also writes every span as a Chrome trace.
+    Console output goes through the event log (see event_log.py), which is flushed after every file.
+    Returns a dict mapping each file path to its success flag (in input order).
+    """
+    results = {}
+    total = len(file_paths)
+    jobs = max(1, min(jobs, total))
+    http_settings = {'request_budget': llm_request_budget or None}
+    configure_http_client(log=log_info, **http_settings)
+    event_log = get_event_log()
+    if not analysis_options.get('full_file_mode') and jobs == 1:
+        snapshot = get_git_snapshot()
+        if snapshot and total > 1:
+            # Pull every staged/HEAD blob of the batch through the cat-file pipe in one round trip
+            log_debug(f"GIT CONTENT: Prefetched {snapshot.prefetch(file_paths)} blob(s) for {total} file(s)")
+    if total > 1:
+        try:
+            # One lizard/cloc/radon run for the whole batch instead of one per file
+            precompute_batch_metrics(
+                file_paths,
+                full_file_mode=analysis_options.get('full_file_mode', False),
+                forced_language=analysis_options.get('forced_language'),
+                use_metrics_cache=analysis_options.get('use_metrics_cache', True),
+                python_metrics_engine=analysis_options.get('python_metrics_engine', 'native'),
+            )
+        except Exception as e:
+            log_warning(f"  WARNING: Batched static analysis failed ({e}). Files will be measured one by one.")
+    if jobs > 1:
+        results = analyze_files_in_parallel(file_paths, jobs, analysis_options, http_settings)
+    else:
+        if (total > 1 and analysis_options.get('changes_only') and not analysis_options.get('full_file_mode')
+                and analysis_options.get('pack_llm_blocks', True) and not analysis_options.get('skip_llm_flag')):
+            try:
+                prefetch_batch_block_packs(file_paths, analysis_options)
+            except Exception as e:
+                log_warning(f"  WARNING: Cross-file block packing failed ({e}). Files will send their blocks themselves.")
+        for index, file_path in enumerate(file_paths, start=1):
+            log_info(f"\n--- [{index}/{total}] Analyzing: {file_path} ---")
+            try:
+                with event_log.file_context(file_path):
+                    results[file_path] = analyze_and_update_code_for_sustainability(file_path, **analysis_options)
+            except Exception as file_e:
+                # One broken file must not stop the rest of the batch
+                import traceback
+                log_error(f"\nFATAL ERROR during analysis of {file_path}: {file_e}")
+                log_error(traceback.format_exc().rstrip())
+                results[file_path] = False
+            event_log.flush()
+
+    failed_count = sum(1 for success in results.values() if not success)
+    event_log.record('run', outcome='failed' if failed_count else 'ok', files=total, failed=failed_count, jobs=jobs)
+    if total > 1:
+        log_result("\n===== Batch Summary =====")
+        for file_path, success in results.items():
+            log_info(f"  {'✅' if success else '❌'} {file_path}")
+        log_result(f"  {total - failed_count}/{total} file(s) processed successfully")
+    metrics_cache = get_metrics_cache() if analysis_options.get('use_metrics_cache', True) else None
+    if metrics_cache:
+        log_info(f"\n  Metrics cache: {metrics_cache.stats_line()}")
+    llm_cache = get_llm_cache() if analysis_options.get('use_llm_cache', True) else None
+    if llm_cache and (llm_cache.hits or llm_cache.misses):
+        log_info(f"  LLM response cache: {llm_cache.stats_line()}")
+    http_client = get_http_client(create=False) # No client means no request (and requests never imported)
+    if http_client and (http_client.requests_sent or http_client.budget_rejections):
+        log_info(f"  LLM API: {http_client.stats_line()}")
+    if analysis_options.get('llm_hedge') and _HEDGE_STATS.requests:
+        log_info(f"  LLM hedging: {_HEDGE_STATS.stats_line()}")
+    close_git_snapshot()
+    tracer = get_tracer()
+    summary_lines = tracer.summary_lines()
+    if summary_lines:
+        log_info("\n===== Stage Timings (nested stages overlap, e.g. tool within metrics) =====")
+        for line in summary_lines:
+            log_info(f"  {line}")
+    if trace_path:
+        try:
+            event_count = tracer.write_chrome_trace(trace_path)
+            log_info(f"  Trace: {event_count} span(s) written to {trace_path} (open in chrome://tracing or ui.perfetto.dev)")
+        except OSError as e:
+            log_warning(f"  WARNING: Could not write trace file {trace_path}: {e}")
+    event_log.flush()
+    return results
+
+
 # --- Main Execution Block ---
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -1554,9 +3081,20 @@ if __name__ == "__main__":
                     "perform syntax checks, measure emissions (Python), and update the file.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
-    parser.add_argument("file_path", help="Path to the code file to analyze and potentially update.")
+    parser.add_argument("file_paths", nargs="*", metavar="file_path",
+                        help="Path(s) to the code file(s) to analyze and potentially update. All files run in one process.")
+    parser.add_argument("--staged", action="store_true",
+                        help="Analyze every staged file with a supported extension (read via 'git diff --cached --name-only -z').")
     parser.add_argument("--api_key_file", default="api_key.txt", help="Path to file containing Groq API key.")
-    parser.add_argument("--verbose", "-v", action="store_true", help="Enable detailed logging (currently always on).") # Note: Verbose flag doesn't suppress output currently
+    verbosity_group = parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument("--verbose", "-v", action="store_true",
+                                 help="Log every step in detail (git, diff, tools, metrics, LLM requests).")
+    verbosity_group.add_argument("--quiet", "-q", action="store_true",
+                                 help="Only log one result line per file, warnings, errors and the run totals "
+                                      "(what the pre-commit hook uses).")
+    parser.add_argument("--log-json", metavar="FILE",
+                        help="Append every log message plus one record per pipeline stage and file (file, stage, "
+                             "duration, outcome, scores) to FILE as JSON lines.")
     parser.add_argument("--changes-only", "-c", action="store_true",
                         help="LLM analyzes only staged changes (vs HEAD) if using Git mode. Ignored if --full-file-mode.")
     parser.add_argument("--language", "-l", help="Force specific language (e.g., 'Python', 'JavaScript'). Overrides automatic detection.")
@@ -1570,6 +3108,58 @@ if __name__ == "__main__":
     parser.add_argument("--full-file-mode", action="store_true",
                         help="Read file directly from disk (skip Git diff/show). Useful for running outside a Git repo or on arbitrary files.")
     parser.add_argument("--check-tools", action="store_true", help="Check for required external analysis tools and exit.")
+    parser.add_argument("--no-metrics-cache", action="store_true",
+                        help="Always rerun lizard/cloc/radon instead of reusing cached metrics from .git/green_code_cache.")
+    parser.add_argument("--no-llm-cache", action="store_true",
+                        help="Always call the Groq API instead of reusing cached responses from .git/green_code_cache/llm_responses.")
+    parser.add_argument("--no-prompt-compaction", action="store_true",
+                        help="Send Python comments and docstrings to the LLM verbatim instead of as placeholders "
+                             "that are restored in its reply.")
+    parser.add_argument("--no-llm-pack", action="store_true",
+                        help="In --changes-only mode, send every change block as its own LLM request instead of "
+                             "packing small blocks into shared multi-segment requests (across files too, "
+                             "when several files are analyzed without --jobs).")
+    parser.add_argument("--no-llm-stream", action="store_true",
+                        help="Wait for complete full-file LLM responses instead of streaming them "
+                             "(streaming stops early on runaway or prose output).")
+    parser.add_argument("--llm-output", choices=LLM_OUTPUT_FORMATS, default="code",
+                        help="Full-file LLM reply format: code (the whole optimized file) or diff (unified-diff hunks "
+                             f"applied with fuzzy context matching; cheaper for large files, LOC limit {LLM_DIFF_LOC_LIMIT}).")
+    parser.add_argument("--llm-routing", metavar="FILE",
+                        help="JSON model routing table (default_model, long_context_model, context_tokens, rules) "
+                             "replacing the built-in one, which sends small or high-scoring code to the fastest model, "
+                             "complex low-scoring code to a larger one and oversized prompts to a long-context model.")
+    parser.add_argument("--no-llm-routing", action="store_true",
+                        help=f"Send every LLM request to {GROQ_MODEL} instead of routing by code size, score and language.")
+    parser.add_argument("--llm-hedge-model", metavar="MODEL",
+                        help="Hedge slow LLM requests: once a request runs longer than the model's observed "
+                             f"p{LLM_HEDGE_PERCENTILE} latency, send it to MODEL as well and keep the first valid reply.")
+    parser.add_argument("--llm-hedge-url", default=GROQ_CHAT_COMPLETIONS_URL,
+                        help="OpenAI-compatible chat completions URL for --llm-hedge-model "
+                             "(e.g. a local llama.cpp or ollama server at http://localhost:11434/v1/chat/completions).")
+    parser.add_argument("--llm-hedge-api-key-env", metavar="VAR",
+                        help="Environment variable holding the API key for --llm-hedge-url (default: the Groq key for Groq, none elsewhere).")
+    parser.add_argument("--llm-hedge-delay", type=float, default=0,
+                        help=f"Seconds before hedging (0 = the observed p{LLM_HEDGE_PERCENTILE} latency, "
+                             f"{LLM_HEDGE_DEFAULT_DELAY:.0f}s until {LLM_HEDGE_MIN_SAMPLES} requests have been timed).")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write timing spans (git, diff, tools, metrics, score, LLM requests with token counts, "
+                             "syntax check, emissions, file write) to FILE in Chrome trace-event JSON format.")
+    parser.add_argument("--python-metrics-engine", choices=PYTHON_METRICS_ENGINES, default="native",
+                        help="Python metrics source: native (in-process token scan) or tools (lizard, cloc, radon). "
+                             "The tools are also used automatically if the native engine can't parse a file.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Analyze up to N files in parallel worker processes (0 = one per CPU). "
+                             "Each file's output is printed as one block, in input order.")
+    parser.add_argument("--llm-concurrency", type=int, default=LLM_MAX_CONCURRENT_REQUESTS,
+                        help="Maximum number of change-block LLM requests in flight at once in --changes-only mode "
+                             "(1 = sequential). Keep it within your Groq rate limits.")
+    parser.add_argument("--llm-request-budget", type=int, default=LLM_REQUEST_BUDGET,
+                        help="Maximum number of LLM API requests for the whole run, retries included (0 = unlimited). "
+                             "Files analyzed after the budget is used up keep their staged content.")
+    parser.add_argument("--diff-backend", choices=DIFF_BACKENDS, default="auto",
+                        help="Line diff engine for staged vs HEAD: difflib (original), patience (near-linear), "
+                             "git (reuse 'git diff --cached -U0' hunks) or auto (difflib for small files, patience for large).")
 
     args = parser.parse_args()
 
@@ -1579,12 +3169,12 @@ if __name__ == "__main__":
         # Specify which tools are core requirements vs optional/language-specific
         tools = {
             # Core for metrics:
-            "lizard": ("pip install lizard", True, "Complexity, function length"),
-            "cloc": ("sudo apt install cloc / brew install cloc / choco install cloc / etc.", True, "Line counts (code, comment, blank)"),
+            "lizard": ("pip install lizard", True, "Complexity, function length (Python uses the built-in engine by default)"),
+            "cloc": ("sudo apt install cloc / brew install cloc / choco install cloc / etc.", True, "Line counts (code, comment, blank) (Python: built-in engine by default)"),
             # Core for non-full-file mode:
             "git": ("Install Git SCM from https://git-scm.com/", True, "Comparing staged vs HEAD, retrieving content"),
             # Language-specific optional:
-            "radon": ("pip install radon", False, "Python Logical LOC (for density score)"),
+            "radon": ("pip install radon", False, "Python Logical LOC (only with --python-metrics-engine tools)"),
             # Add others like eslint, cppcheck here if implemented later
         }
         all_required_found = True
@@ -1592,7 +3182,7 @@ if __name__ == "__main__":
         print("-" * 40)
         for tool, (install_cmd, required, purpose) in tools.items():
             req_str = "Required" if required else "Optional"
-            status = "Found" if shutil.which(tool) else "NOT FOUND"
+            status = "Found" if find_tool(tool) else "NOT FOUND"
             print(f"  - {tool:<10} ({req_str:<8}): {status:<10} | Purpose: {purpose}")
             if status == "NOT FOUND":
                 print(f"      Install/Setup: {install_cmd}")
@@ -1607,7 +3197,7 @@ if __name__ == "__main__":
              print("\nAll required tools found.")
              # Check CodeCarbon only if requested, as it's internal
              if args.measure_emissions:
-                 if CODECARBON_AVAILABLE:
+                 if codecarbon_available():
                      print("  - codecarbon (Python library): Found (for --measure-emissions)")
                  else:
                      print("  - codecarbon (Python library): NOT FOUND (Install: pip install codecarbon)")
@@ -1636,14 +3226,14 @@ if __name__ == "__main__":
         sys.exit(0)
 
     # --- Verbosity Handling ---
-    # Currently, output is always printed. The --verbose flag is kept for potential future use
-    # (e.g., suppressing non-error messages).
-    if args.verbose:
-        print("Verbose mode enabled (currently default).")
-        pass # Explicitly do nothing extra for now
+    verbosity = 'verbose' if args.verbose else 'quiet' if args.quiet else 'normal'
+    try:
+        get_event_log().configure(level=VERBOSITY_LEVELS[verbosity], json_path=args.log_json)
+    except OSError as e:
+        parser.error(f"could not open --log-json file: {e}")
 
     # --- Check CodeCarbon Availability if Emission Measurement Requested ---
-    if args.measure_emissions and not CODECARBON_AVAILABLE:
+    if args.measure_emissions and not codecarbon_available():
         print("\n" + "="*20 + " CONFIGURATION WARNING " + "="*20, file=sys.stderr)
         print("WARNING: --measure-emissions flag was used, but the 'codecarbon' Python library could not be imported.", file=sys.stderr)
         print("Emission measurement steps will be skipped.", file=sys.stderr)
@@ -1652,36 +3242,76 @@ if __name__ == "__main__":
         print("="*61, file=sys.stderr)
         # Continue execution without measurement capability
 
+    # --- Collect Files To Analyze ---
+    file_paths = list(args.file_paths)
+    if args.staged:
+        staged_paths = get_staged_file_paths()
+        if staged_paths is None:
+            print("\n❌ Could not determine staged files.", file=sys.stderr)
+            sys.exit(1)
+        file_paths.extend(path for path in staged_paths if path not in file_paths)
+    if not file_paths:
+        if args.staged:
+            log_info("No staged files matching supported extensions found to analyze.")
+            sys.exit(0)
+        parser.error("at least one file_path is required (or use --staged)")
+
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 (one per CPU) or a positive number")
+    llm_routing = None if args.no_llm_routing else DEFAULT_ROUTING
+    if args.llm_routing and not args.no_llm_routing:
+        try:
+            llm_routing = load_routing_config(args.llm_routing)
+        except (OSError, ValueError) as e:
+            parser.error(f"could not load --llm-routing: {e}")
+    llm_hedge = None
+    if args.llm_hedge_model:
+        llm_hedge = {
+            'model': args.llm_hedge_model,
+            'url': args.llm_hedge_url,
+            # The Groq key is only reused for Groq itself, never sent to another endpoint
+            'api_key': (os.getenv(args.llm_hedge_api_key_env, "") if args.llm_hedge_api_key_env
+                        else None if args.llm_hedge_url == GROQ_CHAT_COMPLETIONS_URL else ""),
+            'delay': max(0.0, args.llm_hedge_delay),
+        }
+    jobs = args.jobs or os.cpu_count() or 1
+
     # --- Run Main Analysis ---
-    overall_success = False
-    try:
-        # Call the main function, passing all relevant arguments
-        overall_success = analyze_and_update_code_for_sustainability(
-            file_path=args.file_path,
-            api_key_file=args.api_key_file,
-            changes_only=args.changes_only,
-            forced_language=args.language,
-            measure_emissions=args.measure_emissions,
-            execution_timeout=args.execution_timeout,
-            skip_llm_flag=args.skip_llm,
-            full_file_mode=args.full_file_mode
-        )
-    except Exception as main_e:
-         # Catch any unexpected errors during the main workflow
-         import traceback
-         print(f"\nFATAL ERROR during analysis of {args.file_path}: {main_e}", file=sys.stderr)
-         print("Traceback:", file=sys.stderr)
-         traceback.print_exc(file=sys.stderr)
-         overall_success = False # Ensure failure state
-    finally:
-        # Any final cleanup if needed (though temp files handled in function)
-        pass
+    results = analyze_files_for_sustainability(
+        file_paths,
+        jobs=jobs,
+        llm_request_budget=max(0, args.llm_request_budget),
+        trace_path=args.trace,
+        api_key_file=args.api_key_file,
+        changes_only=args.changes_only,
+        forced_language=args.language,
+        measure_emissions=args.measure_emissions,
+        execution_timeout=args.execution_timeout,
+        skip_llm_flag=args.skip_llm,
+        full_file_mode=args.full_file_mode,
+        diff_backend=args.diff_backend,
+        use_metrics_cache=not args.no_metrics_cache,
+        python_metrics_engine=args.python_metrics_engine,
+        llm_concurrency=max(1, args.llm_concurrency),
+        use_llm_cache=not args.no_llm_cache,
+        stream_llm=not args.no_llm_stream,
+        llm_output_format=args.llm_output,
+        pack_llm_blocks=not args.no_llm_pack,
+        compact_prompts=not args.no_prompt_compaction,
+        llm_routing=llm_routing,
+        llm_hedge=llm_hedge
+    )
 
     # --- Final Status and Exit Code ---
-    if overall_success:
-        # Use print directly to ensure it goes to original stdout/stderr if redirection was attempted
-        print(f"\n✅ Successfully processed: {args.file_path}")
+    failed_paths = [path for path, success in results.items() if not success]
+    if not failed_paths:
+        for path in results:
+            log_info(f"\n✅ Successfully processed: {path}")
+        get_event_log().close()
         sys.exit(0)
     else:
-        print(f"\n❌ Processing failed or changes could not be applied for: {args.file_path}", file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        get_event_log().flush() # Keep the buffered log ahead of the stderr lines
+        for path in failed_paths:
+            print(f"\n❌ Processing failed or changes could not be applied for: {path}", file=sys.stderr)
+        get_event_log().close()
+        sys.exit(1)
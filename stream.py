@@ -1,7 +1,9 @@
 import os
 import re
 import streamlit as st
-import requests
+from green_code_analyzer.http_client import get_http_client, read_chat_completion_stream
+from green_code_analyzer.model_routing import route_llm_model
+from green_code_analyzer.chunk_utils import estimate_tokens
 from dotenv import load_dotenv
 import tempfile
 
@@ -13,6 +15,9 @@ st.set_page_config(
 # Load environment variables
 load_dotenv()
 
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1").rstrip('/') # Overridable for offline runs against benchmarks/mock_llm_server.py
+AUTO_MODEL = "Auto (route by file size)" # Sidebar choice that lets route_llm_model pick the model
+
 # Page config
 
 # App title and description
@@ -38,7 +43,9 @@ with st.sidebar:
     # Model selection
     model = st.selectbox(
         "Select Model",
-        ["llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768"]
+        ["llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768", AUTO_MODEL],
+        help="Auto picks a model per file from its size: small files go to the fastest model, "
+             "files too large for an 8k context to the long-context one."
     )
     
     # Temperature setting
@@ -78,48 +85,55 @@ def analyze_code_for_sustainability(code_content, filename):
     Please provide ONLY the revised code without any explanations or comments. The output should be in a format ready to directly replace the original code file.
     """
     
-    # Progress bar and status
-    progress_bar = st.progress(0)
+    # Status line and live view of the response as it streams in
     status_text = st.empty()
+    live_output = st.empty()
+    
+    def show_tokens(delta, text_so_far):
+        status_text.text(f"Receiving sustainable version... ({len(text_so_far)} chars)")
+        live_output.code(text_so_far, language="python")
+    
+    request_model = model
+    if request_model == AUTO_MODEL:
+        # No scores here: routed by size only, with the reply assumed to be about as long as the code
+        request_model, _ = route_llm_model(estimate_tokens(prompt), estimate_tokens(code_content), estimate_tokens(code_content))
     
     try:
         # Update status
         status_text.text("Sending code to Groq for sustainability analysis...")
-        progress_bar.progress(30)
         
         # Send request to Groq API
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
+        # Shared pooled client: keep-alive connections, retries with backoff, rate-limit headers
+        response = get_http_client().post(
+            f"{GROQ_BASE_URL}/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
             },
             json={
-                "model": model,
+                "model": request_model,
                 "messages": [
                     {"role": "system", "content": "You are a sustainable coding expert that optimizes code to reduce environmental impact."},
                     {"role": "user", "content": prompt}
                 ],
-                "temperature": temperature
-            }
+                "temperature": temperature,
+                "stream": True
+            },
+            stream=True
         )
         
-        progress_bar.progress(70)
-        
         # Check for errors
         if response.status_code != 200:
             st.error(f"Error from Groq API: {response.text}")
             return None
         
-        # Extract the response
-        sustainable_code = response.json()["choices"][0]["message"]["content"]
+        # Extract the response, showing tokens as they arrive
+        sustainable_code = read_chat_completion_stream(response, on_delta=show_tokens)
         
         # Remove Markdown code block markers
         sustainable_code = re.sub(r'```python\s*', '', sustainable_code)
         sustainable_code = re.sub(r'```\s*', '', sustainable_code)
         
-        # Update progress
-        progress_bar.progress(100)
         status_text.text("Analysis complete!")
         
         # Add to history
@@ -136,8 +150,8 @@ def analyze_code_for_sustainability(code_content, filename):
         return None
     finally:
         # Clean up progress indicators
-        progress_bar.empty()
         status_text.empty()
+        live_output.empty()
 
 # Main interface - tabs for different input methods
 tab1, tab2 = st.tabs(["Upload File", "Paste Code"])
@@ -3,7 +3,9 @@ import re
 import sys
 import json
 import streamlit as st
-import requests
+from green_code_analyzer.http_client import get_http_client, read_chat_completion_stream
+from green_code_analyzer.model_routing import route_llm_model
+from green_code_analyzer.chunk_utils import estimate_tokens
 from dotenv import load_dotenv
 import tempfile
 import argparse
@@ -11,6 +13,9 @@ import argparse
 # Load environment variables
 load_dotenv()
 
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1").rstrip('/') # Overridable for offline runs against benchmarks/mock_llm_server.py
+AUTO_MODEL = "Auto (route by file size)" # Sidebar choice that lets route_llm_model pick the model
+
 def analyze_code_for_sustainability(code_content, filename, api_key=None, model=None, temperature=None, is_cli=False):
     """
     Analyze code using Groq API for sustainability improvements
@@ -59,36 +64,45 @@ def analyze_code_for_sustainability(code_content, filename, api_key=None, model=
     The output should be in a format ready to directly replace the original code file.
     """
     
+    show_tokens = None
     if not is_cli:
-        # Progress bar and status (only in Streamlit UI)
-        progress_bar = st.progress(0)
+        # Status line and live view of the response as it streams in (only in Streamlit UI)
         status_text = st.empty()
+        live_output = st.empty()
         status_text.text("Sending code to Groq for sustainability analysis...")
-        progress_bar.progress(30)
+        
+        def show_tokens(delta, text_so_far):
+            status_text.text(f"Receiving sustainable version... ({len(text_so_far)} chars)")
+            live_output.code(text_so_far, language="python")
     else:
         print("Analyzing code for sustainability...")
     
+    request_model = model
+    if request_model == AUTO_MODEL:
+        # No scores here: routed by size only, with the reply assumed to be about as long as the code
+        request_model, _ = route_llm_model(estimate_tokens(prompt), estimate_tokens(code_content), estimate_tokens(code_content))
+    
     try:
         # Send request to Groq API
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
+        # Shared pooled client: keep-alive connections, retries with backoff, rate-limit headers
+        response = get_http_client().post(
+            f"{GROQ_BASE_URL}/chat/completions",
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json"
             },
             json={
-                "model": model,
+                "model": request_model,
                 "messages": [
                     {"role": "system", "content": "You are a sustainable coding expert that optimizes code to reduce environmental impact."},
                     {"role": "user", "content": prompt}
                 ],
-                "temperature": temperature
-            }
+                "temperature": temperature,
+                "stream": True
+            },
+            stream=True
         )
         
-        if not is_cli:
-            progress_bar.progress(70)
-        
         # Check for errors
         if response.status_code != 200:
             error_message = f"Error from Groq API: {response.text}"
@@ -98,8 +112,8 @@ def analyze_code_for_sustainability(code_content, filename, api_key=None, model=
                 st.error(error_message)
             return None, False
         
-        # Extract the response
-        response_content = response.json()["choices"][0]["message"]["content"]
+        # Extract the response (shown token by token in the Streamlit UI)
+        response_content = read_chat_completion_stream(response, on_delta=show_tokens)
         
         # Try to extract JSON sustainability assessment
         is_sustainable = False
@@ -119,8 +133,7 @@ def analyze_code_for_sustainability(code_content, filename, api_key=None, model=
         sustainable_code = sustainable_code.strip()
         
         if not is_cli:
-            # Update progress (only in Streamlit UI)
-            progress_bar.progress(100)
+            # Update status (only in Streamlit UI)
             status_text.text("Analysis complete!")
             
             # Add to history
@@ -147,8 +160,8 @@ def analyze_code_for_sustainability(code_content, filename, api_key=None, model=
     finally:
         if not is_cli:
             # Clean up progress indicators (only in Streamlit UI)
-            progress_bar.empty()
             status_text.empty()
+            live_output.empty()
 
 def save_optimized_code(original_file_path, sustainable_code):
     """Save the optimized code to a file"""
@@ -192,7 +205,9 @@ def run_streamlit_app():
         # Model selection
         model = st.selectbox(
             "Select Model",
-            ["llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768"]
+            ["llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768", AUTO_MODEL],
+            help="Auto picks a model per file from its size: small files go to the fastest model, "
+                 "files too large for an 8k context to the long-context one."
         )
         
         # Temperature setting